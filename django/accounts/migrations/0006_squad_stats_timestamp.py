@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-19 13:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_alter_squadmembership_position_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='squad',
+            name='stats_timestamp',
+            field=models.PositiveBigIntegerField(blank=True, null=True, verbose_name='Stats refreshed'),
+        ),
+    ]
@@ -5,6 +5,7 @@ import pathlib
 import urllib.request
 import uuid
 
+from stats import timing
 from stats.updater import queue_update_task
 from url_forward import get_redirect_url_to
 
@@ -243,7 +244,8 @@ class Account(AbstractUser):
                     session_ended = False
                     break
             if session_ended:
-                last_session.close()
+                with timing.stage('close_session'):
+                    last_session.close()
 
 
 class Squad(models.Model):
@@ -268,6 +270,15 @@ class Squad(models.Model):
         max_length = 40,
         default = '',
     )
+    stats_timestamp = models.PositiveBigIntegerField(
+        null = True,
+        blank = True,
+        verbose_name = 'Stats refreshed',
+    )
+
+    @property
+    def stats_datetime(self):
+        return None if self.stats_timestamp is None else datetime.datetime.fromtimestamp(self.stats_timestamp)
 
     def __str__(self):
         return self.name
@@ -293,13 +304,28 @@ class Squad(models.Model):
     def absolute_url(self, request):
         return request.build_absolute_uri(self.url)
 
+    @property
+    def accounted_sessions(self):
+        """
+        Return the sessions of the squad which are accounted for the computation of the performance within the last 30
+        days (all sessions started and ended within the last 30 days).
+        """
+        return self.sessions.filter(
+            is_closed = True,  # Exclude matches from sessions that did not end yet
+            started_ts__gte = datetime.datetime.timestamp(
+                datetime.datetime.now()
+            ) - 30 * 24 * 60 * 60,  # Filter matches which started 30 days ago or earlier
+        )
+
     @property
     def last_session(self):
         from stats.models import GamingSession
-        sessions = GamingSession.objects.filter(squad = self)
-        if len(sessions) == 0:
-            return None
-        return sessions.latest('matches__timestamp')
+        return GamingSession.objects.filter(
+            squad = self,
+        ).order_by(
+            models.F('ended_ts').desc(nulls_last = True),
+            '-pk',
+        ).first()
 
     def handle_new_match(self, pmatch):
         from stats.models import GamingSession
@@ -311,11 +337,10 @@ class Squad(models.Model):
             last_session = GamingSession.objects.create(squad = self)
         else:
             log.info(f'Assigning match {pmatch.pk} to current gaming session')
-        if last_session.matches.exists() and pmatch.timestamp < last_session.ended:
+        if last_session.match_count > 0 and pmatch.timestamp < last_session.ended:
             log.info(f'Not assigning match {pmatch.pk} to any gaming session (it was in the past)')
             return
         pmatch.sessions.add(last_session)
-        pmatch.save()
 
     @property
     def accounts(self):
@@ -357,6 +382,8 @@ class Squad(models.Model):
         """
         Update the stats, trends, and leaderboard positions of the squad members.
         """
+        from stats.models import AccountedParticipation
+        AccountedParticipation.refresh(self)
         for m in self.memberships.all():
             m.update_stats()
 
@@ -458,37 +485,28 @@ class SquadMembership(models.Model):
         """
         Return the match participations of the squad member for the computation of their performance within the last 30
         days (all match participations corresponding to sessions started and ended within the last 30 days).
+
+        The accounted match participations are materialized when the stats of the squad are updated (see
+        :class:`stats.models.AccountedParticipation`).
         """
-        sessions = self.squad.sessions.filter(
-            is_closed = True,  # Exclude matches from sessions that did not end yet
-        ).annotate(
-            timestamp = models.Min('matches__timestamp'),
-        ).filter(
-            timestamp__gte = datetime.datetime.timestamp(
-                datetime.datetime.now()
-            ) - 30 * 24 * 60 * 60,  # Filter matches which started 30 days ago or earlier
-        )
-        return self.squad.match_participations(
-            pmatch__sessions__in = sessions,
-        )
+        from stats.models import MatchParticipation
+        return MatchParticipation.objects.filter(accounted_participations__squad = self.squad)
 
     def update_stats(self):
         """
         Update the stats and trends of the squad member based on their performance within the last 30 days.
         """
-        from stats.features import (
-            FeatureContext,
-            Features,
-        )
+        from stats.features import Features
+        from stats.models import RollingAggregate
 
         # Store the current stats for later comparison
         previous_stats = dict(self.stats)
 
-        # Update the stats
-        ctx = FeatureContext(self.accounted_match_participations, self.player)
+        # Update the stats (from the running aggregates of the sessions within the last 30 days)
+        rolling_aggregate = RollingAggregate.update(self)
         self.stats.clear()
         for feature in Features.all:
-            self.stats[feature.slug] = feature(ctx)
+            self.stats[feature.slug] = feature.aggregate(rolling_aggregate.partials.get(feature.slug))
 
         # Prune dangling trends from old versions of the feature set
         for feature in list(self.trends.keys()):
@@ -519,18 +537,22 @@ class SquadMembership(models.Model):
     def squad_buddy_performances(self):
         """
         Returns the player value with and without other squad members.
+
+        The co-play stats are read from the running aggregates, as they were last updated along with the stats (see
+        :meth:`update_stats`), so that reading them never writes to the database.
         """
-        from stats.features import (
-            FeatureContext,
-            Features,
-        )
+        from stats.features import Features
+        from stats.models import RollingAggregate
+
+        # Read the co-play stats from the running aggregates of the sessions within the last 30 days
+        rolling_aggregate = RollingAggregate.objects.filter(membership = self).first()
+        if rolling_aggregate is None:
+            return dict()
         buddy_performances = dict()
-        for buddy_membership in self.squad.memberships.exclude(pk = self.pk):
-            buddy_matches = buddy_membership.player.matches()
-            participations_with_buddy = self.accounted_match_participations.filter(pmatch__in = buddy_matches)
-            participations_without_buddy = self.accounted_match_participations.exclude(pmatch__in = buddy_matches)
-            pv_with_buddy = Features.player_value(FeatureContext(participations_with_buddy, self.player))
-            pv_without_buddy = Features.player_value(FeatureContext(participations_without_buddy, self.player))
+        for buddy_membership in self.squad.memberships.exclude(pk = self.pk).select_related('player'):
+            buddy_partials = rolling_aggregate.buddies.get(buddy_membership.player.pk, dict())
+            pv_with_buddy = Features.player_value.aggregate(buddy_partials.get('with'))
+            pv_without_buddy = Features.player_value.aggregate(buddy_partials.get('without'))
             if pv_with_buddy is not None and pv_without_buddy is not None:
                 buddy_performances[buddy_membership.player] = pv_with_buddy / pv_without_buddy
         return buddy_performances
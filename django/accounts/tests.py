@@ -43,7 +43,6 @@ def _mark_task_as_completed(task, duration = datetime.timedelta(minutes = 2)):
     task.save()
 
 
-@patch('stats.updater.update_event.set', return_value = None)
 class Account__update_matches(TestCase):
 
     @testsuite.fake_api.patch
@@ -51,7 +50,7 @@ class Account__update_matches(TestCase):
         self.player  = accounts.models.SteamProfile.objects.create(steamid = '12345678900000001')
         self.account = accounts.models.Account.objects.create(steam_profile = self.player)
 
-    def test(self, mock_update_event_set):
+    def test(self):
         # [9:00] Schedule an update on 1.1.2024 at 9am
         timestamp = datetime.datetime.timestamp
         update1_datetime = datetime.datetime(2024, 1, 1, 9, 00, 00)
@@ -101,6 +100,53 @@ class Account__update_matches(TestCase):
         self.assertEqual(task3.scheduling_datetime, update3_datetime)
 
 
+@patch('stats.models.GamingSession.close')
+class Squad__handle_new_match(TestCase):
+
+    def setUp(self):
+        self.squad = accounts.models.Squad.objects.create(name = 'squad', discord_channel_id = '1234')
+
+    def create_match(self, timestamp):
+        return stats.models.Match.objects.create(
+            sharecode = f'xxx-{timestamp}',
+            timestamp = timestamp,
+            score_team1 = 12,
+            score_team2 = 13,
+            duration = 1800,
+            map_name = 'de_dust2',
+        )
+
+    def test(self, mock__GamingSession__close):
+        self.assertIsNone(self.squad.last_session)
+
+        # Two matches with a short break are assigned to the same session
+        self.squad.handle_new_match(self.create_match(0))
+        self.squad.handle_new_match(self.create_match(3600))
+        session1 = self.squad.last_session
+        self.assertEqual(session1.match_count, 2)
+        self.assertEqual(session1.started, 0)
+        self.assertEqual(session1.ended, 5400)
+
+        # A match after a long break is assigned to a new session
+        self.squad.handle_new_match(self.create_match(5400 + accounts.models.MIN_BREAK_TIME + 1))
+        mock__GamingSession__close.assert_called_once()
+        session2 = self.squad.last_session
+        self.assertNotEqual(session1.pk, session2.pk)
+        self.assertEqual(session2.match_count, 1)
+
+    def test_matches_summary_updated_once(self, mock__GamingSession__close):
+        pmatch = self.create_match(0)
+        with patch.object(
+            stats.models.GamingSession,
+            'update_matches_summary',
+            autospec = True,
+            side_effect = stats.models.GamingSession.update_matches_summary,
+        ) as mock__GamingSession__update_matches_summary:
+            self.squad.handle_new_match(pmatch)
+        mock__GamingSession__update_matches_summary.assert_called_once()
+        self.assertEqual(self.squad.last_session.match_count, 1)
+
+
 @patch('accounts.models.SquadMembership.update_stats')
 class Squad__update_stats(TestCase):
 
@@ -229,3 +275,120 @@ class Squad__update_stats(TestCase):
         self.assertIsNone(memberships.get(player = self.players[1]).position)
         self.assertEqual (memberships.get(player = self.players[2]).position, 1)
         self.assertIsNone(memberships.get(player = self.players[3]).position)
+
+
+class export_csv(TestCase):
+
+    @testsuite.fake_api.patch
+    def setUp(self):
+        self.player = accounts.models.SteamProfile.objects.create(steamid = '12345678900000001')
+        self.matches = list()
+        for midx in range(3):
+            pmatch = stats.models.Match.objects.create(
+                sharecode = f'CSGO-{midx}',
+                timestamp = 1000 + midx,
+                score_team1 = 12,
+                score_team2 = 13,
+                duration = 1653,
+                map_name = 'de_dust2',
+                mtype = stats.models.Match.MTYPE_PREMIER if midx == 0 else '',
+            )
+            stats.models.MatchParticipation.objects.create(
+                player = self.player,
+                pmatch = pmatch,
+                team = 1,
+                result = 'l',
+                new_rank = 6000 if midx == 0 else None,
+                kills = 20,
+                assists = 10,
+                deaths = 15,
+                score = 30,
+                mvps = 5,
+                headshots = 15,
+                adr = 120.5,
+            )
+            self.matches.append(pmatch)
+
+    def test(self):
+        response = self.client.get(f'/accounts/csv/{self.player.steamid}')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].startswith('Match ID;Timestamp;Map;Match type;'))
+        self.assertEqual(lines[1], f'{self.matches[2].pk};1002;de_dust2;;1653;12;13;1;l;;;20;10;15;30;5;15;120.5')
+        self.assertEqual(
+            lines[3],
+            f'{self.matches[0].pk};1000;de_dust2;Premier;1653;12;13;1;l;;6000;20;10;15;30;5;15;120.5',
+        )
+
+    def test_etag(self):
+        response = self.client.get(f'/accounts/csv/{self.player.steamid}')
+        etag = response.headers['ETag']
+
+        # Test that an unchanged export is revalidated without serializing it
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/accounts/csv/{self.player.steamid}', HTTP_IF_NONE_MATCH = etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Test that the ETag changes when a match participation is added
+        pmatch = stats.models.Match.objects.create(
+            sharecode = 'CSGO-3',
+            timestamp = 1003,
+            score_team1 = 12,
+            score_team2 = 13,
+            duration = 1653,
+            map_name = 'de_dust2',
+        )
+        stats.models.MatchParticipation.objects.create(
+            player = self.player,
+            pmatch = pmatch,
+            team = 1,
+            result = 'l',
+            kills = 20,
+            assists = 10,
+            deaths = 15,
+            score = 30,
+            mvps = 5,
+            headshots = 15,
+            adr = 120.5,
+        )
+        response = self.client.get(f'/accounts/csv/{self.player.steamid}', HTTP_IF_NONE_MATCH = etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    @testsuite.fake_api.patch
+    def test_etag_participation_changed(self):
+        squad = accounts.models.Squad.objects.create(name = 'Test Squad')
+        accounts.models.SquadMembership.objects.create(squad = squad, player = self.player)
+        response = self.client.get(f'/accounts/csv/{self.player.steamid}')
+        etag = response.headers['ETag']
+
+        # Test that the ETag changes when a match participation is changed in place
+        participation = self.matches[1].get_participation(self.player)
+        participation.kills = 25
+        participation.save()
+        response = self.client.get(f'/accounts/csv/{self.player.steamid}', HTTP_IF_NONE_MATCH = etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[2], f'{self.matches[1].pk};1001;de_dust2;;1653;12;13;1;l;;;25;10;15;30;5;15;120.5')
+
+    def test_since(self):
+        response = self.client.get(f'/accounts/csv/{self.player.steamid}?since=1000')
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[1], f'{self.matches[2].pk};1002;de_dust2;;1653;12;13;1;l;;;20;10;15;30;5;15;120.5')
+        self.assertEqual(lines[2], f'{self.matches[1].pk};1001;de_dust2;;1653;12;13;1;l;;;20;10;15;30;5;15;120.5')
+
+        # Test that the ETag depends on the timestamp
+        etag = response.headers['ETag']
+        response = self.client.get(f'/accounts/csv/{self.player.steamid}?since=1001', HTTP_IF_NONE_MATCH = etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_since_invalid(self):
+        response = self.client.get(f'/accounts/csv/{self.player.steamid}?since=x')
+        self.assertEqual(response.status_code, 400)
@@ -12,11 +12,18 @@ from csgo_app.views import add_globals_to_context
 
 from django.contrib.auth import login as do_login
 from django.contrib.auth import logout as do_logout
+from django.core.exceptions import BadRequest
+from django.db.models import (
+    Count,
+    Max,
+)
 from django.shortcuts import (
     redirect,
     render,
 )
 from django.urls import reverse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 
 
 def login(request):
@@ -89,11 +96,69 @@ def settings(request):
     return render(request, 'accounts/settings.html', context)
 
 
-def export_csv(request, steamid):
+def get_exported_participations(request, steamid):
+    """
+    Get the match participations of a player, which are exported as CSV.
+
+    Only the matches played after the ``since`` query parameter (a CSGO timestamp) are exported, if it is given.
+    """
     from stats.models import MatchParticipation
-    steam_profile = SteamProfile.objects.get(pk=steamid)
-    participations = MatchParticipation.objects.filter(player = steam_profile).order_by('-pmatch__timestamp')
-    return render(request, 'accounts/export.csv', dict(participations = participations), content_type = 'text/csv')
+    participations = MatchParticipation.objects.filter(player__pk = steamid)
+    since = request.GET.get('since')
+    if since is not None:
+        try:
+            participations = participations.filter(pmatch__timestamp__gt = int(since))
+        except ValueError:
+            raise BadRequest('Invalid timestamp')
+    return participations
+
+
+def get_export_csv_etag(request, steamid):
+    # Derived from two small queries, so that an unchanged export is revalidated without serializing it
+    from stats.models import DataVersion
+    aggregate = get_exported_participations(request, steamid).aggregate(
+        count = Count('pk'),
+        last_timestamp = Max('pmatch__timestamp'),
+    )
+
+    # The data versions of the squads of the player change whenever a match participation is changed in place
+    data_versions = DataVersion.objects.filter(
+        squad__memberships__player__pk = steamid,
+    ).order_by(
+        'squad',
+    ).values_list(
+        'version',
+        flat = True,
+    )
+    return (
+        f'{steamid}/{request.GET.get("since", "")}/{aggregate["count"]}@{aggregate["last_timestamp"]}'
+        f'/{",".join(str(version) for version in data_versions)}'
+    )
+
+
+@cache_control(private = True, no_cache = True)
+@condition(etag_func = get_export_csv_etag)
+def export_csv(request, steamid):
+    """
+    Export the match participations of a player as CSV.
+
+    The ``since`` query parameter (a CSGO timestamp) restricts the export to the matches played afterwards, so that
+    the export can be fetched incrementally. The response carries an ETag, which changes whenever a match
+    participation of the player changes, so that an unchanged export is not transferred again.
+    """
+    from stats.views import stream_csv
+    participations = get_exported_participations(request, steamid).order_by('-pmatch__timestamp')
+    return stream_csv(
+        [
+            'Match ID', 'Timestamp', 'Map', 'Match type', 'Duration', 'Score team 1', 'Score team 2', 'Team', 'Result',
+            'Old rank', 'New rank', 'Kills', 'Assists', 'Deaths', 'Score', 'MVPs', 'Headshots', 'ADR',
+        ],
+        participations.values_list(
+            'pmatch', 'pmatch__timestamp', 'pmatch__map_name', 'pmatch__mtype', 'pmatch__duration',
+            'pmatch__score_team1', 'pmatch__score_team2', 'team', 'result', 'old_rank', 'new_rank', 'kills',
+            'assists', 'deaths', 'score', 'mvps', 'headshots', 'adr',
+        ),
+    )
 
 
 def create_notebook(request, steamid):
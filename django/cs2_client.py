@@ -19,6 +19,7 @@ from cs2pb_typing import (
 )
 from csgo.client import CSGOClient
 from csgo.sharecode import decode as decode_sharecode
+from stats import timing
 from stats.models import Match
 from steam.client import SteamClient
 from steam.core.connection import WebsocketConnection
@@ -148,20 +149,21 @@ def fetch_matches(
         # Execution inside the forked process
         if newpid == 0:
 
-            # Fetch matches and handle errors
+            # Fetch matches and handle errors (the stages are recorded separately and passed to the parent process)
             success = False
-            try:
-                ret = Client(api).fetch_matches(first_sharecode, steamuser, recent_matches, skip_first)
-                success = True
-            except ClientError as error:
-                log.error(f'An error occurred while fetching matches', exc_info=True)
-                ret = dict(error=error, cause=None)
-            except BaseException as error:
-                log.critical(f'An error occurred while fetching matches', exc_info=True)
-                ret = dict(error=ClientError(), cause=error)
+            with timing.record() as recorder:
+                try:
+                    ret = Client(api).fetch_matches(first_sharecode, steamuser, recent_matches, skip_first)
+                    success = True
+                except ClientError as error:
+                    log.error(f'An error occurred while fetching matches', exc_info=True)
+                    ret = dict(error=error, cause=None)
+                except BaseException as error:
+                    log.critical(f'An error occurred while fetching matches', exc_info=True)
+                    ret = dict(error=ClientError(), cause=error)
 
             # Serialize the result and exit the subprocess
-            dill.dump(ret, ret_file, byref=True)
+            dill.dump((ret, recorder.stages), ret_file, byref=True)
             ret_file.flush()
             os._exit(0 if success else 1)
 
@@ -170,7 +172,8 @@ def fetch_matches(
             exit_code = os.waitpid(newpid, 0)[1]
             log.info(f'fetch_matches subprocess finished with exit code {exit_code}')
             ret_file.seek(0)
-            ret = dill.load(ret_file)
+            ret, stages = dill.load(ret_file)
+            timing.merge(stages)
             if exit_code == 0:
 
                 # Resolve any cache hits to the corresponding match objects,
@@ -212,7 +215,8 @@ class Client:
 
         # Fetch the newest sharecodes
         log.info(f'Fetching sharecodes (for Steam ID: {steamuser.steamid})')
-        sharecodes = list(self.api.fetch_sharecodes(first_sharecode, steamuser))
+        with timing.stage('fetch_sharecodes'):
+            sharecodes = list(self.api.fetch_sharecodes(first_sharecode, steamuser))
         log.info(f'Fetched: {first_sharecode} -> {sharecodes}')
 
         # Skip the first sharecode (if requested, i.e. if the corresponding match was already processed before)
@@ -233,7 +237,8 @@ class Client:
 
             # Otherwise, resolve the sharecode
             else:
-                protobuf = self._resolve_sharecode(sharecode)
+                with timing.stage('resolve_sharecode'):
+                    protobuf = self._resolve_sharecode(sharecode)
                 summary = self._resolve_protobuf(sharecode, protobuf)
 
                 # Skip the match if it is a wingman match
@@ -388,7 +393,8 @@ class SteamAPI:
 def parse_demo(demofile):
     if demofile.startswith('http://'):
         log.info(f'Downloading demo: {demofile}')
-        response = requests.get(demofile)
+        with timing.stage('download_demo'):
+            response = requests.get(demofile)
         with tempfile.NamedTemporaryFile() as temp:
             temp.write(bz2.decompress(response.content))
             temp.flush()
@@ -402,7 +408,8 @@ def parse_demo(demofile):
     log.info(f'Parsing demo: {demofile}')
     try:
         assert os.path.isfile(demofile)
-        return awpy.Demo(path=demofile, ticks = False)  # `ticks = False` is required to reduce memory consumption
+        with timing.stage('parse_demo'):
+            return awpy.Demo(path=demofile, ticks = False)  # `ticks = False` is required to reduce memory consumption
     except:  # noqa: E722
         log.critical(f'Failed to parse demo: {demofile}')
         raise
@@ -114,6 +114,10 @@ LOGGING = {
 
 CSGO_API_ENABLED = True
 
+UPDATER_WORKERS = 4
+
+UPDATER_HOURLY_BUDGET = 60
+
 
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
@@ -1,4 +1,6 @@
 import os
+import threading
+import time
 
 import gitinfo
 
@@ -8,13 +10,92 @@ from django.db.models import Count
 ADMIN_MAIL_ADDRESS = os.environ['CS2PB_ADMIN_MAIL_ADDRESS']
 assert len(ADMIN_MAIL_ADDRESS) > 0
 
+QUEUE_HEALTH_TTL = 10  # 10 seconds
 
-def add_globals_to_context(context):
+MALFUNCTION_ALERT_INTERVAL = 60 * 60  # 1 hour
+
+globals_lock = threading.Lock()
+
+head_info_cache = dict(stamp = None, info = None)
+"""
+The version info of the process, which is only re-computed when the HEAD of the repository changes.
+"""
+
+queue_health_cache = dict(timestamp = None, malfunction = False)
+"""
+The most recent snapshot of the health of the update queue.
+"""
+
+last_malfunction_alert_timestamp = None
+"""
+The time when the last malfunction alert was sent (or None, if no alert was sent yet).
+"""
+
+
+def get_head_info():
+    """
+    Get the version info, which is cached until the HEAD of the repository changes.
+    """
+    stamp = gitinfo.get_head_stamp()
+    with globals_lock:
+        if head_info_cache['info'] is None or head_info_cache['stamp'] != stamp:
+            head_info_cache['info'] = gitinfo.get_head_info()
+            head_info_cache['stamp'] = stamp
+        return head_info_cache['info']
+
+
+def is_update_queue_malfunctioning() -> bool:
+    """
+    Check whether there is an account with more than one pending update task (the updates are stalled then).
+
+    The result is a snapshot, which is re-used for :data:`QUEUE_HEALTH_TTL` seconds.
+    """
     from stats.models import UpdateTask
-    context['version'] = gitinfo.get_head_info()
-    qs = UpdateTask.objects.filter(completion_timestamp = None)
-    qs = qs.values('account').annotate(count = Count('account'))
-    if qs.count() > 0 and qs.latest('count')['count'] > 1:
+    with globals_lock:
+        now = time.monotonic()
+        if queue_health_cache['timestamp'] is None or now - queue_health_cache['timestamp'] >= QUEUE_HEALTH_TTL:
+            max_pending_tasks = UpdateTask.objects.filter(
+                completion_timestamp = None,
+            ).values(
+                'account',
+            ).annotate(
+                count = Count('account'),
+            ).order_by(
+                '-count',
+            ).values_list(
+                'count',
+                flat = True,
+            ).first()
+            queue_health_cache['malfunction'] = max_pending_tasks is not None and max_pending_tasks > 1
+            queue_health_cache['timestamp'] = now
+        return queue_health_cache['malfunction']
+
+
+def send_malfunction_alert(msg):
+    """
+    Send a malfunction alert to the admin in the background, unless an alert was sent within the last
+    :data:`MALFUNCTION_ALERT_INTERVAL` seconds.
+    """
+    global last_malfunction_alert_timestamp
+    with globals_lock:
+        now = time.monotonic()
+        if last_malfunction_alert_timestamp is not None and (
+            now - last_malfunction_alert_timestamp < MALFUNCTION_ALERT_INTERVAL
+        ):
+            return False
+        last_malfunction_alert_timestamp = now
+    threading.Thread(
+        target = send_mail,
+        args = ('Steam API malfunction', msg, ADMIN_MAIL_ADDRESS, [ADMIN_MAIL_ADDRESS]),
+        kwargs = dict(fail_silently = True),
+        daemon = True,
+    ).start()
+    return True
+
+
+def add_globals_to_context(context):
+    context['version'] = get_head_info()
+    if is_update_queue_malfunctioning():
         msg = 'There is a temporary malfunction of the Steam Client API.'
         context['error'] = f'{msg} Come back later.'
-        send_mail('Steam API malfunction', msg, ADMIN_MAIL_ADDRESS, [ADMIN_MAIL_ADDRESS], fail_silently=True)
+        send_malfunction_alert(msg)
@@ -1,3 +1,5 @@
+import json
+import os
 import pathlib
 import re
 from datetime import datetime
@@ -7,6 +9,17 @@ import git
 repo_dir = pathlib.Path(__file__).parent.parent
 base_repo_url = 'https://github.com/kodikit/cs2pb'
 
+changelog_cache_path = repo_dir / '.git' / 'cs2pb-changelog.json'
+"""
+The on-disk cache of the changelog entries (located inside the Git directory, so that it is never committed).
+"""
+
+changelog_cache_format = 1
+
+merged_pr_pattern = re.compile(r'^Merge pull request #([0-9]+) from.+')
+squashed_pr_pattern = re.compile(r'^(.+) \(#([0-9]+)\)')
+hotfix_pattern = re.compile(r'^hotfix:(.*)', re.IGNORECASE)
+
 changelog_exclude = [
     'ef37efb000f082b1a18e9fd4c1e49344eb6d4f78',
     'e7c3037db900d619187186ffa6c9865196c562cc',
@@ -34,52 +47,145 @@ def get_head_info():
     return dict(sha = sha, date = date, branch = branch)
 
 
-def get_changelog(skip_nochangelog=True):
+def get_head_stamp():
+    """
+    Get a cheap stamp of the HEAD, which changes whenever the HEAD changes (without opening the repository).
+
+    The stamp consists of the modification times of the ``HEAD`` file, the file of the reference it points to, and the
+    packed references. Missing files are reported as None.
+    """
+    git_dir = repo_dir / '.git'
+    paths = [git_dir / 'HEAD', git_dir / 'packed-refs']
+    try:
+        head = paths[0].read_text().strip()
+    except OSError:
+        head = ''
+    if head.startswith('ref: '):
+        paths.append(git_dir / head[5:])
+    stamp = list()
+    for path in paths:
+        try:
+            stamp.append(path.stat().st_mtime_ns)
+        except OSError:
+            stamp.append(None)
+    return (head, *stamp)
+
+
+def parse_changelog_entry(c):
+    """
+    Parse the changelog entry of a commit (or None, if the commit does not correspond to a changelog entry).
+
+    The entry is raw in the sense that :data:`changelog_exclude` and :data:`changelog_substitute_message` are not
+    applied yet, and the ``nochangelog`` field indicates whether the commit was tagged ``[no changelog]``.
+    """
+    entry = None
+
+    # Match pull requests with merge commits
+    m = merged_pr_pattern.match(c.message)
+    if m is not None:
+        pr_id = int(m.group(1))
+        entry = dict(
+            message = '\n'.join(c.message.split('\n')[1:]).strip(),
+            url = base_repo_url + '/pull/' + str(pr_id),
+        )
+
+    # Match squashed pull requests
+    m = squashed_pr_pattern.match(c.message)
+    if m is not None:
+        pr_id = int(m.group(2))
+        entry = dict(
+            message = m.group(1),
+            url = base_repo_url + '/pull/' + str(pr_id),
+        )
+
+    # Match hotfix commits
+    m = hotfix_pattern.match(c.message)
+    if m is not None:
+        entry = dict(
+            message = m.group(1).split('\n')[0].strip(),
+            url = base_repo_url + '/commit/' + c.hexsha,
+        )
+
+    if entry is not None:
+        nochangelog = '[no changelog]' in c.message or '[no-changelog]' in c.message
+        return entry | dict(sha = c.hexsha, date = get_fmt_date(c), nochangelog = nochangelog)
+
+
+def load_changelog_cache():
+    try:
+        with open(changelog_cache_path) as fp:
+            cache = json.load(fp)
+        if cache.get('format') == changelog_cache_format:
+            return cache
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def save_changelog_cache(head, entries):
+    try:
+        tmp_path = changelog_cache_path.with_name(changelog_cache_path.name + '.tmp')
+        with open(tmp_path, 'w') as fp:
+            json.dump(dict(format = changelog_cache_format, head = head, entries = entries), fp)
+        os.replace(tmp_path, changelog_cache_path)
+    except OSError:
+        pass  # The cache is only an optimization
+
+
+def get_changelog_entries():
+    """
+    Get the raw changelog entries of all commits reachable from the HEAD (see :func:`parse_changelog_entry`).
+
+    The entries are cached on disk, keyed by the SHA of the HEAD. If the HEAD has moved on since, only the commits which
+    are new are parsed, and the cache is extended accordingly.
+    """
     r = git.Repo(str(repo_dir))
-    merged_pr_pattern = re.compile(r'^Merge pull request #([0-9]+) from.+')
-    squashed_pr_pattern = re.compile(r'^(.+) \(#([0-9]+)\)')
-    hotfix_pattern = re.compile(r'^hotfix:(.*)', re.IGNORECASE)
+    head = r.head.object.hexsha
+    cache = load_changelog_cache()
+    if cache is not None and cache['head'] == head:
+        return cache['entries']
+
+    # Parse only the new commits, if the cached HEAD is an ancestor of the current HEAD
+    try:
+        if cache is not None and r.is_ancestor(cache['head'], head):
+            rev, entries = f'{cache["head"]}..{head}', cache['entries']
+        else:
+            rev, entries = head, list()
+    except git.GitCommandError:  # The cached HEAD is unknown to the repository
+        rev, entries = head, list()
+
+    new_entries = list()
+    for c in r.iter_commits(rev):
+        entry = parse_changelog_entry(c)
+        if entry is not None:
+            new_entries.append(entry)
+    entries = new_entries + entries
+
+    save_changelog_cache(head, entries)
+    return entries
+
+
+def get_changelog(skip_nochangelog=True):
     changelog = list()
-    for c in r.iter_commits():
-        entry = None
+    for entry in get_changelog_entries():
 
-        if c.hexsha in changelog_exclude:
+        if entry['sha'] in changelog_exclude:
             continue
 
-        if skip_nochangelog and ('[no changelog]' in c.message or '[no-changelog]' in c.message):
+        if skip_nochangelog and entry['nochangelog']:
             continue
 
-        # Match pull requests with merge commits
-        m = merged_pr_pattern.match(c.message)
-        if m is not None:
-            pr_id = int(m.group(1))
-            entry = dict(
-                message = '\n'.join(c.message.split('\n')[1:]).strip(),
-                url = base_repo_url + '/pull/' + str(pr_id),
-            )
-
-        # Match squashed pull requests
-        m = squashed_pr_pattern.match(c.message)
-        if m is not None:
-            pr_id = int(m.group(2))
-            entry = dict(
-                message = m.group(1),
-                url = base_repo_url + '/pull/' + str(pr_id),
-            )
-
-        # Match hotfix commits
-        m = hotfix_pattern.match(c.message)
-        if m is not None:
-            entry = dict(
-                message = m.group(1).split('\n')[0].strip(),
-                url = base_repo_url + '/commit/' + c.hexsha,
-            )
-
-        if entry is not None:
-            entry['message'] = changelog_substitute_message.get(c.hexsha, entry['message'])
-            changelog.append(entry | dict(sha = c.hexsha, date = get_fmt_date(c)))
+        entry = {key: value for key, value in entry.items() if key != 'nochangelog'}
+        entry['message'] = changelog_substitute_message.get(entry['sha'], entry['message'])
+        changelog.append(entry)
 
     return changelog
 
 
-changelog = get_changelog()
+def __getattr__(name):
+    # The changelog is computed lazily, upon first access of `gitinfo.changelog`
+    if name == 'changelog':
+        changelog = get_changelog()
+        globals()['changelog'] = changelog
+        return changelog
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
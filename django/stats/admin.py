@@ -1,3 +1,4 @@
+from stats import timing
 from stats.models import (
     GamingSession,
     Match,
@@ -133,11 +134,27 @@ class UpdateTaskAdmin(admin.ModelAdmin):
         'scheduling_date_and_time',
         '_execution_datetime',
         '_completion_datetime',
+        'lease_owner',
+        'attempts',
+        '_stages',
         '_actions',
     )
     list_filter = (
         ('completion_timestamp', admin.EmptyFieldListFilter),
     )
+    change_list_template = 'admin/stats/updatetask/change_list.html'
+
+    def changelist_view(self, request, extra_context = None):
+        # Show the percentiles of the stage durations across the completed tasks
+        stages_list = UpdateTask.objects.exclude(completion_timestamp = None).values_list('stages', flat = True)
+        extra_context = (extra_context or dict()) | dict(
+            stage_percentiles = timing.get_percentiles(list(stages_list)).items(),
+            percentiles = timing.PERCENTILES,
+        )
+        return super().changelist_view(request, extra_context = extra_context)
+
+    def _stages(self, task):
+        return timing.format_stages(task.stages)
 
     def _execution_datetime(self, task):
         return task.execution_date_and_time or 'Pending'
@@ -0,0 +1,260 @@
+"""
+Read-only JSON API for the session and match history of a squad, and the time series of a player.
+
+The endpoints are paginated using keyset pagination on ``(timestamp, pk)``, starting with the most recent entries. The
+following query parameters are supported:
+
+- ``fields``: Comma-separated list of the fields to include (defaults to all fields).
+- ``limit``: The number of entries per page (defaults to :data:`DEFAULT_PAGE_SIZE`, at most :data:`MAX_PAGE_SIZE`).
+- ``cursor``: The ``next`` cursor of the previous page.
+
+Each page carries an ETag, so that unchanged pages can be revalidated without transferring them again. In contrast to
+the HTML views, the endpoints never trigger updates of the matches.
+"""
+import hashlib
+
+import numpy as np
+from accounts.models import (
+    Squad,
+    SquadMembership,
+)
+from cs2pb_typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+from django.core.exceptions import BadRequest
+from django.db.models import (
+    F,
+    Q,
+    QuerySet,
+)
+from django.http import (
+    HttpResponseNotFound,
+    JsonResponse,
+)
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from . import pagecache
+from .models import (
+    GamingSession,
+    Match,
+    MatchParticipation,
+    csgo_timestamp_to_strftime,
+)
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+session_fields = ('id', 'started', 'timestamp', 'is_closed', 'rising_star', 'matches')
+"""
+The fields of a session. The ``started`` and ``timestamp`` fields are the CSGO timestamps of when the first match of
+the session started and the last match ended, respectively.
+"""
+
+match_fields = (
+    'id', 'sharecode', 'timestamp', 'score_team1', 'score_team2', 'duration', 'map_name', 'mtype', 'participations',
+)
+"""
+The fields of a match.
+"""
+
+participation_fields = (
+    'player', 'team', 'result', 'kills', 'deaths', 'assists', 'score', 'mvps', 'headshots', 'adr',
+    'old_rank', 'new_rank',
+)
+"""
+The fields of a match participation (included in the ``participations`` field of a match).
+"""
+
+
+def parse_page_args(request, available_fields: Tuple[str, ...]) -> Tuple[List[str], int, Optional[Tuple[int, int]]]:
+    """
+    Parse the requested fields, the page size, and the cursor.
+    """
+    fields = request.GET.get('fields')
+    fields = fields.split(',') if fields else list(available_fields)
+    unknown_fields = [field for field in fields if field not in available_fields]
+    if len(unknown_fields) > 0:
+        raise BadRequest(f'Unknown fields: {", ".join(unknown_fields)}')
+
+    try:
+        limit = int(request.GET.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise BadRequest('Invalid limit')
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise BadRequest(f'The limit must be between 1 and {MAX_PAGE_SIZE}')
+
+    cursor = request.GET.get('cursor')
+    if cursor is not None:
+        try:
+            timestamp, pk = cursor.split(':')
+            cursor = (int(timestamp), int(pk))
+        except ValueError:
+            raise BadRequest('Invalid cursor')
+
+    return fields, limit, cursor
+
+
+def paginate(
+        qs: QuerySet,
+        limit: int,
+        cursor: Optional[Tuple[int, int]],
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Get the page of a queryset, that follows the cursor, and the cursor of the next page (or None for the last page).
+
+    The queryset must yield dictionaries which provide the ``id`` and ``timestamp`` fields.
+    """
+    if cursor is not None:
+        qs = qs.filter(Q(timestamp__lt = cursor[0]) | Q(timestamp = cursor[0], pk__lt = cursor[1]))
+    page = list(qs.order_by('-timestamp', '-pk')[:limit + 1])
+    if len(page) > limit:
+        page = page[:limit]
+        return page, f'{page[-1]["timestamp"]}:{page[-1]["id"]}'
+    else:
+        return page, None
+
+
+def page_response(request, results: List[Dict[str, Any]], next_cursor: Optional[str]):
+    """
+    Create the JSON response for a page, or a *304 Not Modified* response, if the client has the page already.
+    """
+    response = JsonResponse(dict(results = results, next = next_cursor))
+    etag = quote_etag(hashlib.sha1(response.content).hexdigest())
+    response.headers['ETag'] = etag
+    return get_conditional_response(request, etag = etag, response = response)
+
+
+def sessions(request, squad):
+    try:
+        squad = Squad.objects.get(uuid = squad)
+    except Squad.DoesNotExist:
+        return HttpResponseNotFound('No such squad')
+    fields, limit, cursor = parse_page_args(request, session_fields)
+
+    qs = GamingSession.objects.filter(
+        squad = squad,
+    ).exclude(
+        ended_ts = None,
+    ).annotate(
+        started = F('started_ts'),
+        timestamp = F('ended_ts'),
+    ).values(
+        'id',
+        'started',
+        'timestamp',
+        'is_closed',
+        'rising_star',
+    )
+    page, next_cursor = paginate(qs, limit, cursor)
+
+    # Fetch the matches of the sessions (only if requested)
+    if 'matches' in fields:
+        session_matches = {session['id']: list() for session in page}
+        for session_pk, match_pk in Match.sessions.through.objects.filter(
+            gamingsession__in = list(session_matches.keys()),
+        ).order_by(
+            'match__timestamp',
+        ).values_list(
+            'gamingsession',
+            'match',
+        ):
+            session_matches[session_pk].append(match_pk)
+        for session in page:
+            session['matches'] = session_matches[session['id']]
+
+    results = [{field: session[field] for field in fields} for session in page]
+    return page_response(request, results, next_cursor)
+
+
+def matches(request, squad):
+    try:
+        squad = Squad.objects.get(uuid = squad)
+    except Squad.DoesNotExist:
+        return HttpResponseNotFound('No such squad')
+    fields, limit, cursor = parse_page_args(request, match_fields)
+
+    qs = Match.objects.filter(
+        matchparticipation__player__squad_memberships__squad = squad,
+    ).distinct().values(
+        *[field for field in match_fields if field != 'participations'],
+    )
+    page, next_cursor = paginate(qs, limit, cursor)
+
+    # Fetch the participations of the matches (only if requested)
+    if 'participations' in fields:
+        match_participations = {pmatch['id']: list() for pmatch in page}
+        for participation in MatchParticipation.objects.filter(
+            pmatch__in = list(match_participations.keys()),
+        ).values(
+            'pmatch',
+            *participation_fields,
+        ):
+            match_participations[participation.pop('pmatch')].append(participation)
+        for pmatch in page:
+            pmatch['participations'] = match_participations[pmatch['id']]
+
+    results = [{field: pmatch[field] for field in fields} for pmatch in page]
+    return page_response(request, results, next_cursor)
+
+
+def is_squad_member(squad, steamid) -> bool:
+    """
+    Tell whether a player is a member of a squad (by UUID).
+    """
+    return SquadMembership.objects.filter(squad__uuid = squad, player__pk = steamid).exists()
+
+
+def get_player_series_etag(request, squad, steamid):
+    if not is_squad_member(squad, steamid):
+        return None
+
+    # The data version of the squad changes whenever the match participations of the squad members change
+    return f'{squad}/{steamid}@{pagecache.get_data_version(squad)}'
+
+
+@cache_control(private = True, no_cache = True)
+@condition(etag_func = get_player_series_etag)
+def player_series(request, squad, steamid):
+    """
+    Get the time series of the match participations of a player in columnar form (in chronological order).
+
+    The time series are the CSGO timestamps and human-readable dates of the matches, the player value, the ADR, the
+    K/D, and the Premier rank (None if unranked). Only the time series of the squad members are available. The ETag
+    is derived from the data version of the squad, so that revalidation only requires two queries.
+    """
+    if not is_squad_member(squad, steamid):
+        return HttpResponseNotFound('No such squad member')
+    data = np.array(
+        MatchParticipation.objects.filter(
+            player__pk = steamid,
+        ).order_by(
+            'pmatch__timestamp',
+        ).values_list(
+            'pmatch__timestamp',
+            'kills',
+            'deaths',
+            'adr',
+            'new_rank',
+        ),
+        dtype = float,
+    ).reshape(-1, 5)
+    timestamps, kills, deaths, adr, ranks = data.T
+    kd = kills / np.maximum(deaths, 1)
+    return JsonResponse(
+        dict(
+            timestamps = timestamps.astype(int).tolist(),
+            dates = [csgo_timestamp_to_strftime(timestamp) for timestamp in timestamps.astype(int).tolist()],
+            player_value = np.sqrt(kd * adr / 100).tolist(),
+            adr = adr.tolist(),
+            kd = kd.tolist(),
+            rank = [None if np.isnan(rank) else int(rank) for rank in ranks],
+        )
+    )
@@ -1,28 +1,135 @@
+import numpy as np
 from cs2pb_typing import (
+    Any,
+    Callable,
+    Dict,
     List,
     Optional,
+    Self,
+    Union,
 )
 
 from django.db.models import (
-    Avg,
+    Count,
+    Exists,
     F,
     Max,
+    OuterRef,
+    Q,
+    Sum,
     Value,
 )
-from django.db.models.functions import Sqrt
+from django.db.models.functions import (
+    Coalesce,
+    Sqrt,
+)
 
 
 def F_float(expr):
     return F(expr) * 1.
 
 
+def np_divide(dividend: np.ndarray, divisor: np.ndarray) -> np.ndarray:
+    """
+    Divide element-wise, yielding NaN for divisions by zero (like NULL in SQL).
+    """
+    dividend = dividend.astype(float)
+    return np.divide(dividend, divisor, out = np.full_like(dividend, np.nan), where = divisor != 0)
+
+
 class FeatureContext:
 
     def __init__(self, match_participations, player):
+        self.player = player
         self.match_participations_universe = match_participations
         self.match_participations_of_player = match_participations.filter(player = player)
 
 
+PARTICIPATION_DTYPE = np.dtype(
+    [
+        ('pk', np.int64),
+        ('player', 'U30'),
+        ('pmatch', np.int64),
+        ('timestamp', np.int64),
+        ('mtype', 'U20'),
+        ('result', 'U1'),
+        ('kills', np.int64),
+        ('assists', np.int64),
+        ('deaths', np.int64),
+        ('headshots', np.int64),
+        ('adr', np.float64),
+        ('new_rank', np.int64),  # 0 if unranked
+        ('peach', np.bool_),
+    ]
+)
+"""
+Columnar representation of match participations (see :class:`ColumnarFeatureContext`).
+"""
+
+
+def load_participations(match_participations) -> np.ndarray:
+    """
+    Load match participations into a structured array (see :data:`PARTICIPATION_DTYPE`) using a single query.
+    """
+    from .models import MatchBadge
+    rows = match_participations.annotate(
+        rank = Coalesce('new_rank', 0),
+        peach = Exists(
+            MatchBadge.objects.filter(participation = OuterRef('pk'), badge_type = 'peach'),
+        ),
+    ).order_by().values_list(
+        'pk',
+        'player',
+        'pmatch',
+        'pmatch__timestamp',
+        'pmatch__mtype',
+        'result',
+        'kills',
+        'assists',
+        'deaths',
+        'headshots',
+        'adr',
+        'rank',
+        'peach',
+    )
+    return np.array(list(rows), dtype = PARTICIPATION_DTYPE)
+
+
+class ColumnarFeatureContext:
+    """
+    Feature context which is backed by a columnar in-memory representation of the match participations.
+
+    The match participations are loaded once, and all features are computed using vectorized NumPy operations. The
+    same data can be reused for other players (see :meth:`for_player`) and subsets of the matches (see :meth:`filter`),
+    e.g., for buddy analysis or different time windows, without issuing further queries.
+    """
+
+    def __init__(self, match_participations, player, participations: Optional[np.ndarray] = None):
+        self.player = player
+        self.participations_universe = (
+            load_participations(match_participations) if participations is None else participations
+        )
+        self.participations_of_player = self.participations_universe[
+            self.participations_universe['player'] == getattr(player, 'pk', None)
+        ]
+
+    def for_player(self, player) -> Self:
+        """
+        Create a feature context for a different player, that is backed by the same match participations.
+        """
+        return ColumnarFeatureContext(None, player, self.participations_universe)
+
+    def filter(self, mask: Union[np.ndarray, Callable[[np.ndarray], np.ndarray]]) -> Self:
+        """
+        Create a feature context for a subset of the match participations (e.g., a different time window).
+
+        The subset is specified by a boolean mask, or by a function which computes the mask from the participations.
+        """
+        if callable(mask):
+            mask = mask(self.participations_universe)
+        return ColumnarFeatureContext(None, self.player, self.participations_universe[mask])
+
+
 class Feature:
 
     name: str
@@ -57,20 +164,65 @@ class Feature:
         self.slug = None
         self.extra = extra
 
-    def __call__(self, ctx: FeatureContext) -> Optional[float]:
-        ...
+    def __call__(self, ctx: Union[FeatureContext, ColumnarFeatureContext]) -> Optional[float]:
+        if isinstance(ctx, ColumnarFeatureContext):
+            return self.aggregate(self.accumulate_columns(ctx))
+        else:
+            return self.aggregate(self.accumulate(ctx))
+
+    def accumulate(self, ctx: FeatureContext) -> Any:
+        """
+        Compute the partial aggregate of the feature for a feature context.
+
+        Partial aggregates must be JSON-serializable, so that they can be persisted, and partial aggregates of disjoint
+        sets of matches can be combined using :meth:`merge`.
+        """
+        raise NotImplementedError()
+
+    def accumulate_columns(self, ctx: ColumnarFeatureContext) -> Any:
+        """
+        Compute the partial aggregate of the feature for a columnar feature context (see :meth:`accumulate`).
+        """
+        raise NotImplementedError()
+
+    def merge(self, partial1: Any, partial2: Any) -> Any:
+        """
+        Combine the partial aggregates of two disjoint sets of matches (the default implementation adds them up).
+        """
+        if partial1 is None:
+            return partial2
+        if partial2 is None:
+            return partial1
+        return {key: partial1[key] + partial2[key] for key in partial1.keys()}
+
+    def aggregate(self, partial: Any) -> Optional[float]:
+        """
+        Compute the value of the feature from a partial aggregate.
+        """
+        raise NotImplementedError()
 
 
 class ExpressionFeature(Feature):
 
-    def __init__(self, expression, *args, format='{:.2f}', **kwargs):
+    def __init__(self, expression, *args, vectorized, format='{:.2f}', **kwargs):
         super().__init__(*args, format, **kwargs)
         self.expression = expression
+        self.vectorized = vectorized
+
+    def accumulate(self, ctx: FeatureContext) -> Dict[str, float]:
+        partial = self.get_queryset(ctx).aggregate(sum = Sum('value'), count = Count('value'))
+        return dict(sum = partial['sum'] or 0, count = partial['count'])
 
-    def __call__(self, ctx: FeatureContext) -> Optional[float]:
-        avg_value_qs = self.get_queryset(ctx).aggregate(Avg('value'))
-        avg_value = avg_value_qs['value__avg']
-        return 0 if avg_value is not None and avg_value < 0 else avg_value
+    def accumulate_columns(self, ctx: ColumnarFeatureContext) -> Dict[str, float]:
+        values = self.vectorized(ctx.participations_of_player)
+        values = values[~np.isnan(values)]
+        return dict(sum = float(values.sum()), count = len(values))
+
+    def aggregate(self, partial: Optional[Dict[str, float]]) -> Optional[float]:
+        if partial is None or partial['count'] == 0:
+            return None
+        avg_value = partial['sum'] / partial['count']
+        return 0 if avg_value < 0 else avg_value
 
     def get_queryset(self, ctx: FeatureContext):
         return ctx.match_participations_of_player.annotate(value = self.expression)
@@ -86,22 +238,66 @@ class ParticipationEffect(Feature):
         )
         self.min_datapoints = min_datapoints
 
-    def __call__(self, ctx: FeatureContext) -> Optional[float]:
-        victories_with_participation = ctx.match_participations_of_player.filter(result = 'w').count()
-        matches_with_participation   = ctx.match_participations_of_player.exclude(result = 't').count()
-        matches_without_participation_qs = ctx.match_participations_universe.values('pmatch', 'result').exclude(
-            pmatch__in = ctx.match_participations_of_player.values_list('pmatch', flat = True)
-        ).exclude(result = 't').order_by('pmatch').distinct()
-        matches_without_participation    = matches_without_participation_qs.count()
+    def accumulate(self, ctx: FeatureContext) -> Dict[str, int]:
+        return self.count_matches(ctx)
+
+    def aggregate(self, counts: Optional[Dict[str, int]]) -> Optional[float]:
+        if counts is None:
+            return None
+        victories_with_participation    = counts['victories_with_participation']
+        matches_with_participation      = counts['matches_with_participation']
+        victories_without_participation = counts['victories_without_participation']
+        matches_without_participation   = counts['matches_without_participation']
         if matches_with_participation < self.min_datapoints or matches_without_participation < self.min_datapoints:
             return None
         else:
-            victories_without_participation = matches_without_participation_qs.filter(result = 'w').count()
             victory_chance_with_participation    = victories_with_participation    / matches_with_participation
             victory_chance_without_participation = victories_without_participation / matches_without_participation
             expected_causal_effect = victory_chance_with_participation - victory_chance_without_participation
             return (1 + expected_causal_effect) / 2
 
+    def accumulate_columns(self, ctx: ColumnarFeatureContext) -> Dict[str, int]:
+        participations = ctx.participations_universe
+        with_participation = participations['player'] == getattr(ctx.player, 'pk', None)
+        without_participation = ~np.isin(participations['pmatch'], participations['pmatch'][with_participation])
+        victories_without_participation = len(
+            np.unique(participations['pmatch'][without_participation & (participations['result'] == 'w')])
+        )
+        defeats_without_participation = len(
+            np.unique(participations['pmatch'][without_participation & (participations['result'] == 'l')])
+        )
+        return dict(
+            victories_with_participation = int((with_participation & (participations['result'] == 'w')).sum()),
+            matches_with_participation = int((with_participation & (participations['result'] != 't')).sum()),
+            victories_without_participation = victories_without_participation,
+            matches_without_participation = victories_without_participation + defeats_without_participation,
+        )
+
+    def count_matches(self, ctx: FeatureContext) -> Dict[str, int]:
+        """
+        Count the won and the decided (not tied) matches with and without participation of the player, using a single
+        conditional aggregation over the match participations of the universe.
+
+        Matches without participation are counted once per distinct result, i.e. a match of the universe which was won
+        by some and lost by others is counted both as a victory and a defeat.
+        """
+        with_participation = Q(player = ctx.player)
+        without_participation = ~Q(pmatch__in = ctx.match_participations_of_player.values_list('pmatch', flat = True))
+        counts = ctx.match_participations_universe.aggregate(
+            victories_with_participation = Count('pk', filter = with_participation & Q(result = 'w')),
+            matches_with_participation = Count('pk', filter = with_participation & ~Q(result = 't')),
+            victories_without_participation = Count(
+                'pmatch', distinct = True, filter = without_participation & Q(result = 'w'),
+            ),
+            defeats_without_participation = Count(
+                'pmatch', distinct = True, filter = without_participation & Q(result = 'l'),
+            ),
+        )
+        counts['matches_without_participation'] = (
+            counts['victories_without_participation'] + counts.pop('defeats_without_participation')
+        )
+        return counts
+
 
 class Rank(Feature):
 
@@ -116,16 +312,39 @@ class Rank(Feature):
         )
         self.mtype = mtype
 
-    def __call__(self, ctx: FeatureContext) -> Optional[float]:
+    def accumulate(self, ctx: FeatureContext) -> Optional[Dict[str, int]]:
         from .models import MatchParticipation
         try:
-            rank = ctx.match_participations_of_player.filter(
+            participation = ctx.match_participations_of_player.filter(
                 pmatch__mtype = self.mtype,
-            ).latest('pmatch__timestamp').new_rank
-            return None if rank is None else rank / 1000
+            ).select_related('pmatch').latest('pmatch__timestamp')
+            return dict(timestamp = participation.pmatch.timestamp, rank = participation.new_rank)
         except MatchParticipation.DoesNotExist:
             return None
 
+    def accumulate_columns(self, ctx: ColumnarFeatureContext) -> Optional[Dict[str, int]]:
+        participations = ctx.participations_of_player[ctx.participations_of_player['mtype'] == self.mtype]
+        if len(participations) == 0:
+            return None
+        participation = participations[participations['timestamp'].argmax()]
+        return dict(
+            timestamp = int(participation['timestamp']),
+            rank = int(participation['new_rank']) if participation['new_rank'] != 0 else None,
+        )
+
+    def merge(self, partial1, partial2):
+        if partial1 is None:
+            return partial2
+        if partial2 is None:
+            return partial1
+        return partial2 if partial2['timestamp'] > partial1['timestamp'] else partial1
+
+    def aggregate(self, partial: Optional[Dict[str, int]]) -> Optional[float]:
+        if partial is None or partial['rank'] is None:
+            return None
+        else:
+            return partial['rank'] / 1000
+
 
 class PeachRate(Feature):
 
@@ -135,16 +354,27 @@ class PeachRate(Feature):
             'The empirical probability of qualifying for the Peach Price.',
         )
 
-    def __call__(self, ctx: FeatureContext) -> Optional[float]:
+    def accumulate(self, ctx: FeatureContext) -> Dict[str, int]:
         from .models import MatchBadge
-        if ctx.match_participations_of_player.count() > 0:
-            match_participations_with_peach = MatchBadge.objects.filter(
+        return dict(
+            peaches = MatchBadge.objects.filter(
                 badge_type = 'peach',
                 participation__in = ctx.match_participations_of_player.values_list('pk', flat = True),
-            )
-            return match_participations_with_peach.count() / ctx.match_participations_of_player.count()
-        else:
+            ).count(),
+            participations = ctx.match_participations_of_player.count(),
+        )
+
+    def accumulate_columns(self, ctx: ColumnarFeatureContext) -> Dict[str, int]:
+        return dict(
+            peaches = int(ctx.participations_of_player['peach'].sum()),
+            participations = len(ctx.participations_of_player),
+        )
+
+    def aggregate(self, partial: Optional[Dict[str, int]]) -> Optional[float]:
+        if partial is None or partial['participations'] == 0:
             return None
+        else:
+            return partial['peaches'] / partial['participations']
 
 
 class Features:
@@ -154,24 +384,28 @@ class Features:
         'Damage per round',
         'The damage per round, averaged over all matches.',
         format = '{:.1f}',
+        vectorized = lambda mp: mp['adr'],
     )
 
     assists_per_death = ExpressionFeature(
         F_float('assists') / F_float('deaths'),
         'Assists per death',
         'The assists/death ratio, averaged over all matches.',
+        vectorized = lambda mp: np_divide(mp['assists'], mp['deaths']),
     )
 
     headshot_rate = ExpressionFeature(
         F_float('headshots') / F_float('kills'),
         'Headshot rate',
         'Headshots per kill.',
+        vectorized = lambda mp: np_divide(mp['headshots'], mp['kills']),
     )
 
     kills_per_death = ExpressionFeature(
         F_float('kills') / Max(F_float('deaths'), Value(1.0)),
         'Kills per death',
         'The kills/death ratio, averaged over all matches.',
+        vectorized = lambda mp: mp['kills'] / np.maximum(mp['deaths'], 1.0),
     )
 
     participation_effect = ParticipationEffect()
@@ -180,6 +414,7 @@ class Features:
         Sqrt((F_float('kills') / Max(F_float('deaths'), Value(1.0))) * (F_float('adr') / Value(100))),
         'Player value',
         'Geometric mean of kills per death ration and the average damage per round (divided by 100).',
+        vectorized = lambda mp: np.sqrt((mp['kills'] / np.maximum(mp['deaths'], 1.0)) * (mp['adr'] / 100)),
     )
 
     peach_rate = PeachRate()
@@ -0,0 +1,93 @@
+"""
+Registry of the matches which are currently being ingested (keyed by sharecode).
+
+When multiple squad members played the same match, their update tasks come across the same sharecode. The worker which
+first comes across the sharecode ingests the match (i.e. downloads and parses the demo, and creates the match), while
+the other workers wait for its result. The matches being ingested are also passed to the sharecode walk of other tasks
+(as :class:`InflightMatch` placeholders among the recent matches), so that their sharecodes are not even resolved.
+
+The registry is local to the process. Across processes, matches are deduplicated by the database.
+"""
+import concurrent.futures
+import logging
+import threading
+
+from cs2pb_typing import (
+    Callable,
+    Dict,
+    List,
+)
+
+log = logging.getLogger(__name__)
+
+INGEST_TIMEOUT = 30 * 60  # 30 minutes
+
+lock = threading.Lock()
+
+futures: Dict[str, concurrent.futures.Future] = dict()
+"""
+The futures of the matches which are currently being ingested, keyed by sharecode.
+"""
+
+
+class InflightMatch:
+    """
+    Placeholder for a match which is currently being ingested by another worker.
+    """
+
+    def __init__(self, sharecode: str):
+        self.sharecode = sharecode
+        self.pk = f'inflight:{sharecode}'
+
+
+def get_inflight_matches() -> List[InflightMatch]:
+    """
+    Get placeholders for the matches which are currently being ingested.
+    """
+    with lock:
+        return [InflightMatch(sharecode) for sharecode in futures.keys()]
+
+
+def ingest(sharecode: str, ingest_match: Callable):
+    """
+    Ingest a match using the `ingest_match` function, unless the match is already being ingested by another worker.
+    In the latter case, the result of the other worker is awaited and returned (or its error is raised).
+    """
+    with lock:
+        future = futures.get(sharecode)
+        is_owner = future is None
+        if is_owner:
+            future = futures[sharecode] = concurrent.futures.Future()
+
+    if not is_owner:
+        log.info(f'Waiting for match {sharecode}, which is being ingested by another worker')
+        return future.result(timeout = INGEST_TIMEOUT)
+
+    try:
+        pmatch = ingest_match()
+        future.set_result(pmatch)
+        return pmatch
+    except BaseException as error:
+        future.set_exception(error)
+        raise
+    finally:
+        with lock:
+            del futures[sharecode]
+
+
+def wait(sharecode: str):
+    """
+    Wait for a match, which was being ingested by another worker (see :class:`InflightMatch`), and return it.
+    """
+    from stats.models import Match
+    with lock:
+        future = futures.get(sharecode)
+    if future is not None:
+        log.info(f'Waiting for match {sharecode}, which is being ingested by another worker')
+        return future.result(timeout = INGEST_TIMEOUT)
+
+    # The ingestion has finished in the meantime
+    try:
+        return Match.objects.filter(sharecode = sharecode).latest('timestamp')
+    except Match.DoesNotExist:
+        raise RuntimeError(f'Ingestion of match {sharecode} by another worker failed')
@@ -0,0 +1,12 @@
+from accounts.models import Squad
+from stats.models import AccountedParticipation
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Refresh the accounted match participations of all squads (run daily, so that outdated sessions expire).'
+
+    def handle(self, *args, **options):
+        for squad in Squad.objects.all():
+            AccountedParticipation.refresh(squad)
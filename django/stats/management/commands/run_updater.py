@@ -0,0 +1,37 @@
+import threading
+
+from stats import (
+    scheduler,
+    updater,
+)
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Run the updater, which periodically queues update tasks and processes them using a pool of workers (runs '
+        'until interrupted).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type = int,
+            default = settings.UPDATER_WORKERS,
+            help = 'The number of worker threads.',
+        )
+
+    def handle(self, *args, **options):
+        stop_event = threading.Event()
+        pool = threading.Thread(target = updater.run_workers, args = (options['workers'], stop_event))
+        pool.start()
+        threading.Thread(target = scheduler.run_scheduler, args = (stop_event,), daemon = True).start()
+        try:
+            while pool.is_alive():
+                pool.join(timeout = 1)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping the workers after the current tasks...')
+            stop_event.set()
+            pool.join()
@@ -0,0 +1,37 @@
+# Generated by Django 4.1.13 on 2026-10-19 13:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_alter_squadmembership_position_and_more'),
+        ('stats', '0024_matchparticipation_old_rank_not_zero_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SessionAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('partials', models.JSONField(blank=True, default=dict)),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='session_aggregates', to='accounts.steamprofile')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='aggregates', to='stats.gamingsession')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RollingAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sessions', models.JSONField(blank=True, default=list)),
+                ('partials', models.JSONField(blank=True, default=dict)),
+                ('membership', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='rolling_aggregate', to='accounts.squadmembership')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='sessionaggregate',
+            constraint=models.UniqueConstraint(fields=('session', 'player'), name='unique_session_player'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.1.13 on 2026-10-19 13:22
+
+from django.db import migrations, models
+
+
+def forwards(apps, schema_editor):
+    # Discard the previously computed aggregates, so that they are recomputed including the buddies
+    SessionAggregate = apps.get_model('stats', 'SessionAggregate')
+    RollingAggregate = apps.get_model('stats', 'RollingAggregate')
+    SessionAggregate.objects.using(schema_editor.connection.alias).all().delete()
+    RollingAggregate.objects.using(schema_editor.connection.alias).all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0025_sessionaggregate_rollingaggregate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rollingaggregate',
+            name='buddies',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='sessionaggregate',
+            name='buddies',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.RunPython(forwards),
+    ]
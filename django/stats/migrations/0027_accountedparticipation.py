@@ -0,0 +1,33 @@
+# Generated by Django 4.1.13 on 2026-10-19 13:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_alter_squadmembership_position_and_more'),
+        ('stats', '0026_sessionaggregate_buddies'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountedParticipation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('participation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='accounted_participations', to='stats.matchparticipation')),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='accounted_participations', to='accounts.steamprofile')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='accounted_participations', to='stats.gamingsession')),
+                ('squad', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='accounted_participations', to='accounts.squad')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='accountedparticipation',
+            index=models.Index(fields=['squad', 'player'], name='stats_accou_squad_i_8d8c77_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='accountedparticipation',
+            constraint=models.UniqueConstraint(fields=('squad', 'participation'), name='unique_squad_participation'),
+        ),
+    ]
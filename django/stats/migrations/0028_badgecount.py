@@ -0,0 +1,63 @@
+# Generated by Django 4.1.13 on 2026-10-19 13:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def forwards(apps, schema_editor):
+    # Count the badges which were awarded before the badge counts were maintained
+    db_alias = schema_editor.connection.alias
+    BadgeCount = apps.get_model('stats', 'BadgeCount')
+    GamingSession = apps.get_model('stats', 'GamingSession')
+    MatchBadge = apps.get_model('stats', 'MatchBadge')
+    PlayerOfTheWeek = apps.get_model('stats', 'PlayerOfTheWeek')
+    badge_counts = list()
+    for player_id, slug, count, frequency in MatchBadge.objects.using(db_alias).values_list(
+        'participation__player', 'badge_type',
+    ).annotate(total_count = models.Count('pk'), total_frequency = models.Sum('frequency')).order_by():
+        badge_counts.append(
+            BadgeCount(player_id = player_id, squad = None, slug = slug, count = count, frequency = frequency)
+        )
+    for position in (1, 2, 3):
+        for player_id, squad_id, count in PlayerOfTheWeek.objects.using(db_alias).exclude(
+            **{f'player{position}': None},
+        ).values_list(f'player{position}', 'squad').annotate(count = models.Count('pk')).order_by():
+            badge_counts.append(
+                BadgeCount(
+                    player_id = player_id, squad_id = squad_id, slug = f'potw-{position}', count = count, frequency = count,
+                )
+            )
+    for player_id, squad_id, count in GamingSession.objects.using(db_alias).exclude(
+        rising_star = None,
+    ).values_list('rising_star', 'squad').annotate(count = models.Count('pk')).order_by():
+        badge_counts.append(
+            BadgeCount(player_id = player_id, squad_id = squad_id, slug = 'rising-star', count = count, frequency = count)
+        )
+    BadgeCount.objects.using(db_alias).bulk_create(badge_counts)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_squad_stats_timestamp'),
+        ('stats', '0027_accountedparticipation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BadgeCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.SlugField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('frequency', models.PositiveIntegerField(default=0)),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='badge_counts', to='accounts.steamprofile')),
+                ('squad', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='badge_counts', to='accounts.squad')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='badgecount',
+            index=models.Index(fields=['player', 'squad', 'slug'], name='stats_badge_player__c64e8a_idx'),
+        ),
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.1.13 on 2026-10-19 13:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0028_badgecount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='updatetask',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='updatetask',
+            name='heartbeat_timestamp',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='updatetask',
+            name='lease_expiry',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='updatetask',
+            name='lease_owner',
+            field=models.CharField(blank=True, default='', max_length=200, verbose_name='Worker'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.1.13 on 2026-10-19 13:47
+
+from django.db import migrations, models
+
+
+def forwards(apps, schema_editor):
+    # Coalesce the queued tasks of each account into the earliest one
+    UpdateTask = apps.get_model('stats', 'UpdateTask')
+    queued_tasks = UpdateTask.objects.using(schema_editor.connection.alias).filter(
+        completion_timestamp = None,
+        execution_timestamp = None,
+    ).order_by('account', 'scheduling_timestamp', 'pk')
+    kept_accounts = set()
+    for task in queued_tasks:
+        if task.account_id in kept_accounts:
+            task.delete()
+        else:
+            kept_accounts.add(task.account_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0029_updatetask_lease'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='updatetask',
+            constraint=models.UniqueConstraint(condition=models.Q(('completion_timestamp', None), ('execution_timestamp', None)), fields=('account',), name='unique_queued_update_task'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-19 13:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0030_unique_queued_update_task'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='updatetask',
+            name='stages',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
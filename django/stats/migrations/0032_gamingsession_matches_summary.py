@@ -0,0 +1,49 @@
+# Generated by Django 4.1.13 on 2026-10-19 13:54
+
+from django.db import migrations, models
+
+
+def forwards(apps, schema_editor):
+    # Summarize the matches of the existing sessions
+    GamingSession = apps.get_model('stats', 'GamingSession')
+    for session in GamingSession.objects.using(schema_editor.connection.alias).all():
+        matches = session.matches.order_by('timestamp').values_list('timestamp', 'duration')
+        first_match, last_match = matches.first(), matches.last()
+        session.started_ts = None if first_match is None else first_match[0]
+        session.ended_ts = None if last_match is None else sum(last_match)
+        session.match_count = matches.count()
+        session.save(update_fields = ['started_ts', 'ended_ts', 'match_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0031_updatetask_stages'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gamingsession',
+            name='ended_ts',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='gamingsession',
+            name='match_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='gamingsession',
+            name='started_ts',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='gamingsession',
+            index=models.Index(fields=['squad', 'started_ts'], name='stats_gamin_squad_i_4aea13_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gamingsession',
+            index=models.Index(fields=['squad', 'ended_ts'], name='stats_gamin_squad_i_cbaff7_idx'),
+        ),
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
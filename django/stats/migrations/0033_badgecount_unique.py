@@ -0,0 +1,39 @@
+# Generated by Django 4.1.13 on 2026-10-19 14:06
+
+from django.db import migrations, models
+
+
+def forwards(apps, schema_editor):
+    # Remove the badge counts which were duplicated by concurrent updates (the duplicates are copies of each other)
+    BadgeCount = apps.get_model('stats', 'BadgeCount')
+    badge_counts = BadgeCount.objects.using(schema_editor.connection.alias).order_by('player', 'squad', 'slug', '-pk')
+    kept_keys = set()
+    for badge_count in badge_counts:
+        key = (badge_count.player_id, badge_count.squad_id, badge_count.slug)
+        if key in kept_keys:
+            badge_count.delete()
+        else:
+            kept_keys.add(key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0032_gamingsession_matches_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='badgecount',
+            name='stats_badge_player__c64e8a_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='badgecount',
+            constraint=models.UniqueConstraint(fields=('player', 'squad', 'slug'), name='unique_badge_count'),
+        ),
+        migrations.AddConstraint(
+            model_name='badgecount',
+            constraint=models.UniqueConstraint(condition=models.Q(('squad', None)), fields=('player', 'slug'), name='unique_badge_count_without_squad'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.1.13 on 2026-10-19 14:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_squad_stats_timestamp'),
+        ('stats', '0033_badgecount_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('squad', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='data_version', serialize=False, to='accounts.squad')),
+                ('version', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+    ]
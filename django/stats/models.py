@@ -8,10 +8,13 @@ import numpy as np
 from accounts.models import (
     Account,
     Squad,
+    SquadMembership,
     SteamProfile,
 )
 from cs2pb_typing import (
+    Dict,
     FrozenSet,
+    Iterable,
     List,
     Literal,
     Optional,
@@ -25,17 +28,33 @@ from django.core.exceptions import (
     ObjectDoesNotExist,
 )
 from django.db import (
+    IntegrityError,
     models,
     transaction,
 )
 from django.db.models import (
     Avg,
+    Count,
     F,
+    OuterRef,
+    Q,
     QuerySet,
+    Subquery,
+    Sum,
+)
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
 )
-from django.db.models.signals import m2m_changed
 
-from . import potw
+from . import (
+    inflight,
+    pagecache,
+    potw,
+    timing,
+)
 
 log = logging.getLogger(__name__)
 
@@ -82,23 +101,78 @@ class GamingSession(models.Model):
     The player who was the rising star of the session (if any).
     """
 
+    started_ts = models.PositiveBigIntegerField(null = True, blank = True)
+    """
+    The CSGO timestamp of the first match of the session (None if the session has no matches). This is maintained
+    whenever matches are added to or removed from the session (see :meth:`update_matches_summary`).
+    """
+
+    ended_ts = models.PositiveBigIntegerField(null = True, blank = True)
+    """
+    The CSGO timestamp of the last match of the session plus the duration of the match (None if the session has no
+    matches). This is maintained whenever matches are added to or removed from the session.
+    """
+
+    match_count = models.PositiveIntegerField(default = 0)
+    """
+    The number of matches of the session. This is maintained whenever matches are added to or removed from the session.
+    """
+
+    class Meta:
+
+        indexes = [
+            models.Index(fields = ['squad', 'started_ts']),
+            models.Index(fields = ['squad', 'ended_ts']),
+        ]
+        """
+        The sessions of a squad are looked up by their start and end (e.g., to find the last session of a squad).
+        """
+
+    def update_matches_summary(self) -> None:
+        """
+        Update the :attr:`started_ts`, :attr:`ended_ts`, and :attr:`match_count` fields from the matches of the
+        session.
+        """
+        matches = self.matches.order_by('timestamp').values_list('timestamp', 'duration')
+        first_match, last_match = matches.first(), matches.last()
+        self.started_ts = None if first_match is None else first_match[0]
+        self.ended_ts = None if last_match is None else sum(last_match)
+        self.match_count = matches.count()
+        GamingSession.objects.filter(pk = self.pk).update(
+            started_ts = self.started_ts,
+            ended_ts = self.ended_ts,
+            match_count = self.match_count,
+        )
+
+    @staticmethod
+    def update_matches_summaries(session_pks: Iterable[int]) -> None:
+        """
+        Update the :attr:`started_ts`, :attr:`ended_ts`, and :attr:`match_count` fields of the given sessions.
+        """
+        for session in GamingSession.objects.filter(pk__in = list(session_pks)):
+            session.update_matches_summary()
+
     def close(self) -> None:
         """
         Close the session.
         """
         from .features import (
-            FeatureContext,
+            ColumnarFeatureContext,
             Features,
         )
 
         was_already_closed = self.is_closed
         self.is_closed = True
-        self.save()
+        self.save(update_fields = ['is_closed'])
 
         # Ensure that the session is not closed twice
         if was_already_closed:
             return
 
+        # Compute the partial aggregates of the features, which are merged into the stats of the squad members
+        SessionAggregate.compute(self)
+        AccountedParticipation.refresh(self.squad)
+
         # Process the participated squad members
         participated_steamids = self.participated_steamids
         comments: List[str] = list()
@@ -114,7 +188,7 @@ class GamingSession(models.Model):
 
             # Compute the PV of the player in this session
             feature_contexts[m.player.steamid] = (
-                ctx := FeatureContext(
+                ctx := ColumnarFeatureContext(
                     MatchParticipation.objects.filter(player = m.player, pmatch__sessions = self),
                     m.player,
                 )
@@ -194,7 +268,7 @@ class GamingSession(models.Model):
                 )
                 notification.attach(plot)
             self.rising_star = top_player
-            self.save()
+            self.save(update_fields = ['rising_star'])
 
     @staticmethod
     def sessions_changed(sender, action, pk_set, instance, **kwargs):
@@ -213,7 +287,7 @@ class GamingSession(models.Model):
                         f'since a new closed session of the same squad exists'
                     )
                     session.is_closed = True
-                    session.save()
+                    session.save(update_fields = ['is_closed'])
 
     @property
     def participated_steamids(self) -> FrozenSet[str]:
@@ -265,7 +339,7 @@ class GamingSession(models.Model):
         """
         Get the first match of the session, or `None` if the session has no matches.
         """
-        if not self.matches.exists():
+        if self.match_count == 0:
             return None
         return self.matches.earliest('timestamp')
 
@@ -274,7 +348,7 @@ class GamingSession(models.Model):
         """
         Get the last match of the session, or `None` if the session has no matches.
         """
-        if not self.matches.exists():
+        if self.match_count == 0:
             return None
         return self.matches.latest('timestamp')
 
@@ -283,7 +357,7 @@ class GamingSession(models.Model):
         """
         The CSGO timestamp of the first match of the session, or `None` if the session has no matches.
         """
-        return None if self.first_match is None else self.first_match.timestamp
+        return self.started_ts
 
     @property
     def ended(self) -> Optional[int]:
@@ -291,66 +365,63 @@ class GamingSession(models.Model):
         The CSGO timestamp of the last match of the session plus the duration of the match (in seconds), or `None` if
         the session has no matches.
         """
-        return None if self.last_match is None else self.last_match.ended_timestamp
+        return self.ended_ts
 
     @property
     def started_date_and_time(self) -> str:
         """
         Get the human-readable date and time of the start of the session.
         """
-        return '-' if self.first_match is None else self.first_match.date_and_time
+        return '-' if self.started_ts is None else csgo_timestamp_to_strftime(self.started_ts)
 
     @property
     def started_date(self) -> str:
         """
         Get the human-readable date of the start of the session.
         """
-        return '-' if self.first_match is None else self.first_match.date
+        return '-' if self.started_ts is None else csgo_timestamp_to_strftime(self.started_ts, fmt = r'%b %-d, %Y')
 
     @property
     def started_time(self) -> str:
         """
         Get the human-readable time of the start of the session.
         """
-        return '-' if self.first_match is None else self.first_match.time
+        return '-' if self.started_ts is None else csgo_timestamp_to_strftime(self.started_ts, fmt = r'%H:%M')
 
     @property
     def ended_date_and_time(self) -> str:
         """
         Get the human-readable date and time of the end of the session.
         """
-        return '-' if self.last_match is None else self.last_match.ended_date_and_time
+        return '-' if self.ended_ts is None else csgo_timestamp_to_strftime(self.ended_ts)
 
     @property
     def ended_time(self) -> str:
         """
         Get the human-readable time of the end of the session.
         """
-        return '-' if self.last_match is None else self.last_match.ended_time
+        return '-' if self.ended_ts is None else csgo_timestamp_to_strftime(self.ended_ts, fmt = r'%H:%M')
 
     @property
     def started_weekday(self) -> str:
         """
         Get the human-readable weekday of the start of the session.
         """
-        return '-' if self.first_match is None else self.first_match.weekday
+        return '-' if self.started_ts is None else csgo_timestamp_to_strftime(self.started_ts, fmt = r'%A')
 
     @property
     def started_weekday_short(self) -> str:
         """
         Get the human-readable abbreviation of the weekday of the start of the session.
         """
-        return '-' if self.first_match is None else self.first_match.weekday_short
+        return '-' if self.started_ts is None else csgo_timestamp_to_strftime(self.started_ts, fmt = r'%a')
 
     def __str__(self) -> str:
         """
         Get the string representation of the gaming session.
         """
-        try:
-            if self.matches.all().exists():
-                return f'{self.started_date_and_time} — {self.ended_date_and_time} ({self.pk})'
-        except:  # noqa: E722
-            pass
+        if self.match_count > 0:
+            return f'{self.started_date_and_time} — {self.ended_date_and_time} ({self.pk})'
         return f'Empty Gaming Session ({self.pk})'
 
 
@@ -490,7 +561,7 @@ class Match(models.Model):
         import cs2_client
         cs2_client.fetch_match_details(data)
 
-        with transaction.atomic():
+        with transaction.atomic(), timing.stage('create_match'):
             m = Match()
             m.sharecode = data['sharecode']
             m.timestamp = data['timestamp']
@@ -1271,6 +1342,142 @@ class UpdateTask(models.Model):
     The timestamp when the task completed.
     """
 
+    lease_owner = models.CharField(max_length = 200, blank = True, default = '', verbose_name = 'Worker')
+    """
+    The worker which currently holds the lease of the task (empty if the task is not leased).
+    """
+
+    lease_expiry = models.PositiveBigIntegerField(null = True, blank = True)
+    """
+    The timestamp when the lease of the task expires. The lease is renewed by the heartbeat of the worker, so that the
+    task can be claimed by another worker after the lease expired (e.g., if the worker has crashed). If the task is not
+    leased, but the lease expiry is in the future, then the task is held back for a retry.
+    """
+
+    heartbeat_timestamp = models.PositiveBigIntegerField(null = True, blank = True)
+    """
+    The timestamp of the most recent heartbeat of the worker which holds the lease.
+    """
+
+    attempts = models.PositiveSmallIntegerField(default = 0)
+    """
+    The number of times the task has been claimed by a worker.
+    """
+
+    stages = models.JSONField(default = dict, blank = True)
+    """
+    The total durations (in seconds) and counts of the stages of the most recent run of the task (see
+    :mod:`stats.timing`), e.g. ``{"parse_demo": {"duration": 12.3, "count": 2}}``.
+    """
+
+    class Meta:
+
+        constraints = [
+            models.UniqueConstraint(
+                fields = ['account'],
+                condition = Q(completion_timestamp = None, execution_timestamp = None),
+                name = 'unique_queued_update_task',
+            )
+        ]
+        """
+        There can be at most one queued task per account (that is, a task which has not started executing yet), so that
+        later requests for an update of the account are absorbed by the queued task.
+        """
+
+    @staticmethod
+    def claim(worker: str, lease_duration: int, max_attempts: int) -> Optional[Self]:
+        """
+        Claim a pending task for a worker, or return None if there is no task to be claimed.
+
+        Tasks which are leased by other workers (or whose lease has not expired yet) cannot be claimed, and neither
+        can tasks of accounts for which another task is currently being run. Claiming is atomic, so that a task is
+        never run by two workers concurrently (unless the lease expires).
+
+        Tasks which have been attempted `max_attempts` times and whose lease has expired (e.g., because the worker
+        crashed) are given up and marked as completed.
+        """
+        now = int(datetime.timestamp(datetime.now()))
+        not_leased = Q(lease_expiry = None) | Q(lease_expiry__lte = now)
+        UpdateTask.objects.filter(
+            not_leased,
+            completion_timestamp = None,
+            attempts__gte = max_attempts,
+        ).update(
+            lease_owner = '',
+            lease_expiry = None,
+            completion_timestamp = now,
+        )
+        claimable = Q(completion_timestamp = None, attempts__lt = max_attempts) & not_leased
+        busy_accounts = UpdateTask.objects.filter(
+            completion_timestamp = None,
+            lease_expiry__gt = now,
+        ).exclude(
+            lease_owner = '',
+        ).values('account')
+        for task_pk in UpdateTask.objects.filter(
+            claimable,
+        ).exclude(
+            account__in = busy_accounts,
+        ).order_by(
+            '-scheduling_timestamp',
+        ).values_list(
+            'pk',
+            flat = True,
+        )[:10]:
+            if UpdateTask.objects.filter(claimable, pk = task_pk).update(
+                lease_owner = worker,
+                lease_expiry = now + lease_duration,
+                heartbeat_timestamp = now,
+                attempts = F('attempts') + 1,
+            ):
+                return UpdateTask.objects.get(pk = task_pk)
+        return None
+
+    def renew_lease(self, lease_duration: int) -> bool:
+        """
+        Renew the lease of the task (heartbeat). Returns False if the lease has been lost to another worker.
+        """
+        now = int(datetime.timestamp(datetime.now()))
+        self.lease_expiry = now + lease_duration
+        self.heartbeat_timestamp = now
+        return UpdateTask.objects.filter(pk = self.pk, lease_owner = self.lease_owner).update(
+            lease_expiry = self.lease_expiry,
+            heartbeat_timestamp = self.heartbeat_timestamp,
+        ) > 0
+
+    def release(self, retry_delay: int = 0, give_up: bool = False) -> None:
+        """
+        Release the lease of the task. If the task has not been completed, it can be claimed again after the retry
+        delay, unless `give_up` is True (then the task is marked as completed, e.g. after it has failed too often).
+        """
+        now = int(datetime.timestamp(datetime.now()))
+        lease_expiry = now + retry_delay if retry_delay > 0 else None
+        updates = dict(lease_owner = '', lease_expiry = lease_expiry)
+        if give_up and self.completion_timestamp is None:
+            updates['completion_timestamp'] = now
+        UpdateTask.objects.filter(pk = self.pk, lease_owner = self.lease_owner).update(**updates)
+        for field, value in updates.items():
+            setattr(self, field, value)
+
+    def save_if_leased(self, update_fields: List[str]) -> bool:
+        """
+        Save fields of the task, unless the lease has been lost to another worker meanwhile (so that a stale worker
+        does not overwrite the task, e.g. the lease of the new worker). Returns False if the lease has been lost.
+        """
+        if self.pk is None:
+            self.save()
+            return True
+        return UpdateTask.objects.filter(pk = self.pk, lease_owner = self.lease_owner).update(
+            **{field: getattr(self, field) for field in update_fields}
+        ) > 0
+
+    def save_stages(self, stages: Dict[str, Dict[str, float]]) -> None:
+        """
+        Save the stages recorded for the most recent run of the task.
+        """
+        self.stages = stages
+        UpdateTask.objects.filter(pk = self.pk).update(stages = stages)
+
     @property
     def scheduling_datetime(self) -> datetime:
         """
@@ -1336,7 +1543,9 @@ class UpdateTask(models.Model):
         import cs2_client
 
         self.execution_timestamp = datetime.timestamp(datetime.now())
-        self.save()
+        if not self.save_if_leased(['execution_timestamp']):
+            log.warning(f'Lost the lease of the update task for {self.account.steamid} before running it')
+            return
 
         if self.account.enabled and settings.CSGO_API_ENABLED:
             try:
@@ -1347,10 +1556,11 @@ class UpdateTask(models.Model):
                 # Determine if this is the inital update for the account
                 is_initial_update = (len(self.account.last_sharecode) == 0)
 
-                new_match_data: list[dict | Match] = cs2_client.fetch_matches(
+                # The matches being ingested by other workers are passed as recent matches, so they are not resolved
+                new_match_data: list[dict | Match | inflight.InflightMatch] = cs2_client.fetch_matches(
                     first_sharecode,
                     cs2_client.SteamAPIUser(self.account.steamid, self.account.steam_auth),
-                    list(recent_matches),
+                    list(recent_matches) + inflight.get_inflight_matches(),
 
                     # Only process the match for `first_sharecode` if this is the inital update for the account
                     skip_first = not is_initial_update,
@@ -1358,8 +1568,10 @@ class UpdateTask(models.Model):
 
                 for match_data in new_match_data:
                     if isinstance(match_data, dict):
-                        pmatch: Match = Match.from_summary(match_data)
+                        pmatch: Match = inflight.ingest(match_data['sharecode'], lambda: Match.from_summary(match_data))
                         recent_matches.append(pmatch)
+                    elif isinstance(match_data, inflight.InflightMatch):
+                        pmatch: Match = inflight.wait(match_data.sharecode)
                     else:
                         pmatch: Match = match_data
 
@@ -1372,16 +1584,653 @@ class UpdateTask(models.Model):
                             pmatch__timestamp__lt = pmatch.timestamp,
                         )
                     )
-                    MatchBadge.award_with_history(participation, list(old_participations))
+                    with timing.stage('award_badges'):
+                        MatchBadge.award_with_history(participation, list(old_participations))
 
             except cs2_client.InvalidSharecodeError:
                 self.account.enabled = False
                 self.account.save()
 
         self.completion_timestamp = datetime.timestamp(datetime.now())
-        self.save()
+        self.save_if_leased(['completion_timestamp'])
 
         self.account.handle_finished_update()
 
-        kept_tasks = UpdateTask.objects.order_by('-scheduling_timestamp')[:100]
-        UpdateTask.objects.exclude(pk__in = kept_tasks.values_list('pk', flat = True)).delete()
+        # Prune the history of the completed tasks (pending tasks must be kept, since they are still being worked on,
+        # and so must the most recent task of each account, since the scheduler polls the accounts based on it)
+        completed_tasks = UpdateTask.objects.filter(completion_timestamp__isnull = False)
+        kept_tasks = completed_tasks.order_by('-scheduling_timestamp')[:100]
+        latest_task = UpdateTask.objects.filter(
+            account = OuterRef('account'),
+        ).order_by(
+            '-scheduling_timestamp',
+        ).values('pk')[:1]
+        completed_tasks.exclude(
+            pk__in = kept_tasks.values_list('pk', flat = True),
+        ).exclude(
+            pk = Subquery(latest_task),
+        ).delete()
+
+
+class SessionAggregate(models.Model):
+    """
+    The partial aggregates of the features of a squad member for a closed gaming session.
+
+    The partial aggregates of the sessions within the last 30 days are merged into the :class:`RollingAggregate` of the
+    squad member, so that the stats can be updated without scanning the match history.
+    """
+
+    session = models.ForeignKey(GamingSession, related_name = 'aggregates', on_delete = models.CASCADE)
+    """
+    The gaming session.
+    """
+
+    player = models.ForeignKey(SteamProfile, related_name = 'session_aggregates', on_delete = models.CASCADE)
+    """
+    The squad member (who did not necessarily participate in the session).
+    """
+
+    partials = models.JSONField(default = dict, blank = True)
+    """
+    The partial aggregates of the features (by feature slug).
+    """
+
+    buddies = models.JSONField(default = dict, blank = True)
+    """
+    The partial aggregates of the player value with and without each other squad member (by Steam ID of the buddy).
+    """
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields = ['session', 'player'], name = 'unique_session_player',
+            )
+        ]
+
+    @staticmethod
+    def compute(session: GamingSession) -> List[Self]:
+        """
+        Compute the partial aggregates of the features of all squad members for a session.
+
+        Previously computed partial aggregates of the session are replaced. The session is locked while its partial
+        aggregates are replaced, and if they are replaced concurrently nonetheless (e.g., by a database without row
+        locks), the partial aggregates stored by the concurrent computation are returned.
+        """
+        from .features import (
+            ColumnarFeatureContext,
+            Features,
+        )
+        ctx = ColumnarFeatureContext(session.squad.match_participations(pmatch__sessions = session), None)
+        participations = ctx.participations_universe
+        players = [m.player for m in session.squad.memberships.select_related('player')]
+
+        # Determine the matches with participation of each squad member
+        with_player = dict()
+        for player in players:
+            player_matches = participations['pmatch'][participations['player'] == player.pk]
+            with_player[player.pk] = np.isin(participations['pmatch'], player_matches)
+
+        def accumulate_buddies(player):
+            player_ctx = ctx.for_player(player)
+            return {
+                buddy.pk: {
+                    'with': Features.player_value.accumulate_columns(player_ctx.filter(with_player[buddy.pk])),
+                    'without': Features.player_value.accumulate_columns(player_ctx.filter(~with_player[buddy.pk])),
+                }
+                for buddy in players if buddy.pk != player.pk
+            }
+
+        session_aggregates = [
+            SessionAggregate(
+                session = session,
+                player = player,
+                partials = {
+                    feature.slug: feature.accumulate_columns(ctx.for_player(player))
+                    for feature in Features.all
+                },
+                buddies = accumulate_buddies(player),
+            )
+            for player in players
+        ]
+        try:
+            with transaction.atomic():
+                GamingSession.objects.select_for_update().get(pk = session.pk)
+                SessionAggregate.objects.filter(session = session).delete()
+                return SessionAggregate.objects.bulk_create(session_aggregates)
+        except IntegrityError:
+            return list(SessionAggregate.objects.filter(session = session))
+
+    @staticmethod
+    def invalidate(sessions: QuerySet) -> None:
+        """
+        Discard the partial aggregates of sessions, and the running aggregates which they were merged into.
+        """
+        deleted, _ = SessionAggregate.objects.filter(session__in = sessions).delete()
+        if deleted > 0:
+            RollingAggregate.objects.filter(
+                membership__squad__in = sessions.values_list('squad', flat = True),
+            ).delete()
+
+
+class RollingAggregate(models.Model):
+    """
+    The running aggregates of the features of a squad member over the sessions within the last 30 days.
+
+    The running aggregates are updated incrementally, by merging the partial aggregates of newly closed sessions. Only
+    if sessions leave the 30-days window, the running aggregates are rebuilt from the partial aggregates of the
+    remaining sessions.
+    """
+
+    membership = models.OneToOneField(
+        SquadMembership,
+        related_name = 'rolling_aggregate',
+        on_delete = models.CASCADE,
+    )
+    """
+    The squad membership.
+    """
+
+    sessions = models.JSONField(default = list, blank = True)
+    """
+    The primary keys of the sessions merged into the running aggregates.
+    """
+
+    partials = models.JSONField(default = dict, blank = True)
+    """
+    The running aggregates of the features (by feature slug).
+    """
+
+    buddies = models.JSONField(default = dict, blank = True)
+    """
+    The running aggregates of the player value with and without each other squad member (by Steam ID of the buddy).
+    """
+
+    @staticmethod
+    def update(membership: SquadMembership) -> Self:
+        """
+        Update the running aggregates of a squad member, so that they correspond to the accounted sessions.
+        """
+        from .features import Features
+        feature_slugs = frozenset(feature.slug for feature in Features.all)
+        rolling_aggregate, changed = RollingAggregate.objects.get_or_create(membership = membership)
+        accounted_sessions = frozenset(membership.squad.accounted_sessions.values_list('pk', flat = True))
+        merged_sessions = frozenset(rolling_aggregate.sessions)
+
+        # Rebuild the running aggregates if sessions have left the window or the feature set has changed
+        if not merged_sessions <= accounted_sessions or (
+            len(merged_sessions) > 0 and rolling_aggregate.partials.keys() != feature_slugs
+        ):
+            merged_sessions = frozenset()
+            rolling_aggregate.partials = dict()
+            rolling_aggregate.buddies = dict()
+            changed = True
+
+        # Merge the partial aggregates of the sessions which have entered the window
+        new_sessions = accounted_sessions - merged_sessions
+        session_aggregates = {
+            session_aggregate.session_id: session_aggregate for session_aggregate in SessionAggregate.objects.filter(
+                session__in = new_sessions,
+                player__pk = membership.player_id,
+            )
+        }
+        for session_pk in sorted(new_sessions):
+            session_aggregate = session_aggregates.get(session_pk)
+
+            # Compute the partial aggregates if they are missing or outdated
+            if session_aggregate is None or session_aggregate.partials.keys() != feature_slugs:
+                session_aggregate = [
+                    session_aggregate
+                    for session_aggregate in SessionAggregate.compute(GamingSession.objects.get(pk = session_pk))
+                    if session_aggregate.player_id == membership.player_id
+                ][0]
+
+            for feature in Features.all:
+                rolling_aggregate.partials[feature.slug] = feature.merge(
+                    rolling_aggregate.partials.get(feature.slug),
+                    session_aggregate.partials[feature.slug],
+                )
+
+            for buddy_steamid, buddy_partials in session_aggregate.buddies.items():
+                rolling_buddy_partials = rolling_aggregate.buddies.setdefault(buddy_steamid, dict())
+                for key in ('with', 'without'):
+                    rolling_buddy_partials[key] = Features.player_value.merge(
+                        rolling_buddy_partials.get(key),
+                        buddy_partials[key],
+                    )
+
+            changed = True
+
+        if changed:
+            rolling_aggregate.sessions = sorted(accounted_sessions)
+            rolling_aggregate.save()
+        return rolling_aggregate
+
+
+class AccountedParticipation(models.Model):
+    """
+    A match participation which is accounted for the performance of the squad members within the last 30 days.
+
+    The accounted match participations are materialized from the accounted sessions of the squad (see
+    :meth:`refresh`), so that they do not need to be determined for each access.
+    """
+
+    squad = models.ForeignKey(Squad, related_name = 'accounted_participations', on_delete = models.CASCADE)
+    """
+    The squad.
+    """
+
+    player = models.ForeignKey(SteamProfile, related_name = 'accounted_participations', on_delete = models.CASCADE)
+    """
+    The player who participated in the match.
+    """
+
+    session = models.ForeignKey(GamingSession, related_name = 'accounted_participations', on_delete = models.CASCADE)
+    """
+    The gaming session of the squad, which the match belongs to.
+    """
+
+    participation = models.ForeignKey(
+        MatchParticipation,
+        related_name = 'accounted_participations',
+        on_delete = models.CASCADE,
+    )
+    """
+    The match participation.
+    """
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields = ['squad', 'participation'], name = 'unique_squad_participation',
+            )
+        ]
+        indexes = [
+            models.Index(fields = ['squad', 'player']),
+        ]
+
+    @staticmethod
+    def refresh(squad: Squad) -> None:
+        """
+        Refresh the accounted match participations of a squad.
+
+        Participations of sessions which have left the 30-days window are removed, and those of sessions which have
+        entered the window are added.
+        """
+        accounted_sessions = frozenset(squad.accounted_sessions.values_list('pk', flat = True))
+        with transaction.atomic():
+
+            # Lock the squad, so that concurrent refreshes do not add the same participations twice
+            Squad.objects.select_for_update().get(pk = squad.pk)
+            stored_sessions = frozenset(
+                AccountedParticipation.objects.filter(squad = squad).values_list('session', flat = True).distinct()
+            )
+            if accounted_sessions == stored_sessions:
+                return
+            AccountedParticipation.objects.filter(
+                squad = squad,
+            ).exclude(
+                session__in = accounted_sessions,
+            ).delete()
+            for session_pk in accounted_sessions - stored_sessions:
+                AccountedParticipation.objects.bulk_create(
+                    [
+                        AccountedParticipation(
+                            squad = squad,
+                            player_id = player_pk,
+                            session_id = session_pk,
+                            participation_id = participation_pk,
+                        )
+                        for participation_pk, player_pk in squad.match_participations(
+                            pmatch__sessions = session_pk,
+                        ).values_list('pk', 'player')
+                    ]
+                )
+
+    @staticmethod
+    def invalidate(sessions: QuerySet) -> None:
+        """
+        Discard the accounted match participations of sessions (they are added again by the next refresh).
+        """
+        AccountedParticipation.objects.filter(session__in = sessions).delete()
+
+
+class BadgeCount(models.Model):
+    """
+    The number of badges of a specific type, which a player has earned in a squad.
+
+    The badge counts are maintained when badges are awarded or deleted (see the ``update_*`` methods), so that the
+    badge summaries of a player can be read without counting the badges for each access.
+    """
+
+    player = models.ForeignKey(SteamProfile, related_name = 'badge_counts', on_delete = models.CASCADE)
+    """
+    The player who earned the badges.
+    """
+
+    squad = models.ForeignKey(
+        Squad,
+        related_name = 'badge_counts',
+        on_delete = models.CASCADE,
+        null = True,
+        blank = True,
+    )
+    """
+    The squad, in which the badges were earned (or None for match badges, which are independent of squads).
+    """
+
+    slug = models.SlugField()
+    """
+    The slug of the badge type (e.g., ``potw-1``, ``rising-star``, or the slug of a :class:`MatchBadgeType`).
+    """
+
+    count = models.PositiveIntegerField(default = 0)
+    """
+    The number of badges.
+    """
+
+    frequency = models.PositiveIntegerField(default = 0)
+    """
+    The total frequency of the badges (a match badge can be achieved multiple times within a single match).
+    """
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields = ['player', 'squad', 'slug'], name = 'unique_badge_count',
+            ),
+            models.UniqueConstraint(
+                fields = ['player', 'slug'], condition = Q(squad = None), name = 'unique_badge_count_without_squad',
+            ),
+        ]
+        """
+        There is at most one badge count per player, squad, and badge type (the second constraint is required, since
+        the first does not apply to badge counts without a squad).
+        """
+
+    @staticmethod
+    def _replace(qs: QuerySet, badge_counts: List[Self]) -> None:
+        """
+        Replace the badge counts of a query set. The badge counts are updated in place, so that concurrent updates
+        (e.g., by the workers of the updater) cannot duplicate them.
+        """
+        with transaction.atomic():
+            kept_pks = [
+                BadgeCount.objects.update_or_create(
+                    player_id = badge_count.player_id,
+                    squad_id = badge_count.squad_id,
+                    slug = badge_count.slug,
+                    defaults = dict(count = badge_count.count, frequency = badge_count.frequency),
+                )[0].pk
+                for badge_count in badge_counts
+            ]
+            qs.exclude(pk__in = kept_pks).delete()
+
+    @staticmethod
+    def update_match_badges(player_id: str, slug: str) -> None:
+        """
+        Update the number of match badges of a specific type, which a player has earned.
+        """
+        aggregate = MatchBadge.objects.filter(
+            participation__player__pk = player_id,
+            badge_type__pk = slug,
+        ).aggregate(
+            count = Count('pk'),
+            frequency = Sum('frequency'),
+        )
+        BadgeCount._replace(
+            BadgeCount.objects.filter(player__pk = player_id, squad = None, slug = slug),
+            [
+                BadgeCount(player_id = player_id, squad = None, slug = slug, **aggregate),
+            ] if aggregate['count'] > 0 else [],
+        )
+
+    @staticmethod
+    def update_potw_badges(squad_id) -> None:
+        """
+        Update the number of Player of the Week badges, which the members of a squad have earned.
+        """
+        badge_counts = list()
+        for position in (1, 2, 3):
+            for player_id, count in PlayerOfTheWeek.objects.filter(
+                squad__pk = squad_id,
+            ).exclude(
+                **{f'player{position}': None},
+            ).values_list(
+                f'player{position}',
+            ).annotate(
+                count = Count('pk'),
+            ).order_by():
+                badge_counts.append(
+                    BadgeCount(
+                        player_id = player_id,
+                        squad_id = squad_id,
+                        slug = f'potw-{position}',
+                        count = count,
+                        frequency = count,
+                    )
+                )
+        BadgeCount._replace(
+            BadgeCount.objects.filter(squad__pk = squad_id, slug__in = ['potw-1', 'potw-2', 'potw-3']),
+            badge_counts,
+        )
+
+    @staticmethod
+    def update_rising_star_badges(squad_id) -> None:
+        """
+        Update the number of Rising Star badges, which the members of a squad have earned.
+        """
+        BadgeCount._replace(
+            BadgeCount.objects.filter(squad__pk = squad_id, slug = 'rising-star'),
+            [
+                BadgeCount(
+                    player_id = player_id,
+                    squad_id = squad_id,
+                    slug = 'rising-star',
+                    count = count,
+                    frequency = count,
+                )
+                for player_id, count in GamingSession.objects.filter(
+                    squad__pk = squad_id,
+                ).exclude(
+                    rising_star = None,
+                ).values_list(
+                    'rising_star',
+                ).annotate(
+                    count = Count('pk'),
+                ).order_by()
+            ],
+        )
+
+    @staticmethod
+    def summarize(squad: Squad, player: SteamProfile) -> Dict[str, Dict[str, int]]:
+        """
+        Get the number of badges of each type, which a player has earned, using a single query.
+
+        Rising Star badges are only counted for the given squad, whereas Player of the Week badges are counted for all
+        squads. The result maps the badge slugs to dictionaries with the keys ``count`` and ``frequency``.
+        """
+        return {
+            slug: dict(count = count, frequency = frequency)
+            for slug, count, frequency in BadgeCount.objects.filter(
+                player = player,
+            ).exclude(
+                ~Q(squad = squad),
+                slug = 'rising-star',
+            ).values(
+                'slug',
+            ).annotate(
+                total_count = Sum('count'),
+                total_frequency = Sum('frequency'),
+            ).values_list(
+                'slug',
+                'total_count',
+                'total_frequency',
+            ).order_by()
+        }
+
+
+class DataVersion(models.Model):
+    """
+    The version of the data shown on the pages of a squad, which is incremented whenever the data changes (see
+    :mod:`stats.pagecache`).
+    """
+
+    squad = models.OneToOneField(
+        Squad,
+        related_name = 'data_version',
+        on_delete = models.CASCADE,
+        primary_key = True,
+    )
+    """
+    The squad.
+    """
+
+    version = models.PositiveBigIntegerField(default = 0)
+    """
+    The data version.
+    """
+
+
+def invalidate_aggregates_of_participation(sender, instance, **kwargs):
+    sessions = GamingSession.objects.filter(matches__pk = instance.pmatch_id)
+    SessionAggregate.invalidate(sessions)
+    if kwargs.get('created', False):
+        AccountedParticipation.invalidate(sessions)
+
+
+def invalidate_aggregates_of_badge(sender, instance, **kwargs):
+    SessionAggregate.invalidate(
+        GamingSession.objects.filter(matches__matchparticipation__pk = instance.participation_id),
+    )
+
+
+def invalidate_aggregates_of_match(sender, instance, **kwargs):
+    SessionAggregate.invalidate(instance.sessions.all())
+
+
+def invalidate_aggregates_of_sessions(sender, action, reverse, pk_set, instance, **kwargs):
+    if action in ('post_add', 'post_remove'):
+        if reverse:
+            sessions = GamingSession.objects.filter(pk = instance.pk)
+        else:
+            sessions = GamingSession.objects.filter(pk__in = pk_set)
+    elif action == 'pre_clear':
+        if reverse:
+            sessions = GamingSession.objects.filter(pk = instance.pk)
+        else:
+            sessions = instance.sessions.all()
+    else:
+        return
+    SessionAggregate.invalidate(sessions)
+    AccountedParticipation.invalidate(sessions)
+
+
+def invalidate_aggregates_of_squad(sender, instance, **kwargs):
+    if kwargs.get('created', True):
+        SessionAggregate.invalidate(GamingSession.objects.filter(squad__pk = instance.squad_id))
+        AccountedParticipation.objects.filter(squad__pk = instance.squad_id).delete()
+
+
+def invalidate_pages_of_participation(sender, instance, **kwargs):
+    pagecache.bump_data_versions(
+        Squad.objects.filter(memberships__player__pk = instance.player_id).values_list('uuid', flat = True),
+    )
+
+
+def invalidate_pages_of_badge(sender, instance, **kwargs):
+    pagecache.bump_data_versions(
+        Squad.objects.filter(
+            memberships__player__matchparticipation__pk = instance.participation_id,
+        ).values_list('uuid', flat = True),
+    )
+
+
+def invalidate_pages_of_sessions(sender, action, reverse, pk_set, instance, **kwargs):
+    if reverse and action in ('post_add', 'post_remove', 'pre_clear'):
+        pagecache.bump_data_versions([instance.squad_id])
+    elif not reverse and action in ('post_add', 'post_remove'):
+        pagecache.bump_data_versions(
+            GamingSession.objects.filter(pk__in = pk_set).values_list('squad__uuid', flat = True),
+        )
+    elif not reverse and action == 'pre_clear':
+        pagecache.bump_data_versions(instance.sessions.values_list('squad__uuid', flat = True))
+
+
+def invalidate_pages_of_squad(sender, instance, **kwargs):
+    pagecache.bump_data_versions([instance.squad_id])
+
+
+def invalidate_pages_of_membership(sender, instance, **kwargs):
+    if kwargs.get('created', True):
+        invalidate_pages_of_squad(sender, instance, **kwargs)
+
+
+def update_matches_summaries_of_sessions(sender, action, reverse, pk_set, instance, **kwargs):
+    if reverse and action in ('post_add', 'post_remove', 'post_clear'):
+        instance.update_matches_summary()
+    elif not reverse and action in ('post_add', 'post_remove'):
+        GamingSession.update_matches_summaries(pk_set)
+    elif not reverse and action == 'pre_clear':
+        instance._cleared_session_pks = list(instance.sessions.values_list('pk', flat = True))
+    elif not reverse and action == 'post_clear':
+        GamingSession.update_matches_summaries(getattr(instance, '_cleared_session_pks', list()))
+
+
+def update_matches_summaries_of_match(sender, instance, **kwargs):
+    if not kwargs.get('created', False):
+        GamingSession.update_matches_summaries(instance.sessions.values_list('pk', flat = True))
+
+
+def remember_sessions_of_deleted_match(sender, instance, **kwargs):
+    # The sessions must be determined before the match is deleted, since the relations are deleted along
+    instance._deleted_session_pks = list(instance.sessions.values_list('pk', flat = True))
+
+
+def update_matches_summaries_of_deleted_match(sender, instance, **kwargs):
+    GamingSession.update_matches_summaries(getattr(instance, '_deleted_session_pks', list()))
+
+
+def update_badge_counts_of_match_badge(sender, instance, **kwargs):
+    BadgeCount.update_match_badges(instance.participation.player_id, instance.badge_type_id)
+
+
+def update_badge_counts_of_potw(sender, instance, **kwargs):
+    BadgeCount.update_potw_badges(instance.squad_id)
+
+
+def update_badge_counts_of_session(sender, instance, **kwargs):
+    BadgeCount.update_rising_star_badges(instance.squad_id)
+
+
+post_save.connect(invalidate_aggregates_of_participation, sender = MatchParticipation)
+post_delete.connect(invalidate_aggregates_of_participation, sender = MatchParticipation)
+post_save.connect(invalidate_aggregates_of_badge, sender = MatchBadge)
+post_delete.connect(invalidate_aggregates_of_badge, sender = MatchBadge)
+pre_delete.connect(invalidate_aggregates_of_match, sender = Match)
+m2m_changed.connect(invalidate_aggregates_of_sessions, sender = Match.sessions.through)
+post_save.connect(invalidate_aggregates_of_squad, sender = SquadMembership)
+post_delete.connect(invalidate_aggregates_of_squad, sender = SquadMembership)
+
+post_save.connect(invalidate_pages_of_participation, sender = MatchParticipation)
+post_delete.connect(invalidate_pages_of_participation, sender = MatchParticipation)
+post_save.connect(invalidate_pages_of_badge, sender = MatchBadge)
+post_delete.connect(invalidate_pages_of_badge, sender = MatchBadge)
+m2m_changed.connect(invalidate_pages_of_sessions, sender = Match.sessions.through)
+post_save.connect(invalidate_pages_of_squad, sender = GamingSession)
+post_delete.connect(invalidate_pages_of_squad, sender = GamingSession)
+post_save.connect(invalidate_pages_of_squad, sender = PlayerOfTheWeek)
+post_delete.connect(invalidate_pages_of_squad, sender = PlayerOfTheWeek)
+post_save.connect(invalidate_pages_of_membership, sender = SquadMembership)
+post_delete.connect(invalidate_pages_of_membership, sender = SquadMembership)
+
+post_save.connect(update_badge_counts_of_match_badge, sender = MatchBadge)
+post_delete.connect(update_badge_counts_of_match_badge, sender = MatchBadge)
+post_save.connect(update_badge_counts_of_potw, sender = PlayerOfTheWeek)
+post_delete.connect(update_badge_counts_of_potw, sender = PlayerOfTheWeek)
+post_save.connect(update_badge_counts_of_session, sender = GamingSession)
+post_delete.connect(update_badge_counts_of_session, sender = GamingSession)
+
+m2m_changed.connect(update_matches_summaries_of_sessions, sender = Match.sessions.through)
+post_save.connect(update_matches_summaries_of_match, sender = Match)
+pre_delete.connect(remember_sessions_of_deleted_match, sender = Match)
+post_delete.connect(update_matches_summaries_of_deleted_match, sender = Match)
@@ -0,0 +1,86 @@
+import hashlib
+
+from cs2pb_typing import (
+    Dict,
+    Iterable,
+    Optional,
+)
+
+from django.core.cache import cache
+from django.db.models import F
+from django.http import HttpResponse
+
+PAGE_CACHE_TIMEOUT = 60 * 60 * 24  # 1 day
+
+
+def get_data_versions(squad_uuids: Iterable) -> Dict:
+    """
+    Get the data versions of squads (by UUID) using a single query. The data version of a squad is incremented
+    whenever the data shown on the pages of the squad changes.
+
+    The data versions are stored in the database, so that they are shared by all processes (e.g., the updater bumps
+    the data versions when it ingests matches, and the web server reads them).
+    """
+    from .models import DataVersion
+    squad_uuids = list(squad_uuids)
+    data_versions = {
+        str(squad_uuid): version
+        for squad_uuid, version in DataVersion.objects.filter(squad__in = squad_uuids).values_list('squad', 'version')
+    }
+    return {squad_uuid: data_versions.get(str(squad_uuid), 0) for squad_uuid in squad_uuids}
+
+
+def get_data_version(squad_uuid) -> int:
+    """
+    Get the data version of a squad.
+    """
+    return get_data_versions([squad_uuid])[squad_uuid]
+
+
+def bump_data_versions(squad_uuids: Iterable) -> None:
+    """
+    Increment the data versions of squads, so that the cached pages of the squads are invalidated.
+    """
+    from accounts.models import Squad
+
+    from .models import DataVersion
+    squad_uuids = frozenset(squad_uuids)
+    if len(squad_uuids) == 0:
+        return
+    bumped_squad_uuids = frozenset(
+        DataVersion.objects.filter(squad__in = squad_uuids).values_list('squad', flat = True)
+    )
+    DataVersion.objects.filter(squad__in = bumped_squad_uuids).update(version = F('version') + 1)
+    new_squad_uuids = Squad.objects.filter(uuid__in = squad_uuids - bumped_squad_uuids).values_list('uuid', flat = True)
+    for squad_uuid in new_squad_uuids:
+        data_version, created = DataVersion.objects.get_or_create(squad_id = squad_uuid, defaults = dict(version = 1))
+        if not created:
+            DataVersion.objects.filter(squad_id = squad_uuid).update(version = F('version') + 1)
+
+
+def get_page_cache_key(request, view: str, squads: Iterable, *args) -> str:
+    """
+    Get the cache key of a page, which depends on the view, the data versions of the squads shown on the page, the
+    arguments of the view, and the visitor (the header of the page is specific to the logged in user).
+    """
+    steam_profile = getattr(request.user, 'steam_profile', None)
+    squads = list(squads)
+    data_versions = get_data_versions([squad.uuid for squad in squads])
+    key = [
+        view,
+        *(f'{squad.uuid}@{data_versions[squad.uuid]}' for squad in squads),
+        *(str(arg) for arg in args),
+        '' if steam_profile is None else steam_profile.pk,
+    ]
+    return 'stats.pagecache.page:' + hashlib.sha1('/'.join(key).encode('utf8')).hexdigest()
+
+
+def get_cached_page(key: str) -> Optional[HttpResponse]:
+    content = cache.get(key)
+    return None if content is None else HttpResponse(content)
+
+
+def cache_page(key: str, response: HttpResponse) -> HttpResponse:
+    if response.status_code == 200:
+        cache.set(key, response.content, PAGE_CACHE_TIMEOUT)
+    return response
@@ -21,6 +21,7 @@ from matplotlib.offsetbox import (
 )
 
 from .features import (
+    ColumnarFeatureContext,
     Feature,
     FeatureContext,
     Features,
@@ -37,7 +38,7 @@ DEFAULT_COLORS: List[str] = plt.rcParams['axes.prop_cycle'].by_key()['color']
 Default color cycle.
 """
 
-DataChunkType = Union[SquadMembership, FeatureContext]
+DataChunkType = Union[SquadMembership, FeatureContext, ColumnarFeatureContext]
 
 
 class Renderer:
@@ -82,7 +83,7 @@ def unwrap_datachunks(features: List[Feature], *datachunks: DataChunkType) -> Li
     values: List[List[Real]] = list()
     for dc_idx, datachunk in enumerate(datachunks):
 
-        if isinstance(datachunk, FeatureContext):
+        if isinstance(datachunk, (FeatureContext, ColumnarFeatureContext)):
             values.append([feature(datachunk) for feature in features])
             continue
 
@@ -167,7 +168,7 @@ def radar(
 
 def trends(
         squad_membership: SquadMembership,
-        context: FeatureContext,
+        context: Union[FeatureContext, ColumnarFeatureContext],
         features: List[Feature],
     ) -> BytesIO:
     datachunks = [squad_membership, context]
@@ -0,0 +1,78 @@
+import datetime
+import logging
+import threading
+
+from django.db import connection
+
+from . import pagecache
+
+log = logging.getLogger(__name__)
+
+REFRESH_INTERVAL = 60  # 1 minute
+
+refresh_lock = threading.Lock()
+refreshing_squads = set()
+"""
+The UUIDs of the squads, for which a refresh is currently in flight.
+"""
+
+
+def is_stale(squad) -> bool:
+    """
+    Check whether the stats of a squad are due to be refreshed.
+    """
+    return squad.stats_timestamp is None or (
+        datetime.datetime.timestamp(datetime.datetime.now()) - squad.stats_timestamp >= REFRESH_INTERVAL
+    )
+
+
+def refresh_squad(squad_uuid) -> None:
+    """
+    Refresh the stats of a squad (update the stats and avatars, and award missing Player of the Week badges).
+
+    The matches are not updated here, but periodically by the scheduler (see :mod:`stats.scheduler`).
+    """
+    from accounts.models import Squad
+    from stats.models import PlayerOfTheWeek
+    squad = Squad.objects.get(uuid = squad_uuid)
+
+    # Invalidate the cached pages of the squad only if the stats have actually changed
+    def get_stats_snapshot():
+        return list(squad.memberships.order_by('pk').values_list('player', 'position', 'stats', 'trends'))
+    stats_snapshot = get_stats_snapshot()
+    squad.update_stats()
+    if get_stats_snapshot() != stats_snapshot:
+        pagecache.bump_data_versions([squad.uuid])
+
+    for squad_membership in squad.memberships.all():
+        squad_membership.player.update_cached_avatar()
+
+    PlayerOfTheWeek.create_missing_badges(squad)
+
+    squad.stats_timestamp = datetime.datetime.timestamp(datetime.datetime.now())
+    squad.save(update_fields = ['stats_timestamp'])
+
+
+def run_refresh(squad_uuid) -> None:
+    try:
+        refresh_squad(squad_uuid)
+    except:  # noqa: E722
+        log.critical(f'Failed to refresh stats of squad {squad_uuid}.', exc_info = True)
+    finally:
+        with refresh_lock:
+            refreshing_squads.discard(squad_uuid)
+        connection.close()
+
+
+def request_refresh(squad) -> bool:
+    """
+    Refresh the stats of a squad in the background, unless a refresh of the squad is already in flight.
+
+    Returns True if a refresh was started, and False otherwise.
+    """
+    with refresh_lock:
+        if squad.uuid in refreshing_squads:
+            return False
+        refreshing_squads.add(squad.uuid)
+    threading.Thread(target = run_refresh, args = (squad.uuid,), daemon = True).start()
+    return True
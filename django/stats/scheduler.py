@@ -0,0 +1,149 @@
+"""
+The scheduler queues the update tasks of the accounts periodically, independent of page views.
+
+The poll interval of each account adapts to its recent activity. Accounts are polled every
+:data:`ACTIVE_POLL_INTERVAL` seconds while they play (i.e. a gaming session of one of their squads is open, or their
+last match ended less than :data:`~accounts.models.MIN_BREAK_TIME` seconds ago). Afterwards, the poll interval grows
+with the time since the last match, up to :data:`IDLE_POLL_INTERVAL` seconds.
+
+The number of update tasks per hour is capped by the ``UPDATER_HOURLY_BUDGET`` setting, since each update task issues
+requests to the Steam API. If more accounts are due, the most overdue ones are queued first.
+"""
+import datetime
+import logging
+import threading
+
+from cs2pb_typing import (
+    List,
+    Optional,
+)
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import (
+    Exists,
+    F,
+    OuterRef,
+    Subquery,
+)
+
+from .updater import (
+    MAX_ATTEMPTS,
+    queue_update_task,
+)
+
+log = logging.getLogger(__name__)
+
+ACTIVE_POLL_INTERVAL = 5 * 60  # 5 minutes
+
+IDLE_POLL_INTERVAL = 6 * 60 * 60  # 6 hours
+
+IDLE_BACKOFF = 4
+"""
+The poll interval of an account, which is not active, is the time since its last match divided by this factor.
+"""
+
+SCHEDULER_INTERVAL = 60  # 1 minute
+
+BUDGET_WINDOW = 60 * 60  # 1 hour
+
+
+def get_poll_interval(now: float, last_match_end: Optional[int], is_in_session: bool) -> int:
+    """
+    Get the poll interval of an account, based on when its last match ended, and whether it is in an open session.
+    """
+    from accounts.models import MIN_BREAK_TIME
+    if is_in_session:
+        return ACTIVE_POLL_INTERVAL
+    if last_match_end is None:
+        return IDLE_POLL_INTERVAL
+    inactive_time = now - last_match_end
+    if inactive_time < MIN_BREAK_TIME:
+        return ACTIVE_POLL_INTERVAL
+    return int(min(max(inactive_time / IDLE_BACKOFF, ACTIVE_POLL_INTERVAL), IDLE_POLL_INTERVAL))
+
+
+def schedule_updates(now: Optional[float] = None) -> List:
+    """
+    Queue the update tasks of the accounts which are due, within the limits of the budget. Returns the accounts for
+    which update tasks were queued.
+    """
+    from accounts.models import Account
+    from stats.models import (
+        GamingSession,
+        MatchParticipation,
+        UpdateTask,
+    )
+    if now is None:
+        now = datetime.datetime.timestamp(datetime.datetime.now())
+
+    # Accounts with a pending update task do not need to be polled (tasks which have been attempted too often are not
+    # pending anymore, e.g. if the updater crashed while running them)
+    accounts = Account.objects.filter(
+        enabled = True,
+    ).exclude(
+        pk__in = UpdateTask.objects.filter(
+            completion_timestamp = None,
+            attempts__lt = MAX_ATTEMPTS,
+        ).values('account'),
+    ).annotate(
+        last_scheduled = Subquery(
+            UpdateTask.objects.filter(
+                account = OuterRef('pk'),
+            ).order_by(
+                '-scheduling_timestamp',
+            ).values('scheduling_timestamp')[:1]
+        ),
+        last_match_end = Subquery(
+            MatchParticipation.objects.filter(
+                player = OuterRef('steam_profile'),
+            ).order_by(
+                '-pmatch__timestamp',
+            ).values(end = F('pmatch__timestamp') + F('pmatch__duration'))[:1]
+        ),
+        is_in_session = Exists(
+            GamingSession.objects.filter(
+                is_closed = False,
+                squad__memberships__player = OuterRef('steam_profile'),
+            )
+        ),
+    )
+
+    # Determine the accounts which are due, the most overdue first
+    due_accounts = list()
+    for account in accounts:
+        poll_interval = get_poll_interval(now, account.last_match_end, account.is_in_session)
+        due_timestamp = (account.last_scheduled or 0) + poll_interval
+        if due_timestamp <= now:
+            due_accounts.append((due_timestamp, account))
+    due_accounts.sort(key = lambda item: item[0])
+
+    # Cap the number of update tasks per hour (including those not queued by the scheduler)
+    budget = settings.UPDATER_HOURLY_BUDGET - UpdateTask.objects.filter(
+        scheduling_timestamp__gt = now - BUDGET_WINDOW,
+    ).count()
+    if len(due_accounts) > budget:
+        log.warning(f'Update budget exceeded, deferring {len(due_accounts) - max(budget, 0)} account(s)')
+
+    queued_accounts = list()
+    for _, account in due_accounts[:max(budget, 0)]:
+        queue_update_task(account)
+        queued_accounts.append(account)
+    return queued_accounts
+
+
+def run_scheduler(stop_event: threading.Event) -> None:
+    """
+    Queue the update tasks of the accounts which are due every :data:`SCHEDULER_INTERVAL` seconds, until the stop
+    event is set.
+    """
+    try:
+        while not stop_event.is_set():
+            try:
+                schedule_updates()
+            except:  # noqa: E722
+                log.critical('Failed to schedule updates.', exc_info = True)
+                connection.close()
+            stop_event.wait(SCHEDULER_INTERVAL)
+    finally:
+        connection.close()
@@ -3,7 +3,6 @@ import math
 import stats.potw
 
 from django import template
-from django.db.models import Sum
 from django.template.defaultfilters import stringfilter
 from django.utils.safestring import mark_safe
 
@@ -18,7 +17,7 @@ def map_name(slug):
 
 @register.filter
 def replay_url(pmatch):
-    steamid = pmatch.matchparticipation_set.first().player.steamid
+    steamid = pmatch.matchparticipation_set.all()[0].player.steamid  # uses the prefetched participations
     return f'steam://rungame/730/{ steamid }/+csgo_download_match%20{ pmatch.sharecode }'
 
 
@@ -70,11 +69,6 @@ def potw_mode_name(mode):
     return stats.potw.get_mode_by_id(mode).name
 
 
-@register.filter
-def match_badge_count(qs):
-    return qs.aggregate(Sum('frequency'))['frequency__sum']
-
-
 @register.filter
 def list_of_match_badges(qs):
 
@@ -1,6 +1,8 @@
 import datetime
 import math
 import pathlib
+import random
+import threading
 import time
 import uuid
 from unittest.mock import (
@@ -9,17 +11,24 @@ from unittest.mock import (
 )
 
 import cs2_client
+import gitinfo
 from accounts.models import (
     Account,
     Squad,
     SquadMembership,
     SteamProfile,
 )
+from csgo_app import views as csgo_app_views
 from discordbot.models import ScheduledNotification
 from stats import (
     features,
+    inflight,
     models,
+    pagecache,
     potw,
+    refresher,
+    scheduler,
+    timing,
     updater,
     views,
 )
@@ -27,11 +36,21 @@ from stats.templatetags import stats_extras
 from tests import testsuite
 from url_forward import get_redirect_url_to
 
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import (
+    IntegrityError,
+    connection,
+    transaction,
+)
+from django.db.models import Max
 from django.http import HttpResponseNotFound
+from django.template.loader import render_to_string
 from django.test import (
     RequestFactory,
     TestCase,
 )
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 
@@ -75,6 +94,34 @@ class add_globals_to_context(TestCase):
         self.assertTrue('sha' in ctx['version'].keys())
         self.assertTrue('date' in ctx['version'].keys())
 
+    @patch('gitinfo.get_head_info', wraps = gitinfo.get_head_info)
+    def test_version_cached(self, mock__get_head_info):
+        csgo_app_views.head_info_cache['info'] = None
+        for _ in range(3):
+            ctx = dict()
+            views.add_globals_to_context(ctx)
+        mock__get_head_info.assert_called_once()
+
+    @patch('csgo_app.views.threading.Thread')
+    def test_malfunction(self, mock__Thread):
+        player = SteamProfile.objects.create(steamid = '12345678900000001')
+        account = Account.objects.create(steam_profile = player)
+        models.UpdateTask.objects.create(account = account, scheduling_timestamp = 0, execution_timestamp = 0)
+        models.UpdateTask.objects.create(account = account, scheduling_timestamp = 1)
+        csgo_app_views.queue_health_cache['timestamp'] = None
+        csgo_app_views.last_malfunction_alert_timestamp = None
+        self.addCleanup(csgo_app_views.queue_health_cache.update, timestamp = None)
+
+        # The alert is sent only once, and the queue health is queried only once
+        with self.assertNumQueries(1):
+            for _ in range(3):
+                ctx = dict()
+                views.add_globals_to_context(ctx)
+                self.assertIn('error', ctx)
+        mock__Thread.assert_called_once()
+        self.assertEqual(mock__Thread.call_args.kwargs['target'], csgo_app_views.send_mail)
+        mock__Thread.return_value.start.assert_called_once()
+
 
 class Match__from_summary(TestCase):
 
@@ -778,6 +825,12 @@ class PlayerOfTheWeek__create_badge(TestCase):
         self.assertIn(potw.get_mode_by_id(badge.mode).name, ScheduledNotification.objects.get().text)
 
 
+def refresh_synchronously(squad):
+    refresher.refresh_squad(squad.uuid)
+    return True
+
+
+@patch('stats.refresher.request_refresh', new = refresh_synchronously)
 @patch('accounts.models.SteamProfile.update_cached_avatar')
 class squads(TestCase):
 
@@ -795,6 +848,37 @@ class squads(TestCase):
         self.assertEqual(response.context['squad'], self.squad)
         mock__SteamProfile__update_cached_avatar.assert_called_once()
 
+    def test_squads_with_fresh_stats(self, mock__SteamProfile__update_cached_avatar):
+        self.squad.stats_timestamp = int(time.time())
+        self.squad.save()
+        response = self.client.get(reverse('squads', kwargs={'squad': self.squad.uuid}))
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.context['squads'][0]['stats_datetime'])
+        mock__SteamProfile__update_cached_avatar.assert_not_called()
+
+    def test_squads_cached(self, mock__SteamProfile__update_cached_avatar):
+        self.squad.stats_timestamp = int(time.time())
+        self.squad.save()
+        response = self.client.get(reverse('squads', kwargs={'squad': self.squad.uuid}))
+        self.assertIsNotNone(response.context)
+
+        # Test that the page is served from the cache
+        response_cached = self.client.get(reverse('squads', kwargs={'squad': self.squad.uuid}))
+        self.assertIsNone(response_cached.context)
+        self.assertEqual(response_cached.content, response.content)
+
+        # Test that the cached page is invalidated when the data of the squad changes
+        models.GamingSession.objects.create(squad = self.squad)
+        response = self.client.get(reverse('squads', kwargs={'squad': self.squad.uuid}))
+        self.assertIsNotNone(response.context)
+
+        # Test that the cached page is invalidated when the stats of the squad are refreshed
+        self.client.get(reverse('squads', kwargs={'squad': self.squad.uuid}))
+        self.squad.stats_timestamp += 1
+        self.squad.save()
+        response = self.client.get(reverse('squads', kwargs={'squad': self.squad.uuid}))
+        self.assertIsNotNone(response.context)
+
     def test_squads_with_invalid_squad(self, mock__SteamProfile__update_cached_avatar):
         invalid_uuid = str(uuid.uuid4())
         response = self.client.get(reverse('squads', kwargs={'squad': invalid_uuid}))
@@ -835,6 +919,55 @@ class squads(TestCase):
         mock__SteamProfile__update_cached_avatar.assert_called_once()
 
 
+@patch('stats.refresher.threading.Thread')
+class request_refresh(TestCase):
+
+    def setUp(self):
+        self.squad = Squad.objects.create(name = 'Test Squad')
+
+    def tearDown(self):
+        refresher.refreshing_squads.clear()
+
+    def test(self, mock__Thread):
+        self.assertTrue(refresher.request_refresh(self.squad))
+        mock__Thread.assert_called_once_with(target = refresher.run_refresh, args = (self.squad.uuid,), daemon = True)
+        mock__Thread.return_value.start.assert_called_once()
+
+    def test_in_flight(self, mock__Thread):
+        self.assertTrue(refresher.request_refresh(self.squad))
+        self.assertFalse(refresher.request_refresh(self.squad))
+        mock__Thread.return_value.start.assert_called_once()
+
+    @patch('stats.refresher.connection')
+    @patch('stats.refresher.refresh_squad')
+    def test_finished(self, mock__refresh_squad, mock__connection, mock__Thread):
+        self.assertTrue(refresher.request_refresh(self.squad))
+        refresher.run_refresh(self.squad.uuid)
+        mock__refresh_squad.assert_called_once_with(self.squad.uuid)
+        self.assertTrue(refresher.request_refresh(self.squad))
+
+
+class get_max_stats(TestCase):
+
+    def setUp(self):
+        self.squad = Squad.objects.create(name = 'Test Squad')
+        for steamid, stats in (
+            ('12345678900000001', dict(player_value = 0.8, kills_per_death = None)),
+            ('12345678900000002', dict(player_value = 1.2, kills_per_death = 0.9)),
+            ('12345678900000003', dict()),
+        ):
+            SquadMembership.objects.create(
+                squad = self.squad,
+                player = SteamProfile.objects.create(steamid = steamid),
+                stats = stats,
+            )
+
+    def test(self):
+        with self.assertNumQueries(1):
+            max_stats = views.get_max_stats(self.squad)
+        self.assertEqual(max_stats, dict(player_value = 1.2, kills_per_death = 0.9))
+
+
 class split_into_chunks(TestCase):
 
     def test_split_into_chunks(self):
@@ -935,6 +1068,88 @@ class matches(TestCase):
         self.assertEqual(response.context['last_timestamp'], self.match.timestamp)
         self.assertEqual(response.context['sessions'].count(), 1)
 
+    def test_matches_cached(self):
+        response = self.client.get(reverse('matches', kwargs={'squad': self.squad.uuid}))
+        self.assertIsNotNone(response.context)
+
+        # Test that the page is served from the cache
+        response_cached = self.client.get(reverse('matches', kwargs={'squad': self.squad.uuid}))
+        self.assertIsNone(response_cached.context)
+        self.assertEqual(response_cached.content, response.content)
+
+        # Test that the cached page is invalidated when a match is added
+        match = models.Match.objects.create(
+            timestamp = int(time.time()) + 60,
+            score_team1 = 13,
+            score_team2 = 12,
+            duration = 1653,
+            map_name = 'de_dust2',
+        )
+        match.sessions.add(self.session)
+        response = self.client.get(reverse('matches', kwargs={'squad': self.squad.uuid}))
+        self.assertIsNotNone(response.context)
+
+    def test_prefetch_sessions(self):
+        players = [self.player] + [
+            SteamProfile.objects.create(steamid = f'1234567890000001{pidx}') for pidx in range(3)
+        ]
+        SquadMembership.objects.create(squad = self.squad, player = players[1])
+        for sidx in range(3):
+            session = models.GamingSession.objects.create(squad = self.squad, rising_star = players[1])
+            for midx in range(3):
+                pmatch = models.Match.objects.create(
+                    timestamp = int(time.time()) - 60 * 60 * (sidx + 1) + midx,
+                    score_team1 = 13,
+                    score_team2 = 12,
+                    duration = 1653,
+                    map_name = 'de_dust2',
+                )
+                pmatch.sessions.add(session)
+                for pidx, player in enumerate(players):
+                    participation = models.MatchParticipation.objects.create(
+                        player = player,
+                        pmatch = pmatch,
+                        team = 1 if pidx < 2 else 2,
+                        result = 'w' if pidx < 2 else 'l',
+                        kills = 20,
+                        assists = 10,
+                        deaths = 15,
+                        score = 30,
+                        mvps = 5,
+                        headshots = 15,
+                        adr = 100 + pidx,
+                    )
+                    models.MatchBadge.objects.create(participation = participation, badge_type_id = 'peach')
+        members = SteamProfile.objects.filter(squad_memberships__squad = self.squad)
+        sessions = models.GamingSession.objects.annotate(
+            timestamp = Max('matches__timestamp'),
+        ).order_by(
+            '-timestamp',
+        )[:3]
+
+        # Test that the number of queries does not depend on the number of sessions, matches, and participations
+        with self.assertNumQueries(6):
+            sessions = views.prefetch_sessions(sessions, members)
+            html = render_to_string('stats/sessions-list.html', dict(sessions = sessions))
+        self.assertEqual(len(sessions), 3)
+        self.assertEqual(sessions[0], self.session)
+        self.assertEqual(len(sessions[1].matches_list), 3)
+        self.assertEqual(
+            [member['steamid'] for member in sessions[1].participated_members],
+            [players[1].steamid, self.player.steamid],
+        )
+        self.assertEqual(html.count('is-squad-member'), 2 * 3 * 2 + 1)
+        self.assertEqual(html.count('is-not-squad-member'), 2 * 3 * 2)
+
+    def test_data_version_shared(self):
+        data_version = pagecache.get_data_version(self.squad.uuid)
+        pagecache.bump_data_versions([self.squad.uuid])
+
+        # Test that the data version is not lost with the cache of the process (e.g., a bump by the updater)
+        cache.clear()
+        self.assertEqual(pagecache.get_data_version(self.squad.uuid), data_version + 1)
+        self.assertEqual(pagecache.get_data_version(str(self.squad.uuid)), data_version + 1)
+
     def test_matches_without_authentication(self):
         response = self.client.get(reverse('matches'))
         self.assertEqual(response.status_code, 302)
@@ -966,6 +1181,152 @@ class matches(TestCase):
         self.assertNotContains(response, '<div class="previous-rank-container">')
 
 
+class api(TestCase):
+
+    @testsuite.fake_api.patch
+    def setUp(self):
+        self.player = SteamProfile.objects.create(steamid = '12345678900000001')
+        self.squad = Squad.objects.create(name = 'Test Squad')
+        SquadMembership.objects.create(squad = self.squad, player = self.player)
+        self.account = Account.objects.create(steam_profile = self.player)
+        self.sessions = [models.GamingSession.objects.create(squad = self.squad) for _ in range(2)]
+        self.matches = list()
+        for midx in range(5):
+            pmatch = models.Match.objects.create(
+                sharecode = f'CSGO-{midx}',
+                timestamp = 1000 + 10 * (midx // 2),  # matches 0 and 1, and 2 and 3, share the same timestamp
+                score_team1 = 12,
+                score_team2 = 13,
+                duration = 1653,
+                map_name = 'de_dust2',
+            )
+            pmatch.sessions.add(self.sessions[midx // 3])
+            models.MatchParticipation.objects.create(
+                player = self.player,
+                pmatch = pmatch,
+                team = 1,
+                result = 'l',
+                kills = 20,
+                assists = 10,
+                deaths = 15,
+                score = 30,
+                mvps = 5,
+                headshots = 15,
+                adr = 120.5,
+            )
+            self.matches.append(pmatch)
+
+    def _get(self, name, **params):
+        return self.client.get(reverse(name, kwargs = dict(squad = self.squad.uuid)), params)
+
+    @patch('accounts.models.Account.update_matches')
+    def test_matches(self, mock__update_matches):
+        match_pks = list()
+        cursor = None
+        while True:
+            response = self._get('api_matches', limit = 2, **(dict(cursor = cursor) if cursor else dict()))
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertLessEqual(len(data['results']), 2)
+            match_pks += [pmatch['id'] for pmatch in data['results']]
+            cursor = data['next']
+            if cursor is None:
+                break
+        self.assertEqual(match_pks, [pmatch.pk for pmatch in self.matches[::-1]])
+        mock__update_matches.assert_not_called()
+
+    def test_matches_participations(self):
+        response = self._get('api_matches', limit = 1)
+        participations = response.json()['results'][0]['participations']
+        self.assertEqual(len(participations), 1)
+        self.assertEqual(participations[0]['player'], self.player.steamid)
+        self.assertEqual(participations[0]['adr'], 120.5)
+
+    def test_sessions(self):
+        response = self._get('api_sessions')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertIsNone(data['next'])
+        self.assertEqual(
+            [session['id'] for session in data['results']],
+            [session.pk for session in self.sessions[::-1]],
+        )
+        self.assertEqual(data['results'][0]['started'], 1010)
+        self.assertEqual(data['results'][0]['timestamp'], 1020 + 1653)
+        self.assertEqual(data['results'][0]['matches'], [pmatch.pk for pmatch in self.matches[3:]])
+
+    def test_fields(self):
+        response = self._get('api_matches', fields = 'id,map_name')
+        self.assertEqual(response.status_code, 200)
+        for pmatch in response.json()['results']:
+            self.assertEqual(set(pmatch.keys()), {'id', 'map_name'})
+
+    def test_invalid_args(self):
+        self.assertEqual(self._get('api_matches', fields = 'id,password').status_code, 400)
+        self.assertEqual(self._get('api_matches', limit = 0).status_code, 400)
+        self.assertEqual(self._get('api_sessions', cursor = 'abc').status_code, 400)
+
+    def test_etag(self):
+        response = self._get('api_matches')
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+
+        # Test that the page is not transferred again if it did not change
+        response = self.client.get(
+            reverse('api_matches', kwargs = dict(squad = self.squad.uuid)),
+            HTTP_IF_NONE_MATCH = etag,
+        )
+        self.assertEqual(response.status_code, 304)
+
+        # Test that the ETag changes when the page changes
+        self.matches[0].map_name = 'de_inferno'
+        self.matches[0].save()
+        response = self.client.get(
+            reverse('api_matches', kwargs = dict(squad = self.squad.uuid)),
+            HTTP_IF_NONE_MATCH = etag,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+
+class export_csv(TestCase):
+
+    @testsuite.fake_api.patch
+    def setUp(self):
+        self.pmatch = models.Match.objects.create(
+            timestamp = 1000,
+            score_team1 = 12,
+            score_team2 = 13,
+            duration = 1653,
+            map_name = 'de_dust2',
+        )
+        for pidx, team in enumerate((1, 2)):
+            models.MatchParticipation.objects.create(
+                player = SteamProfile.objects.create(steamid = f'1234567890000000{pidx + 1}'),
+                pmatch = self.pmatch,
+                team = team,
+                result = 'l' if team == 1 else 'w',
+                kills = 20,
+                assists = 10,
+                deaths = 15,
+                score = 30,
+                mvps = 5,
+                headshots = 15,
+                adr = 100 + pidx,
+            )
+
+    def test(self):
+        response = self.client.get(f'/stats/csv/{self.pmatch.pk}')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(
+            b''.join(response.streaming_content).decode(),
+            'Steam ID;Team\n'
+            '12345678900000002;2\n'
+            '12345678900000001;1\n'
+        )
+
+
 class run_pending_tasks(TestCase):
 
     def test(self):
@@ -994,6 +1355,420 @@ class run_pending_tasks(TestCase):
             Account__update_matches__testcase.tearDown()
 
 
+class UpdateTask__claim(TestCase):
+
+    def setUp(self):
+        self.accounts = [
+            Account.objects.create(
+                steam_profile = SteamProfile.objects.create(steamid = f'1234567890000000{idx + 1}'),
+                email_address = f'player{idx + 1}@test.com',
+            )
+            for idx in range(2)
+        ]
+        self.tasks = [
+            models.UpdateTask.objects.create(account = self.accounts[0], scheduling_timestamp = 1),
+            models.UpdateTask.objects.create(account = self.accounts[1], scheduling_timestamp = 2),
+        ]
+
+    def test(self):
+        task = models.UpdateTask.claim('worker1', 60, 3)
+        self.assertEqual(task.pk, self.tasks[1].pk)
+        self.assertEqual(task.lease_owner, 'worker1')
+        self.assertEqual(task.attempts, 1)
+        task = models.UpdateTask.claim('worker2', 60, 3)
+        self.assertEqual(task.pk, self.tasks[0].pk)
+        self.assertEqual(task.lease_owner, 'worker2')
+        self.assertIsNone(models.UpdateTask.claim('worker3', 60, 3))
+
+    def test_busy_account(self):
+        models.UpdateTask.objects.create(account = self.accounts[1], scheduling_timestamp = 3, execution_timestamp = 3)
+        task = models.UpdateTask.claim('worker1', 60, 3)
+        self.assertEqual(task.scheduling_timestamp, 3)
+
+        # The other task of the same account must not be run concurrently
+        task = models.UpdateTask.claim('worker2', 60, 3)
+        self.assertEqual(task.pk, self.tasks[0].pk)
+        self.assertIsNone(models.UpdateTask.claim('worker3', 60, 3))
+
+    def test_lease_expired(self):
+        task = models.UpdateTask.claim('worker1', 60, 3)
+        models.UpdateTask.objects.filter(pk = task.pk).update(lease_expiry = 0)
+        models.UpdateTask.objects.filter(pk = self.tasks[0].pk).update(completion_timestamp = 1)
+
+        # The task can be claimed by another worker (e.g., after the first has crashed)
+        task = models.UpdateTask.claim('worker2', 60, 3)
+        self.assertEqual(task.pk, self.tasks[1].pk)
+        self.assertEqual(task.attempts, 2)
+
+        # The first worker has lost the lease
+        self.assertFalse(models.UpdateTask(pk = task.pk, lease_owner = 'worker1').renew_lease(60))
+        self.assertTrue(task.renew_lease(60))
+
+    def test_max_attempts(self):
+        models.UpdateTask.objects.update(attempts = 3)
+        self.assertIsNone(models.UpdateTask.claim('worker1', 60, 3))
+
+        # The tasks have been given up
+        self.assertEqual(models.UpdateTask.objects.filter(completion_timestamp = None).count(), 0)
+
+    def test_max_attempts_leased(self):
+        task = models.UpdateTask.claim('worker1', 60, 3)
+        models.UpdateTask.objects.update(attempts = 3)
+        self.assertIsNone(models.UpdateTask.claim('worker2', 60, 3))
+
+        # The task which is still leased is not given up
+        task.refresh_from_db()
+        self.assertIsNone(task.completion_timestamp)
+        self.assertEqual(task.lease_owner, 'worker1')
+
+    def test_release(self):
+        task = models.UpdateTask.claim('worker1', 60, 3)
+        task.release()
+        self.assertEqual(task.lease_owner, '')
+        self.assertIsNone(task.lease_expiry)
+        self.assertEqual(models.UpdateTask.claim('worker1', 60, 3).pk, task.pk)
+
+    def test_release_retry_delay(self):
+        task = models.UpdateTask.claim('worker1', 60, 3)
+        task.release(retry_delay = 60)
+        self.assertEqual(models.UpdateTask.claim('worker1', 60, 3).pk, self.tasks[0].pk)
+        self.assertIsNone(models.UpdateTask.claim('worker1', 60, 3))
+
+
+class queue_update_task(TestCase):
+
+    def setUp(self):
+        self.player = SteamProfile.objects.create(steamid = '12345678900000001')
+        self.account = Account.objects.create(steam_profile = self.player)
+
+    def test(self):
+        task1 = updater.queue_update_task(self.account)
+        task2 = updater.queue_update_task(self.account)
+        self.assertEqual(task1.pk, task2.pk)
+        self.assertEqual(models.UpdateTask.objects.count(), 1)
+
+        # Forced updates are coalesced as well
+        self.assertEqual(self.account.update_matches(force = True).pk, task1.pk)
+        self.assertEqual(models.UpdateTask.objects.count(), 1)
+
+    def test_executing(self):
+        task1 = updater.queue_update_task(self.account)
+        task1.execution_timestamp = task1.scheduling_timestamp
+        task1.save()
+
+        # The task has started executing, so a new task is queued
+        task2 = updater.queue_update_task(self.account)
+        self.assertNotEqual(task1.pk, task2.pk)
+        self.assertEqual(updater.queue_update_task(self.account).pk, task2.pk)
+        self.assertEqual(models.UpdateTask.objects.count(), 2)
+
+    def test_queued_concurrently(self):
+        task1 = updater.queue_update_task(self.account)
+
+        # Pretend that the task was queued after the lookup, so that the insert conflicts
+        with patch('django.db.models.query.QuerySet.first', return_value = None):
+            task2 = updater.queue_update_task(self.account)
+        self.assertEqual(task1.pk, task2.pk)
+        self.assertEqual(models.UpdateTask.objects.count(), 1)
+
+
+class get_poll_interval(TestCase):
+
+    def test_in_session(self):
+        self.assertEqual(scheduler.get_poll_interval(1e6, None, True), scheduler.ACTIVE_POLL_INTERVAL)
+
+    def test_no_matches(self):
+        self.assertEqual(scheduler.get_poll_interval(1e6, None, False), scheduler.IDLE_POLL_INTERVAL)
+
+    def test_active(self):
+        self.assertEqual(scheduler.get_poll_interval(1e6, 1e6 - 60 * 60, False), scheduler.ACTIVE_POLL_INTERVAL)
+
+    def test_backoff(self):
+        self.assertEqual(scheduler.get_poll_interval(1e6, 1e6 - 4 * 60 * 60, False), 60 * 60)
+        self.assertEqual(scheduler.get_poll_interval(1e6, 1e6 - 7 * 24 * 60 * 60, False), scheduler.IDLE_POLL_INTERVAL)
+
+
+class schedule_updates(TestCase):
+
+    def setUp(self):
+        self.now = 1e9
+        self.players = [SteamProfile.objects.create(steamid = f'1234567890000000{idx + 1}') for idx in range(2)]
+        self.accounts = [
+            Account.objects.create(steam_profile = player, email_address = f'player{idx + 1}@test.com')
+            for idx, player in enumerate(self.players)
+        ]
+        self.squad = Squad.objects.create(name = 'Test Squad')
+        SquadMembership.objects.create(squad = self.squad, player = self.players[0])
+
+        # The first player played a match an hour ago
+        pmatch = models.Match.objects.create(
+            timestamp = self.now - 60 * 60 - 1653,
+            score_team1 = 12,
+            score_team2 = 13,
+            duration = 1653,
+            map_name = 'de_dust2',
+        )
+        models.MatchParticipation.objects.create(
+            player = self.players[0],
+            pmatch = pmatch,
+            team = 1,
+            result = 'l',
+            kills = 20,
+            assists = 10,
+            deaths = 15,
+            score = 30,
+            mvps = 5,
+            headshots = 15,
+            adr = 120.5,
+        )
+
+        # Both accounts were updated 10 minutes ago
+        for account in self.accounts:
+            models.UpdateTask.objects.create(
+                account = account,
+                scheduling_timestamp = self.now - 10 * 60,
+                completion_timestamp = self.now - 10 * 60,
+            )
+
+    def test(self):
+        # Only the active account is due
+        self.assertEqual(scheduler.schedule_updates(self.now), [self.accounts[0]])
+        self.assertEqual(models.UpdateTask.objects.filter(completion_timestamp = None).count(), 1)
+
+        # The account already has a pending update task
+        self.assertEqual(scheduler.schedule_updates(self.now), [])
+
+    def test_in_session(self):
+        models.Match.objects.all().update(timestamp = self.now - 30 * 24 * 60 * 60)
+        self.assertEqual(scheduler.schedule_updates(self.now), [])
+
+        # The accounts of players in open gaming sessions are polled actively
+        models.GamingSession.objects.create(squad = self.squad)
+        self.assertEqual(scheduler.schedule_updates(self.now), [self.accounts[0]])
+
+    def test_idle(self):
+        self.assertEqual(scheduler.schedule_updates(self.now + scheduler.IDLE_POLL_INTERVAL), self.accounts)
+
+    def test_failed_task(self):
+        task = models.UpdateTask.objects.create(
+            account = self.accounts[0],
+            scheduling_timestamp = self.now,
+            execution_timestamp = self.now,
+        )
+
+        # Let the task fail until it is given up
+        with patch.object(models.UpdateTask, 'run', side_effect = cs2_client.ClientError):
+            with self.assertLogs(updater.log, level = 'CRITICAL'):
+                for attempt in range(updater.MAX_ATTEMPTS):
+                    models.UpdateTask.objects.filter(pk = task.pk).update(lease_expiry = None)
+                    updater.run_pending_tasks()
+        task.refresh_from_db()
+        self.assertEqual(task.attempts, updater.MAX_ATTEMPTS)
+        self.assertTrue(task.is_completed)
+
+        # The account is polled again
+        self.assertIn(self.accounts[0], scheduler.schedule_updates(self.now + 24 * 60 * 60))
+
+    def test_exhausted_task(self):
+        models.UpdateTask.objects.create(
+            account = self.accounts[0],
+            scheduling_timestamp = self.now,
+            execution_timestamp = self.now,
+            attempts = updater.MAX_ATTEMPTS,
+        )
+
+        # The task has been attempted too often (e.g., the updater crashed while running it), so it is not pending
+        self.assertIn(self.accounts[0], scheduler.schedule_updates(self.now + 24 * 60 * 60))
+
+    @patch.object(models.settings, 'CSGO_API_ENABLED', False)
+    def test_task_history_pruned(self):
+        models.UpdateTask.objects.bulk_create(
+            [
+                models.UpdateTask(
+                    account = self.accounts[0],
+                    scheduling_timestamp = self.now - 5 * 60 + idx,
+                    execution_timestamp = self.now - 5 * 60 + idx,
+                    completion_timestamp = self.now - 5 * 60 + idx,
+                )
+                for idx in range(150)
+            ]
+        )
+        task = models.UpdateTask.objects.create(account = self.accounts[0], scheduling_timestamp = self.now)
+        task.run(recent_matches = list())
+        self.assertEqual(models.UpdateTask.objects.filter(account = self.accounts[1]).count(), 1)
+
+        # The idle account is not due, although the tasks of the other account have outnumbered its latest task
+        self.assertNotIn(self.accounts[1], scheduler.schedule_updates(self.now))
+        self.assertIn(self.accounts[1], scheduler.schedule_updates(self.now + scheduler.IDLE_POLL_INTERVAL))
+
+    @patch.object(models.settings, 'UPDATER_HOURLY_BUDGET', 2)
+    def test_budget(self):
+        models.UpdateTask.objects.filter(account = self.accounts[1]).update(scheduling_timestamp = 0)
+
+        # Both accounts are due, but the budget is partially spent by the previous update of the first account, so only
+        # the most overdue account is queued
+        self.assertEqual(scheduler.schedule_updates(self.now), [self.accounts[1]])
+
+
+@patch('stats.updater.POLL_INTERVAL', 0)
+class run_worker(TestCase):
+
+    def setUp(self):
+        self.player = SteamProfile.objects.create(steamid = '12345678900000001')
+        self.account = Account.objects.create(steam_profile = self.player)
+        self.task = models.UpdateTask.objects.create(account = self.account, scheduling_timestamp = 1)
+
+    def test(self):
+        stop_event = MagicMock()
+        stop_event.is_set.side_effect = [False, False, True]
+
+        def run(task, recent_matches):
+            with timing.stage('award_badges'):
+                task.completion_timestamp = 2
+                task.save()
+
+        with patch.object(models.UpdateTask, 'run', autospec = True, side_effect = run) as mock__run:
+            updater.run_worker('worker1', list(), stop_event)
+        mock__run.assert_called_once()
+        stop_event.wait.assert_called_once_with(0)
+
+        self.task.refresh_from_db()
+        self.assertTrue(self.task.is_completed)
+        self.assertEqual(self.task.lease_owner, '')
+        self.assertEqual(list(self.task.stages.keys()), ['award_badges'])
+        self.assertEqual(self.task.stages['award_badges']['count'], 1)
+
+
+class timing_stage(TestCase):
+
+    def test(self):
+        with timing.record() as recorder:
+            for _ in range(2):
+                with timing.stage('parse_demo'):
+                    pass
+            with timing.record() as nested_recorder:
+                with timing.stage('fetch_sharecodes'):
+                    pass
+            timing.merge(nested_recorder.stages)
+        self.assertEqual(sorted(recorder.stages.keys()), ['fetch_sharecodes', 'parse_demo'])
+        self.assertEqual(recorder.stages['parse_demo']['count'], 2)
+        self.assertEqual(recorder.stages['fetch_sharecodes']['count'], 1)
+        self.assertGreaterEqual(recorder.stages['parse_demo']['duration'], 0)
+
+    def test_without_recorder(self):
+        with timing.stage('parse_demo'):
+            pass
+        self.assertIsNone(timing.get_recorder())
+
+    def test_get_percentiles(self):
+        percentiles = timing.get_percentiles(
+            [
+                dict(parse_demo = dict(duration = float(duration), count = 1)) for duration in range(101)
+            ] + [
+                dict(),
+            ]
+        )
+        self.assertEqual(percentiles, dict(parse_demo = [50., 90., 99.]))
+
+
+class UpdateTaskAdmin(TestCase):
+
+    def setUp(self):
+        self.admin = Account.objects.create_superuser('12345678900000001', 'password')
+        self.client.force_login(self.admin)
+        models.UpdateTask.objects.create(
+            account = self.admin,
+            scheduling_timestamp = 0,
+            execution_timestamp = 0,
+            completion_timestamp = 20,
+            stages = dict(parse_demo = dict(duration = 12.34, count = 2)),
+        )
+
+    def test(self):
+        response = self.client.get(reverse('admin:stats_updatetask_changelist'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'parse_demo: 12.3s (2x)')
+        self.assertContains(response, '<td>parse_demo</td>', html = True)
+
+
+class inflight__ingest(TestCase):
+
+    def test(self):
+        started = threading.Event()
+        proceed = threading.Event()
+        pmatch = object()
+
+        def ingest_match():
+            started.set()
+            proceed.wait()
+            return pmatch
+
+        # The first worker ingests the match, the second waits for the result
+        mock__ingest_match = MagicMock(side_effect = ingest_match)
+        results = list()
+        owner = threading.Thread(target = lambda: results.append(inflight.ingest('xxx', mock__ingest_match)))
+        owner.start()
+        started.wait()
+        self.assertEqual([m.sharecode for m in inflight.get_inflight_matches()], ['xxx'])
+        waiter = threading.Thread(target = lambda: results.append(inflight.ingest('xxx', mock__ingest_match)))
+        waiter.start()
+        proceed.set()
+        owner.join()
+        waiter.join()
+
+        mock__ingest_match.assert_called_once()
+        self.assertEqual(results, [pmatch, pmatch])
+        self.assertEqual(inflight.get_inflight_matches(), [])
+
+    def test_error(self):
+        started = threading.Event()
+        proceed = threading.Event()
+
+        def ingest_match():
+            started.set()
+            proceed.wait()
+            raise cs2_client.InvalidDemoError('xxx', 'demo-url')
+
+        errors = list()
+
+        def run():
+            try:
+                inflight.ingest('xxx', ingest_match)
+            except cs2_client.InvalidDemoError as error:
+                errors.append(error)
+
+        owner = threading.Thread(target = run)
+        owner.start()
+        started.wait()
+        waiter = threading.Thread(target = run)
+        waiter.start()
+        proceed.set()
+        owner.join()
+        waiter.join()
+
+        # The error is passed to the waiting worker
+        self.assertEqual(len(errors), 2)
+        self.assertIs(errors[0], errors[1])
+
+
+class inflight__wait(TestCase):
+
+    def test_finished(self):
+        pmatch = models.Match.objects.create(
+            sharecode = 'xxx',
+            timestamp = 0,
+            score_team1 = 12,
+            score_team2 = 13,
+            duration = 1653,
+            map_name = 'de_dust2',
+        )
+        self.assertEqual(inflight.wait('xxx'), pmatch)
+
+    def test_failed(self):
+        with self.assertRaises(RuntimeError):
+            inflight.wait('xxx')
+
+
 class UpdateTask__run(TestCase):
 
     @testsuite.fake_api.patch
@@ -1047,6 +1822,49 @@ class UpdateTask__run(TestCase):
         # Verify that the task was not actually processed
         self.assertEqual(mock_cs2_client_fetch_matches.call_count, 0)
 
+    @patch('cs2_client.fetch_matches')
+    def test_lease_lost(self, mock_cs2_client_fetch_matches):
+        self.account.enabled = False
+        self.account.save()
+        self.task.save()
+        task = models.UpdateTask.claim('worker1', lease_duration = 0, max_attempts = 3)
+        self.assertEqual(task.pk, self.task.pk)
+
+        # Pretend that the lease expired and the task was claimed by another worker
+        models.UpdateTask.claim('worker2', lease_duration = 60, max_attempts = 3)
+
+        # Verify that the stale worker does not overwrite the task
+        task.run(recent_matches = list())
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.lease_owner, 'worker2')
+        self.assertIsNone(self.task.execution_timestamp)
+        self.assertIsNone(self.task.completion_timestamp)
+
+    def test_pending_tasks_kept(self):
+        self.account.enabled = False
+        self.account.save()
+        models.UpdateTask.objects.bulk_create(
+            [
+                models.UpdateTask(
+                    account = self.account,
+                    scheduling_timestamp = self.task.scheduling_timestamp + 1 + idx,
+                    execution_timestamp = self.task.scheduling_timestamp + 1 + idx,
+                    completion_timestamp = self.task.scheduling_timestamp + 1 + idx,
+                )
+                for idx in range(100)
+            ]
+        )
+        pending_task = models.UpdateTask.objects.create(
+            account = self.account,
+            scheduling_timestamp = self.task.scheduling_timestamp - 1,
+        )
+
+        # Verify that only the oldest completed tasks are pruned
+        self.task.run(recent_matches = list())
+        self.assertEqual(models.UpdateTask.objects.filter(completion_timestamp__isnull = False).count(), 100)
+        self.assertTrue(models.UpdateTask.objects.filter(pk = pending_task.pk).exists())
+        self.assertFalse(models.UpdateTask.objects.filter(pk = self.task.pk).exists())
+
     @patch.object(models.settings, 'CSGO_API_ENABLED', True)
     @patch('cs2_client.fetch_matches')
     @patch('stats.models.Match.from_summary')
@@ -1256,6 +2074,47 @@ class GamingSession(TestCase):
         for m in self.matches:
             m.sessions.add(self.session)
 
+        # The summary of the matches is maintained in the database
+        self.session.refresh_from_db()
+
+    def test__match_count(self):
+        self.assertEqual(self.session.match_count, 2)
+
+    def test__no_queries(self):
+        with self.assertNumQueries(0):
+            self.session.started
+            self.session.ended
+            self.session.started_date
+            self.session.started_time
+            self.session.ended_time
+            self.session.started_weekday
+            str(self.session)
+
+    def test__remove_match(self):
+        self.matches[-1].sessions.remove(self.session)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.match_count, 1)
+        self.assertEqual(self.session.ended, 3010)
+
+    def test__clear_matches(self):
+        self.session.matches.clear()
+        self.assertEqual(self.session.match_count, 0)
+        self.assertIsNone(self.session.started)
+        self.assertIsNone(self.session.ended)
+        self.assertEqual(str(self.session), f'Empty Gaming Session ({self.session.pk})')
+
+    def test__delete_match(self):
+        self.matches[0].delete()
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.match_count, 1)
+        self.assertEqual(self.session.started, 3600)
+
+    def test__update_match(self):
+        self.matches[-1].duration = 1000
+        self.matches[-1].save()
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.ended, 4600)
+
     def test__first_match(self):
         self.assertEqual(self.session.first_match, self.matches[0])
 
@@ -1620,6 +2479,8 @@ class GamingSession__close(TestCase):
         )
 
 
+@patch('stats.refresher.request_refresh', new = refresh_synchronously)
+@patch('accounts.models.SteamProfile.update_cached_avatar', new = MagicMock())
 class player(TestCase):
 
     @testsuite.fake_api.patch
@@ -1743,6 +2604,292 @@ class player(TestCase):
             p.save()
         self.test_no_premier()
 
+    def test_average_opponent_ranks(self):
+        for pmatch in self.matches:
+            p = pmatch.get_participation(self.players[1])
+            p.old_rank = 6000
+            p.new_rank = 6200
+            p.save()
+        p = self.matches[1].get_participation(self.players[2])
+        p.new_rank = 4000
+        p.save()
+        participations = [pmatch.get_participation(player) for pmatch in self.matches for player in self.players]
+        with self.assertNumQueries(1):
+            average_opponent_ranks = views._get_average_opponent_ranks(participations)
+        self.assertEqual(average_opponent_ranks[0], 6100)
+        self.assertEqual(average_opponent_ranks[3], 5050)
+        for pidx in (1, 2, 4, 5):
+            self.assertTrue(math.isnan(average_opponent_ranks[pidx]))  # no opponents on team 1 are ranked
+
+    def test_series(self):
+        p = self.matches[1].get_participation(self.players[0])
+        p.deaths = 0
+        p.new_rank = 6000
+        p.save()
+        url = reverse('api_player_series', kwargs = dict(squad = self.squad.uuid, steamid = self.players[0].steamid))
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['timestamps'], [pmatch.timestamp for pmatch in self.matches])
+        self.assertEqual(data['dates'], [pmatch.date_and_time for pmatch in self.matches])
+        self.assertEqual(data['adr'], [120, 120])
+        self.assertEqual(data['kd'], [20 / 15, 21])
+        self.assertEqual(data['player_value'], [math.sqrt(20 / 15 * 1.2), math.sqrt(21 * 1.2)])
+        self.assertEqual(data['rank'], [None, 6000])
+
+        # Test that the time series are revalidated by only querying the membership and the data version
+        with self.assertNumQueries(2):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH = response.headers['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        # Test that the ETag changes when a match participation of the squad members changes
+        p.kills = 25
+        p.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH = response.headers['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['kd'], [20 / 15, 25])
+
+    @testsuite.fake_api.patch
+    def test_series_of_non_member(self):
+        player = SteamProfile.objects.create(steamid = '12345678900000009')
+        url = reverse('api_player_series', kwargs = dict(squad = self.squad.uuid, steamid = player.steamid))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+
+        # Test that the time series of the squad members are not available through other squads
+        squad = Squad.objects.create(name = 'Other Squad', discord_channel_id = 'other')
+        url = reverse('api_player_series', kwargs = dict(squad = squad.uuid, steamid = self.players[0].steamid))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+
+    def test_accounted_period_5000_matches(self):
+        models.Match.objects.bulk_create(
+            [
+                models.Match(
+                    sharecode = f'CSGO-{midx}',
+                    timestamp = midx,
+                    score_team1 = 12,
+                    score_team2 = 13,
+                    duration = 1653,
+                    map_name = 'de_dust2',
+                )
+                for midx in range(5000)
+            ]
+        )
+        models.MatchParticipation.objects.bulk_create(
+            [
+                models.MatchParticipation(
+                    player = self.players[0],
+                    pmatch = pmatch,
+                    team = 1,
+                    result = 'l',
+                    kills = 20,
+                    assists = 10,
+                    deaths = 15,
+                    score = 30,
+                    mvps = 5,
+                    headshots = 15,
+                    adr = 120,
+                )
+                for pmatch in models.Match.objects.filter(sharecode__startswith = 'CSGO-')
+            ]
+        )
+        participations = models.MatchParticipation.objects.filter(
+            player = self.players[0],
+        ).order_by(
+            'pmatch__timestamp',
+        )
+        models.AccountedParticipation.objects.bulk_create(
+            [
+                models.AccountedParticipation(
+                    squad = self.squad,
+                    player = self.players[0],
+                    session = self.session,
+                    participation = participation,
+                )
+                for participation in participations.filter(pmatch__timestamp__range = (4800, 4899))
+            ]
+        )
+
+        # Test that the accounted period is determined using a single query for the accounted participations
+        participation_pks = list(participations.values_list('pk', flat = True))
+        with self.assertNumQueries(1):
+            period = views._get_accounted_period(
+                participation_pks,
+                models.MatchParticipation.objects.filter(accounted_participations__squad = self.squad),
+            )
+        self.assertEqual(period, (4800, 4900))
+
+    def test_match_badges(self):
+        models.MatchBadge.objects.create(
+            participation = self.matches[0].get_participation(self.players[0]),
+            badge_type_id = 'quad-kill',
+            frequency = 2,
+        )
+        response = self._request()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['badges']['match_badges']['quad-kill']['matches']), 1)
+        self.assertEqual(response.context['badges']['match_badges']['quad-kill']['frequency'], 2)
+        self.assertEqual(response.context['badges']['match_badges']['peach']['matches'], list())
+        self.assertContains(response, 'Quad-kill <span class="badge-frequency">(2&times;)</span>', html = True)
+
+
+class BadgeCount(TestCase):
+
+    @testsuite.fake_api.patch
+    def setUp(self):
+        self.players = [
+            SteamProfile.objects.create(steamid = '12345678900000001'),
+            SteamProfile.objects.create(steamid = '12345678900000002'),
+        ]
+        self.squads = [
+            Squad.objects.create(name = 'Test Squad 1', discord_channel_id = '1'),
+            Squad.objects.create(name = 'Test Squad 2', discord_channel_id = '2'),
+        ]
+        for squad in self.squads:
+            for player in self.players:
+                SquadMembership.objects.create(squad = squad, player = player)
+        self.match = models.Match.objects.create(
+            timestamp = int(time.time()),
+            score_team1 = 12,
+            score_team2 = 13,
+            duration = 1653,
+            map_name = 'de_dust2',
+        )
+        self.participations = [
+            models.MatchParticipation.objects.create(
+                player = player,
+                pmatch = self.match,
+                team = 1,
+                result = 'l',
+                kills = 20,
+                assists = 10,
+                deaths = 15,
+                score = 30,
+                mvps = 5,
+                headshots = 15,
+                adr = 120,
+            )
+            for player in self.players
+        ]
+
+    def test_match_badges(self):
+        models.MatchBadge.objects.create(
+            participation = self.participations[0],
+            badge_type_id = 'quad-kill',
+            frequency = 2,
+        )
+        badge = models.MatchBadge.objects.create(participation = self.participations[0], badge_type_id = 'peach')
+        for squad in self.squads:
+            self.assertEqual(
+                models.BadgeCount.summarize(squad, self.players[0]),
+                {
+                    'quad-kill': dict(count = 1, frequency = 2),
+                    'peach': dict(count = 1, frequency = 1),
+                },
+            )
+        self.assertEqual(models.BadgeCount.summarize(self.squads[0], self.players[1]), dict())
+
+        # Test deletion of a badge
+        badge.delete()
+        self.assertEqual(
+            models.BadgeCount.summarize(self.squads[0], self.players[0]),
+            {
+                'quad-kill': dict(count = 1, frequency = 2),
+            },
+        )
+
+    def test_match_badges_recounted(self):
+        models.MatchBadge.objects.create(participation = self.participations[0], badge_type_id = 'peach')
+        models.BadgeCount.update_match_badges(self.players[0].pk, 'peach')
+        self.assertEqual(models.BadgeCount.objects.filter(player = self.players[0], slug = 'peach').count(), 1)
+        self.assertEqual(
+            models.BadgeCount.summarize(self.squads[0], self.players[0]),
+            {
+                'peach': dict(count = 1, frequency = 1),
+            },
+        )
+
+    def test_unique(self):
+        models.BadgeCount.objects.create(player = self.players[0], squad = None, slug = 'peach')
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                models.BadgeCount.objects.create(player = self.players[0], squad = None, slug = 'peach')
+        models.BadgeCount.objects.create(player = self.players[0], squad = self.squads[0], slug = 'rising-star')
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                models.BadgeCount.objects.create(player = self.players[0], squad = self.squads[0], slug = 'rising-star')
+
+    def test_potw_badges(self):
+        badge = models.PlayerOfTheWeek.objects.create(
+            timestamp = int(time.time()),
+            player1 = self.players[0],
+            player2 = self.players[1],
+            squad = self.squads[0],
+            mode = 'k/d',
+        )
+        for squad in self.squads:
+            self.assertEqual(
+                models.BadgeCount.summarize(squad, self.players[0]),
+                {
+                    'potw-1': dict(count = 1, frequency = 1),
+                },
+            )
+        self.assertEqual(
+            models.BadgeCount.summarize(self.squads[0], self.players[1]),
+            {
+                'potw-2': dict(count = 1, frequency = 1),
+            },
+        )
+
+        # Test update of the badge
+        badge.player1 = self.players[1]
+        badge.player2 = None
+        badge.save()
+        self.assertEqual(models.BadgeCount.summarize(self.squads[0], self.players[0]), dict())
+        self.assertEqual(
+            models.BadgeCount.summarize(self.squads[0], self.players[1]),
+            {
+                'potw-1': dict(count = 1, frequency = 1),
+            },
+        )
+
+    def test_rising_star_badges(self):
+        models.GamingSession.objects.create(squad = self.squads[0], rising_star = self.players[0])
+        models.GamingSession.objects.create(squad = self.squads[0], rising_star = self.players[0])
+        self.assertEqual(
+            models.BadgeCount.summarize(self.squads[0], self.players[0]),
+            {
+                'rising-star': dict(count = 2, frequency = 2),
+            },
+        )
+        self.assertEqual(models.BadgeCount.summarize(self.squads[1], self.players[0]), dict())
+
+    def test_get_badges(self):
+        models.MatchBadge.objects.create(
+            participation = self.participations[0],
+            badge_type_id = 'quad-kill',
+            frequency = 2,
+        )
+        models.GamingSession.objects.create(squad = self.squads[0], rising_star = self.players[0])
+        models.PlayerOfTheWeek.objects.create(
+            timestamp = int(time.time()),
+            player1 = self.players[0],
+            squad = self.squads[0],
+            mode = 'k/d',
+        )
+        with self.assertNumQueries(1):
+            badges = views.get_badges(self.squads[0], self.players[0])
+        self.assertEqual(
+            badges,
+            [
+                dict(slug = 'potw-1', count = 1),
+                dict(slug = 'rising-star', count = 1),
+                dict(slug = 'quad-kill', count = 1),
+            ],
+        )
+
 
 class templatetags(TestCase):
 
@@ -1834,3 +2981,343 @@ class Features(TestCase):
             player = self.player1,
         )
         self.assertEqual(features.Features.player_value(ctx), math.sqrt(120 * 20 / 100))
+
+
+def _participation_effect_reference(ctx, min_datapoints = 2):
+    """
+    Reference implementation of the participation effect (one query per count).
+    """
+    victories_with_participation = ctx.match_participations_of_player.filter(result = 'w').count()
+    matches_with_participation   = ctx.match_participations_of_player.exclude(result = 't').count()
+    matches_without_participation_qs = ctx.match_participations_universe.values('pmatch', 'result').exclude(
+        pmatch__in = ctx.match_participations_of_player.values_list('pmatch', flat = True)
+    ).exclude(result = 't').order_by('pmatch').distinct()
+    matches_without_participation    = matches_without_participation_qs.count()
+    if matches_with_participation < min_datapoints or matches_without_participation < min_datapoints:
+        return None
+    else:
+        victories_without_participation = matches_without_participation_qs.filter(result = 'w').count()
+        victory_chance_with_participation    = victories_with_participation    / matches_with_participation
+        victory_chance_without_participation = victories_without_participation / matches_without_participation
+        expected_causal_effect = victory_chance_with_participation - victory_chance_without_participation
+        return (1 + expected_causal_effect) / 2
+
+
+class ParticipationEffect(TestCase):
+
+    @classmethod
+    @testsuite.fake_api.patch
+    def setUpTestData(cls):
+        cls.players = [SteamProfile.objects.create(steamid = f'1234567890000000{pidx}') for pidx in range(5)]
+        cls.squad = Squad.objects.create(name = 'Test Squad')
+        for player in cls.players:
+            SquadMembership.objects.create(squad = cls.squad, player = player)
+
+        # Create a synthetic match history, where each squad member participates in a random subset of the matches
+        rng = random.Random(0)
+        models.Match.objects.bulk_create(
+            [
+                models.Match(
+                    sharecode = f'xxx-{midx}',
+                    timestamp = midx * 3600,
+                    score_team1 = rng.randint(10, 13),
+                    score_team2 = rng.randint(10, 13),
+                    duration = 1653,
+                    map_name = 'de_dust2',
+                )
+                for midx in range(2000)
+            ]
+        )
+        participations = list()
+        for pmatch in models.Match.objects.all():
+            for player in cls.players:
+                if rng.random() < 0.5:
+                    continue
+                team = rng.randint(1, 2)
+                participations.append(
+                    models.MatchParticipation(
+                        player = player,
+                        pmatch = pmatch,
+                        team = team,
+                        result = models.get_match_result(team - 1, (pmatch.score_team1, pmatch.score_team2)),
+                        kills = 20,
+                        assists = 10,
+                        deaths = 15,
+                        score = 30,
+                        mvps = 5,
+                        headshots = 15,
+                        adr = 120,
+                    )
+                )
+        models.MatchParticipation.objects.bulk_create(participations)
+
+    def _get_feature_context(self, player):
+        return features.FeatureContext(self.squad.match_participations(), player)
+
+    def test(self):
+        for player in self.players:
+            ctx = self._get_feature_context(player)
+            with self.assertNumQueries(1):
+                actual = features.Features.participation_effect(ctx)
+            self.assertIsNotNone(actual)
+            self.assertAlmostEqual(actual, _participation_effect_reference(ctx))
+
+    def test_insufficient_data(self):
+        ctx = features.FeatureContext(self.squad.match_participations(pmatch__timestamp = 0), self.players[0])
+        self.assertEqual(features.Features.participation_effect(ctx), _participation_effect_reference(ctx))
+
+    def test_query_count(self):
+        ctx = self._get_feature_context(self.players[0])
+        with CaptureQueriesContext(connection) as reference_queries:
+            _participation_effect_reference(ctx)
+        with self.assertNumQueries(1):
+            features.Features.participation_effect(ctx)
+        self.assertGreater(len(reference_queries), 1)
+
+
+class RollingAggregate__update(TestCase):
+
+    @testsuite.fake_api.patch
+    def setUp(self):
+        rng = random.Random(0)
+        self.players = [SteamProfile.objects.create(steamid = f'1234567890000000{pidx + 1}') for pidx in range(3)]
+        self.squad = Squad.objects.create(name = 'Test Squad', discord_channel_id = '')
+        for player in self.players:
+            SquadMembership.objects.create(squad = self.squad, player = player)
+        self.sessions = list()
+        for days_ago in (20, 10, 5):
+            session = models.GamingSession.objects.create(squad = self.squad, is_closed = True)
+            for midx in range(3):
+                pmatch = models.Match.objects.create(
+                    sharecode = f'xxx-{days_ago}-{midx}',
+                    timestamp = int(time.time()) - 60 * 60 * 24 * days_ago + midx * 3600,
+                    score_team1 = rng.randint(10, 13),
+                    score_team2 = rng.randint(10, 13),
+                    duration = 1653,
+                    map_name = 'de_dust2',
+                )
+                pmatch.sessions.add(session)
+                for player in self.players[:2 + midx % 2]:
+                    team = rng.randint(1, 2)
+                    models.MatchParticipation.objects.create(
+                        player = player,
+                        pmatch = pmatch,
+                        team = team,
+                        result = models.get_match_result(team - 1, (pmatch.score_team1, pmatch.score_team2)),
+                        kills = rng.randint(0, 30),
+                        assists = rng.randint(0, 10),
+                        deaths = rng.randint(0, 20),
+                        score = 30,
+                        mvps = 5,
+                        headshots = 0,
+                        adr = rng.uniform(20, 150),
+                    )
+            self.sessions.append(session)
+
+    def assert_stats_equal_to_features(self):
+        self.squad.update_stats()
+        for m in self.squad.memberships.all():
+            ctx = features.FeatureContext(m.accounted_match_participations, m.player)
+            for feature in features.Features.all:
+                expected = feature(ctx)
+                if expected is None:
+                    self.assertIsNone(m.stats[feature.slug])
+                else:
+                    self.assertAlmostEqual(m.stats[feature.slug], expected)
+
+    def test(self):
+        self.assert_stats_equal_to_features()
+        self.assertEqual(len(models.SessionAggregate.objects.all()), 9)
+
+        # Verify that the running aggregates are reused
+        m = self.squad.memberships.get(player = self.players[0])
+        with self.assertNumQueries(2):
+            models.RollingAggregate.update(m)
+
+    def test_session_expired(self):
+        self.assert_stats_equal_to_features()
+        for pmatch in self.sessions[0].matches.all():
+            pmatch.timestamp -= 60 * 60 * 24 * 14
+            pmatch.save()
+        self.assert_stats_equal_to_features()
+        m = self.squad.memberships.get(player = self.players[0])
+        self.assertEqual(m.rolling_aggregate.sessions, [self.sessions[1].pk, self.sessions[2].pk])
+
+    def test_accounted_participations(self):
+        self.squad.update_stats()
+        m = self.squad.memberships.get(player = self.players[0])
+        self.assertEqual(len(m.accounted_match_participations), 21)
+
+        # Verify that the participations expire with the session, when refreshed
+        for pmatch in self.sessions[0].matches.all():
+            pmatch.timestamp -= 60 * 60 * 24 * 14
+            pmatch.save()
+        self.assertEqual(len(m.accounted_match_participations), 21)
+        call_command('refresh_accounted_participations')
+        self.assertEqual(len(m.accounted_match_participations), 14)
+        self.assertFalse(m.accounted_match_participations.filter(pmatch__sessions = self.sessions[0]).exists())
+
+    @testsuite.fake_api.patch
+    def test_accounted_participations_member_added(self):
+        player = SteamProfile.objects.create(steamid = '12345678900000004')
+        models.MatchParticipation.objects.create(
+            player = player,
+            pmatch = self.sessions[2].matches.first(),
+            team = 1,
+            result = 'w',
+            kills = 20,
+            assists = 10,
+            deaths = 15,
+            score = 30,
+            mvps = 5,
+            headshots = 15,
+            adr = 120,
+        )
+        self.squad.update_stats()
+
+        # Verify that the participations of the new member are accounted
+        m = SquadMembership.objects.create(squad = self.squad, player = player)
+        self.squad.update_stats()
+        self.assertEqual(m.accounted_match_participations.filter(player = player).count(), 1)
+        self.assert_stats_equal_to_features()
+
+    def test_accounted_participations_member_removed(self):
+        self.squad.update_stats()
+        self.squad.memberships.get(player = self.players[2]).delete()
+        self.assertFalse(models.AccountedParticipation.objects.filter(player = self.players[2]).exists())
+        self.squad.update_stats()
+        self.assertFalse(models.AccountedParticipation.objects.filter(player = self.players[2]).exists())
+        self.assert_stats_equal_to_features()
+
+    def test_accounted_participations_refreshed_concurrently(self):
+        select_for_update = models.Squad.objects.select_for_update
+
+        # Pretend that the accounted participations are refreshed concurrently, while waiting for the lock
+        def refresh_concurrently():
+            with patch.object(models.Squad.objects, 'select_for_update', side_effect = select_for_update):
+                models.AccountedParticipation.refresh(self.squad)
+            return select_for_update()
+
+        with patch.object(models.Squad.objects, 'select_for_update', side_effect = refresh_concurrently) as lock:
+            models.AccountedParticipation.refresh(self.squad)
+        lock.assert_called_once()
+        m = self.squad.memberships.get(player = self.players[0])
+        self.assertEqual(len(m.accounted_match_participations), 21)
+
+    def test_squad_buddy_performances_read_only(self):
+        m = self.squad.memberships.get(player = self.players[0])
+        self.assertEqual(m.squad_buddy_performances, dict())
+        self.assertFalse(models.SessionAggregate.objects.exists())
+        self.assertFalse(models.RollingAggregate.objects.exists())
+
+    def test_session_aggregates_computed_concurrently(self):
+        session_aggregates = models.SessionAggregate.compute(self.sessions[0])
+
+        # Pretend that the partial aggregates were replaced concurrently
+        with patch.object(models.SessionAggregate.objects, 'bulk_create', side_effect = IntegrityError):
+            actual = models.SessionAggregate.compute(self.sessions[0])
+        self.assertEqual(
+            sorted(session_aggregate.player_id for session_aggregate in actual),
+            sorted(session_aggregate.player_id for session_aggregate in session_aggregates),
+        )
+
+    def test_participation_changed(self):
+        self.assert_stats_equal_to_features()
+        mp = models.MatchParticipation.objects.filter(pmatch__sessions = self.sessions[1]).first()
+        mp.adr = 500
+        mp.save()
+        self.assert_stats_equal_to_features()
+
+    def test_squad_buddy_performances(self):
+        self.squad.update_stats()
+        for m in self.squad.memberships.all():
+            expected = dict()
+            participations = m.accounted_match_participations
+            for buddy_membership in self.squad.memberships.exclude(pk = m.pk):
+                buddy_matches = buddy_membership.player.matches()
+                pv_with_buddy = features.Features.player_value(
+                    features.FeatureContext(participations.filter(pmatch__in = buddy_matches), m.player)
+                )
+                pv_without_buddy = features.Features.player_value(
+                    features.FeatureContext(participations.exclude(pmatch__in = buddy_matches), m.player)
+                )
+                if pv_with_buddy is not None and pv_without_buddy is not None:
+                    expected[buddy_membership.player] = pv_with_buddy / pv_without_buddy
+            actual = m.squad_buddy_performances
+            self.assertEqual(actual.keys(), expected.keys())
+            for buddy in expected.keys():
+                self.assertAlmostEqual(actual[buddy], expected[buddy])
+
+
+class ColumnarFeatureContext(TestCase):
+
+    @testsuite.fake_api.patch
+    def setUp(self):
+        rng = random.Random(0)
+        self.players = [SteamProfile.objects.create(steamid = f'1234567890000000{pidx + 1}') for pidx in range(3)]
+        self.squad = Squad.objects.create(name = 'Test Squad', discord_channel_id = '')
+        for player in self.players:
+            SquadMembership.objects.create(squad = self.squad, player = player)
+        models.MatchBadgeType.objects.get_or_create(slug = 'peach', defaults = dict(name = 'Peach Price'))
+        for midx in range(20):
+            pmatch = models.Match.objects.create(
+                sharecode = f'xxx-{midx}',
+                timestamp = midx * 3600,
+                score_team1 = rng.randint(10, 13),
+                score_team2 = rng.randint(10, 13),
+                duration = 1653,
+                map_name = 'de_dust2',
+                mtype = rng.choice(['Premier', 'Competitive']),
+            )
+            for player in self.players:
+                if rng.random() < 0.3:
+                    continue
+                team = rng.randint(1, 2)
+                kills = rng.randint(0, 30)
+                participation = models.MatchParticipation.objects.create(
+                    player = player,
+                    pmatch = pmatch,
+                    team = team,
+                    result = models.get_match_result(team - 1, (pmatch.score_team1, pmatch.score_team2)),
+                    kills = kills,
+                    assists = rng.randint(0, 10),
+                    deaths = rng.randint(0, 20),
+                    score = 30,
+                    mvps = 5,
+                    headshots = rng.randint(0, kills),
+                    adr = rng.uniform(20, 150),
+                    new_rank = rng.choice([None, 10000, 15000]),
+                )
+                if rng.random() < 0.2:
+                    models.MatchBadge.objects.create(participation = participation, badge_type_id = 'peach')
+
+    def test(self):
+        with self.assertNumQueries(1):
+            ctx = features.ColumnarFeatureContext(self.squad.match_participations(), self.players[0])
+        for player in self.players:
+            expected_ctx = features.FeatureContext(self.squad.match_participations(), player)
+            for feature in features.Features.all:
+                with self.subTest(player = player.steamid, feature = feature.slug):
+                    with self.assertNumQueries(0):
+                        actual = feature(ctx.for_player(player))
+                    expected = feature(expected_ctx)
+                    if expected is None:
+                        self.assertIsNone(actual)
+                    else:
+                        self.assertAlmostEqual(actual, expected)
+
+    def test_filter(self):
+        ctx = features.ColumnarFeatureContext(self.squad.match_participations(), self.players[0])
+        expected_ctx = features.FeatureContext(
+            self.squad.match_participations(pmatch__timestamp__lt = 10 * 3600),
+            self.players[0],
+        )
+        self.assertAlmostEqual(
+            features.Features.player_value(ctx.filter(lambda mp: mp['timestamp'] < 10 * 3600)),
+            features.Features.player_value(expected_ctx),
+        )
+
+    def test_empty(self):
+        ctx = features.ColumnarFeatureContext(models.MatchParticipation.objects.none(), self.players[0])
+        for feature in features.Features.all:
+            self.assertIsNone(feature(ctx))
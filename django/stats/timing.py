@@ -0,0 +1,107 @@
+"""
+Instrumentation of the stages of an update (e.g., fetching the sharecodes, parsing the demos, or awarding the badges).
+
+The durations and counts of the stages are recorded by the recorder which is active for the current thread (see
+:func:`record`). Stages which are run without an active recorder are not recorded.
+"""
+import contextlib
+import threading
+import time
+
+import numpy as np
+from cs2pb_typing import (
+    Dict,
+    Iterator,
+    List,
+    Optional,
+)
+
+PERCENTILES = (50, 90, 99)
+
+recorders = threading.local()
+
+
+class StageRecorder:
+    """
+    Records the durations (in seconds) and counts of stages.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, Dict[str, float]] = dict()
+
+    def add(self, name: str, duration: float, count: int = 1) -> None:
+        stage = self.stages.setdefault(name, dict(duration = 0., count = 0))
+        stage['duration'] += duration
+        stage['count'] += count
+
+    def merge(self, stages: Dict[str, Dict[str, float]]) -> None:
+        """
+        Merge the stages recorded by another recorder (e.g., in a subprocess).
+        """
+        for name, stage in stages.items():
+            self.add(name, stage['duration'], stage['count'])
+
+
+def get_recorder() -> Optional[StageRecorder]:
+    """
+    Get the recorder which is active for the current thread (or None).
+    """
+    return getattr(recorders, 'active', None)
+
+
+@contextlib.contextmanager
+def record() -> Iterator[StageRecorder]:
+    """
+    Activate a new recorder for the current thread (the previously active recorder is restored afterwards).
+    """
+    recorder = StageRecorder()
+    previous_recorder = get_recorder()
+    recorders.active = recorder
+    try:
+        yield recorder
+    finally:
+        recorders.active = previous_recorder
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Record the duration of a stage (if a recorder is active for the current thread).
+    """
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder = get_recorder()
+        if recorder is not None:
+            recorder.add(name, time.perf_counter() - t0)
+
+
+def merge(stages: Dict[str, Dict[str, float]]) -> None:
+    """
+    Merge stages into the recorder which is active for the current thread (if any).
+    """
+    recorder = get_recorder()
+    if recorder is not None:
+        recorder.merge(stages)
+
+
+def format_stages(stages: Dict[str, Dict[str, float]]) -> str:
+    """
+    Format stages for humans, e.g. ``parse_demo: 12.3s (2x), award_badges: 0.4s (2x)``.
+    """
+    return ', '.join(f'{name}: {stage["duration"]:.1f}s ({stage["count"]}x)' for name, stage in stages.items())
+
+
+def get_percentiles(stages_list: List[Dict[str, Dict[str, float]]]) -> Dict[str, List[float]]:
+    """
+    Get the :data:`PERCENTILES` of the durations of each stage, across a list of recorded stages (e.g., of multiple
+    update tasks). Tasks which did not run a stage are not taken into account for that stage.
+    """
+    durations: Dict[str, List[float]] = dict()
+    for stages in stages_list:
+        for name, stage in stages.items():
+            durations.setdefault(name, list()).append(stage['duration'])
+    return {
+        name: np.percentile(durations[name], PERCENTILES).tolist() for name in sorted(durations.keys())
+    }
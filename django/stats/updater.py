@@ -1,52 +1,175 @@
+"""
+The updater runs the pending :class:`~stats.models.UpdateTask` objects, using the database table as a job queue.
+
+The updater is run as a dedicated process (see the ``run_updater`` management command), which runs a pool of worker
+threads. Each worker claims a pending task by acquiring its lease, and keeps the lease alive by a heartbeat while the
+task is running. If the updater crashes, the leases of the tasks expire, so that the tasks are picked up again later.
+Multiple updater processes can be run concurrently.
+"""
+import collections
 import datetime
 import logging
+import os
+import socket
 import threading
-import time
+
+from cs2pb_typing import Optional
+
+from django.db import (
+    IntegrityError,
+    connection,
+    transaction,
+)
+
+from . import timing
 
 log = logging.getLogger(__name__)
 
-update_thread = None
-update_event  = threading.Event()
+LEASE_DURATION = 5 * 60  # 5 minutes
 
+HEARTBEAT_INTERVAL = 60  # 1 minute
 
-def run_update_loop():
-    try:
-        while True:
-            update_event.wait()
-            update_event.clear()
+RETRY_DELAY = 5 * 60  # 5 minutes
 
-            # Wait for a while to gather more tasks into a single run, to exploit more `recent_matches`
-            time.sleep(1)
+MAX_ATTEMPTS = 3
 
-            run_pending_tasks()
-    finally:
-        global update_thread
-        update_thread = None
+POLL_INTERVAL = 5  # 5 seconds
+
+RECENT_MATCHES_MAXLEN = 100
+
+
+def get_worker_name(worker_idx: int) -> str:
+    """
+    Get the name of a worker, which is unique across hosts and processes.
+    """
+    return f'{socket.gethostname()}:{os.getpid()}:{worker_idx}'
+
+
+def run_task(task, recent_matches) -> bool:
+    """
+    Run a claimed task, while renewing its lease periodically, and release the lease afterwards.
+
+    Returns True if the task was run successfully. Failed tasks are retried after :data:`RETRY_DELAY` seconds, unless
+    they already have been attempted :data:`MAX_ATTEMPTS` times (then they are given up and marked as completed, so
+    that the account is polled again by the scheduler).
+    """
+    stop_heartbeat = threading.Event()
+
+    def run_heartbeat():
+        try:
+            while not stop_heartbeat.wait(HEARTBEAT_INTERVAL):
+                if not task.renew_lease(LEASE_DURATION):
+                    log.warning(f'Worker {task.lease_owner} lost the lease of task {task.pk}')
+        finally:
+            connection.close()
 
+    heartbeat_thread = threading.Thread(target = run_heartbeat, daemon = True)
+    heartbeat_thread.start()
+    with timing.record() as recorder:
+        try:
+            task.run(recent_matches)
+            success = True
+        except:  # noqa: E722
+            log.critical(f'Failed to update stats.', exc_info = True)
+            success = False
+        finally:
+            stop_heartbeat.set()
+            heartbeat_thread.join()
+    log.info(f'Task {task.pk} stages: {timing.format_stages(recorder.stages) or "None"}')
+    task.save_stages(recorder.stages)
+    give_up = not success and task.attempts >= MAX_ATTEMPTS
+    if give_up:
+        log.error(f'Giving up task {task.pk} after {task.attempts} attempts')
+    task.release(retry_delay = 0 if success else RETRY_DELAY, give_up = give_up)
+    return success
 
-def run_pending_tasks():
+
+def claim_and_run_task(worker: str, recent_matches) -> bool:
+    """
+    Claim a pending task and run it. Returns False if there was no task to be claimed.
+    """
     from stats.models import UpdateTask
-    pending_tasks = UpdateTask.objects.filter(completion_timestamp=None).order_by('-scheduling_timestamp').all()
-    if len(pending_tasks) > 0:
-        log.info('Begin processing %d pending task(s)' % len(pending_tasks))
-        recent_matches = list()
-        for task in pending_tasks:
+    task = UpdateTask.claim(worker, LEASE_DURATION, MAX_ATTEMPTS)
+    if task is None:
+        return False
+    log.info(f'Worker {worker} begins processing task {task.pk} (attempt {task.attempts})')
+    run_task(task, recent_matches)
+    return True
+
+
+def run_pending_tasks(worker: Optional[str] = None) -> int:
+    """
+    Run pending tasks until there are no more tasks to be claimed. Returns the number of tasks which were run.
+    """
+    if worker is None:
+        worker = get_worker_name(0)
+    recent_matches = list()
+    task_count = 0
+    while claim_and_run_task(worker, recent_matches):
+        task_count += 1
+    return task_count
+
+
+def run_worker(worker: str, recent_matches, stop_event: threading.Event) -> None:
+    """
+    Run pending tasks, until the stop event is set. The worker sleeps for :data:`POLL_INTERVAL` seconds whenever there
+    are no pending tasks.
+    """
+    try:
+        while not stop_event.is_set():
             try:
-                task.run(recent_matches)
+                if not claim_and_run_task(worker, recent_matches):
+                    stop_event.wait(POLL_INTERVAL)
             except:  # noqa: E722
-                log.critical(f'Failed to update stats.', exc_info = True)
-        log.info('Finished processing %d pending task(s)' % len(pending_tasks))
+                # Claiming tasks can fail, e.g., if the database is temporarily unavailable
+                log.critical(f'Worker {worker} failed to claim a task.', exc_info = True)
+                connection.close()
+                stop_event.wait(POLL_INTERVAL)
+    finally:
+        connection.close()
+
+
+def run_workers(worker_count: int, stop_event: threading.Event) -> None:
+    """
+    Run a pool of workers, until the stop event is set.
+
+    The workers share the list of recent matches, so that matches played by multiple accounts are fetched only once.
+    """
+    recent_matches = collections.deque(maxlen = RECENT_MATCHES_MAXLEN)
+    workers = [
+        threading.Thread(
+            target = run_worker,
+            args = (get_worker_name(worker_idx), recent_matches, stop_event),
+            daemon = True,
+        )
+        for worker_idx in range(worker_count)
+    ]
+    log.info(f'Starting {worker_count} worker(s)')
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    log.info('All workers stopped')
 
 
 def queue_update_task(account):
-    global update_thread
+    """
+    Queue an update task for an account, unless there already is a queued task for the account (that task is returned
+    then).
+
+    Queueing is atomic, since the database permits at most one queued task per account (a task which has not started
+    executing yet). If another task is queued concurrently, that task is returned instead.
+    """
     from stats.models import UpdateTask
-    task = UpdateTask.objects.create(
-        account = account,
-        scheduling_timestamp = datetime.datetime.timestamp(datetime.datetime.now()),
-    )
-    if update_thread is None:
-        update_thread = threading.Thread(target=run_update_loop, daemon=True)
-        update_thread.start()
-    update_event.set()  # wakeup the thread
-    return task
+    queued_tasks = UpdateTask.objects.filter(account = account, completion_timestamp = None, execution_timestamp = None)
+    task = queued_tasks.first()
+    if task is not None:
+        return task
+    try:
+        with transaction.atomic():
+            return UpdateTask.objects.create(
+                account = account,
+                scheduling_timestamp = datetime.datetime.timestamp(datetime.datetime.now()),
+            )
+    except IntegrityError:
+        return queued_tasks.get()
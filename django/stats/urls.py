@@ -1,6 +1,9 @@
 from django.urls import path
 
-from . import views
+from . import (
+    api,
+    views,
+)
 
 urlpatterns = [
     path('', views.squads, {'squad': None}, name='squads'),
@@ -12,4 +15,7 @@ urlpatterns = [
     path('matches/<int:last_timestamp>', views.matches, name='matches'),
     path('matches/<uuid:squad>/<int:last_timestamp>', views.matches, name='matches'),
     path('csv/<int:matchid>', views.export_csv, name='csv'),
+    path('api/sessions/<uuid:squad>', api.sessions, name='api_sessions'),
+    path('api/matches/<uuid:squad>', api.matches, name='api_matches'),
+    path('api/series/<uuid:squad>/<int:steamid>', api.player_series, name='api_player_series'),
 ]
@@ -1,40 +1,53 @@
+import csv
+import itertools
 import logging
 import numbers
 import warnings
 
 import numpy as np
 from accounts.models import (
-    Account,
     Squad,
     SquadMembership,
     SteamProfile,
 )
 from cs2pb_typing import (
     Dict,
+    Iterable,
     List,
     Optional,
+    Tuple,
 )
 from csgo_app.views import add_globals_to_context
 
 from django.db.models import (
-    Count,
+    Avg,
     F,
-    Max,
+    Prefetch,
+    QuerySet,
+)
+from django.http import (
+    HttpResponseNotFound,
+    StreamingHttpResponse,
 )
-from django.http import HttpResponseNotFound
 from django.shortcuts import (
     redirect,
     render,
 )
 from django.urls import reverse
 
-from . import potw
+from . import (
+    pagecache,
+    potw,
+    refresher,
+)
 from .features import (
     Feature,
     FeatureContext,
     Features,
+    np_divide,
 )
 from .models import (
+    BadgeCount,
     GamingSession,
     Match,
     MatchBadge,
@@ -75,45 +88,40 @@ all_features_expanded = all_features_collapsed + [
 
 
 def get_badges(squad, player, max_badge_count = 6):
-    potw = [
-        len(PlayerOfTheWeek.objects.filter(player1 = player)),
-        len(PlayerOfTheWeek.objects.filter(player2 = player)),
-        len(PlayerOfTheWeek.objects.filter(player3 = player)),
+    badges = [
+        dict(slug = slug, count = badge_count['count'])
+        for slug, badge_count in BadgeCount.summarize(squad, player).items()
     ]
-    badges = list()
-    for place, count in enumerate(potw, start=1):
-        if count > 0:
-            badges.append(dict(slug=f'potw-{place}', count=count))
-    for badge in player.match_badges().all().values(
-        'badge_type'
-    ).annotate(
-        count = Count('badge_type'),
-    ).order_by(
-        'badge_type',
-    ):
-        if badge['count'] > 0:
-            badges.append(
-                dict(
-                    slug = badge['badge_type'],
-                    count = badge['count'],
-                )
-            )
-    rising_star_count = GamingSession.objects.filter(squad = squad, rising_star = player).count()
-    if rising_star_count > 0:
-        badges.append(dict(slug = 'rising-star', count = rising_star_count))
     badges.sort(key = lambda badge: badge_order.index(badge['slug']))
     if len(badges) > 0:
         badges = badges[:max_badge_count]
     return badges
 
 
+def get_max_stats(squad: Squad) -> Dict[str, numbers.Real]:
+    """
+    Get the maximum value of each feature within the squad, which is used for normalization.
+    """
+    max_stats = dict()
+    for stats in squad.memberships.values_list('stats', flat = True):
+        for slug, value in stats.items():
+            if value is not None:
+                max_stats[slug] = max(value, max_stats.get(slug, value))
+    return max_stats
+
+
 def compute_card(
         squad_membership: SquadMembership,
         features: List[Feature],
         orders: List[numbers.Real] = [2, len(all_features_collapsed), np.inf],
         max_badge_count: int = 5,
+        max_stats: Optional[Dict[str, numbers.Real]] = None,
     ):
 
+    # Load the maximum values of the squad for normalization (shared by all cards of the squad, if passed)
+    if max_stats is None:
+        max_stats = get_max_stats(squad_membership.squad)
+
     # Compute the best/worst squad buddy
     if buddy_performances := squad_membership.squad_buddy_performances:
         best_buddy  = max(buddy_performances, key = buddy_performances.get)
@@ -125,16 +133,8 @@ def compute_card(
     def stat(feature):
         value = squad_membership.stats.get(feature.slug, None)
 
-        # Compute the maximum value of the squad for normalization
-        max_value = squad_membership.squad.memberships.values(
-            f'stats__{feature.slug}',
-        ).exclude(
-            **{f'stats__{feature.slug}': None},  # https://stackoverflow.com/a/49956014/1444073
-        ).order_by(
-            f'-stats__{feature.slug}',
-        )[0][
-            f'stats__{feature.slug}'
-        ] if value is not None else None
+        # Fetch the maximum value of the squad for normalization
+        max_value = max_stats.get(feature.slug) if value is not None else None
 
         # Check logics: `max_value` can only be None if `value` is None
         assert value is None or (value is not None and max_value is not None), (feature.slug, value, max_value)
@@ -230,24 +230,37 @@ def squads(request, squad = None, expanded_stats = False):
     else:
         return redirect('login')
 
-    context['squads'] = list()
+    # Render the last computed state, and refresh the stats in the background if they are outdated
+    squad_list = list(squad_list)
     for squad in squad_list:
-        squad.update_stats()
+        if refresher.is_stale(squad):
+            refresher.request_refresh(squad)
 
-        for account in Account.objects.filter(
-            steam_profile__in = squad.memberships.values_list('player__pk', flat = True)
-        ):
-            account.update_matches()
+    # Serve the page from the cache, unless the data of any of the squads has changed since it was rendered (the time
+    # of the last refresh is shown on the page, so it is part of the cache key as well)
+    add_globals_to_context(context)
+    cache_key = pagecache.get_page_cache_key(
+        request,
+        'squads',
+        squad_list,
+        expanded_stats,
+        *(squad.stats_timestamp for squad in squad_list),
+        context.get('version'),
+        context.get('error'),
+    )
+    if (response := pagecache.get_cached_page(cache_key)) is not None:
+        return response
 
-        for squad_membership in squad.memberships.all():
-            squad_membership.player.update_cached_avatar()
+    context['squads'] = list()
+    for squad in squad_list:
 
-        PlayerOfTheWeek.create_missing_badges(squad)
+        max_stats = get_max_stats(squad)
         cards = [
             compute_card(
                 squad_membership,
                 all_features_expanded if expanded_stats else all_features_collapsed,
                 max_badge_count = 6 if expanded_stats else 5,
+                max_stats = max_stats,
             )
             for squad_membership in squad.memberships.exclude(
                 position__isnull = True,
@@ -278,6 +291,7 @@ def squads(request, squad = None, expanded_stats = False):
                 kwargs = dict(squad = squad.uuid),
             ),
             'card_rows': rows,
+            'stats_datetime': squad.stats_datetime,
             'upcoming_player_of_the_week': upcoming_potw,
             'upcoming_player_of_the_week_mode': upcoming_potw_mode,
         }
@@ -298,8 +312,68 @@ def squads(request, squad = None, expanded_stats = False):
         context['squads'].append(squad_data)
 
     context['request'] = request
-    add_globals_to_context(context)
-    return render(request, 'stats/squads.html', context)
+    return pagecache.cache_page(cache_key, render(request, 'stats/squads.html', context))
+
+
+def prefetch_sessions(sessions: QuerySet, members: QuerySet) -> QuerySet:
+    """
+    Load everything which is required to render the sessions list, using a constant number of queries.
+
+    The matches of each session, which the members participated in, are attached as ``matches_list`` (with the
+    participations, players, and badges prefetched), and all matches of each session in chronological order are
+    attached as ``chronological_matches``. The squad members who participated in each session are attached as
+    ``participated_members`` (ordered by their average ADR) and ``participated_member_steamids``.
+    """
+    sessions = sessions.select_related(
+        'squad',
+    ).prefetch_related(
+        Prefetch(
+            'matches',
+            queryset = Match.objects.order_by('timestamp'),
+            to_attr = 'chronological_matches',
+        ),
+        Prefetch(
+            'matches',
+            queryset = Match.objects.filter(
+                matchparticipation__player__in = members,
+            ).distinct().order_by(
+                '-timestamp',
+            ).annotate(
+                result = F('matchparticipation__result'),
+            ).prefetch_related(
+                Prefetch(
+                    'matchparticipation_set',
+                    queryset = MatchParticipation.objects.select_related(
+                        'player',
+                    ).prefetch_related(
+                        Prefetch('badges', queryset = MatchBadge.objects.select_related('badge_type')),
+                    ),
+                ),
+            ),
+            to_attr = 'matches_list',
+        ),
+    )
+
+    # Determine the squad members who participated in the sessions
+    participated_members = {session.pk: list() for session in sessions}
+    for member in MatchParticipation.objects.filter(
+        pmatch__sessions__in = list(participated_members.keys()),
+        player__squad_memberships__squad = F('pmatch__sessions__squad'),
+    ).values(
+        'pmatch__sessions',
+        steamid = F('player__steamid'),
+        avatar_s = F('player__avatar_s'),
+    ).annotate(
+        avg_adr = Avg('adr'),
+    ).order_by(
+        '-avg_adr',
+    ):
+        participated_members[member.pop('pmatch__sessions')].append(member)
+    for session in sessions:
+        session.participated_members = participated_members[session.pk]
+        session.participated_member_steamids = frozenset(member['steamid'] for member in session.participated_members)
+
+    return sessions
 
 
 def matches(request, squad=None, last_timestamp=None):
@@ -307,6 +381,7 @@ def matches(request, squad=None, last_timestamp=None):
 
     if squad is None:
         if getattr(request.user, 'steam_profile', None) is not None:
+            squad_list = list(Squad.objects.filter(memberships__player = request.user.steam_profile))
             members = SteamProfile.objects.filter(
                 squad_memberships__squad__in = request.user.steam_profile.squad_memberships.values_list(
                     'squad__pk',
@@ -318,57 +393,100 @@ def matches(request, squad=None, last_timestamp=None):
     else:
         members = SteamProfile.objects.filter(squad_memberships__squad = squad)
         squad = Squad.objects.get(uuid = squad)
+        squad_list = [squad]
         context['squad'] = squad
 
-    for m in members:
-        if getattr(m, 'account', None) is not None:
-            m.account.update_matches()
+    # Serve the page from the cache, unless the data of any of the squads has changed since it was rendered
+    if last_timestamp is None:
+        add_globals_to_context(context)
+    cache_key = pagecache.get_page_cache_key(
+        request,
+        'matches',
+        squad_list,
+        squad is None,
+        last_timestamp,
+        context.get('version'),
+        context.get('error'),
+    )
+    if (response := pagecache.get_cached_page(cache_key)) is not None:
+        return response
 
     sessions = GamingSession.objects.filter(
         matches__matchparticipation__player__in = members,
-    ).annotate(
-        timestamp = Max('matches__timestamp'),
+    ).distinct().annotate(
+        timestamp = F('started_ts'),
     ).order_by(
         '-timestamp',
     )
     if last_timestamp is not None:
         sessions = sessions.filter(timestamp__lt = last_timestamp)
-    sessions = sessions[:3]
-    for session in sessions:
-        session.matches_list = session.matches.filter(
-            matchparticipation__player__in = members,
-        ).distinct().order_by(
-            '-timestamp',
-        ).annotate(
-            result = F('matchparticipation__result'),
-        )
+    sessions = prefetch_sessions(sessions[:3], members)
     context['sessions'] = sessions
-    context['last_timestamp'] = session.timestamp if sessions.exists() else None
+    context['last_timestamp'] = list(sessions)[-1].timestamp if sessions.exists() else None
 
     if last_timestamp is None:
-        add_globals_to_context(context)
-        return render(request, 'stats/sessions.html', context)
+        response = render(request, 'stats/sessions.html', context)
     else:
-        return render(request, 'stats/sessions-list.html', context)
+        response = render(request, 'stats/sessions-list.html', context)
+    return pagecache.cache_page(cache_key, response)
 
 
-def _get_average_opponent_rank(participation: MatchParticipation) -> float:
+def _get_average_opponent_ranks(participations: List[MatchParticipation]) -> List[float]:
     """
-    Compute the average rank of the opponents in the match.
+    Compute the average rank of the opponents in the match, for each of the match participations.
+
+    The ranks of all participants of the matches are fetched with a single grouped query, and averaged per match and
+    team. The rank of a participant is the average of the old and the new rank, and unranked participants are ignored.
     """
     ranks_data = np.array(
-        participation.pmatch.matchparticipation_set.exclude(
-            team = participation.team,
+        MatchParticipation.objects.filter(
+            pmatch__in = [participation.pmatch_id for participation in participations],
         ).values_list(
+            'pmatch',
+            'team',
             'old_rank',
             'new_rank',
         ),
         dtype = float,
-    )
+    ).reshape(-1, 4)
     with warnings.catch_warnings():
         warnings.filterwarnings('ignore', category = RuntimeWarning)  # Ignore "Mean of empty slice" warning
-        ranks = np.nanmean(ranks_data, axis = 1)
-    return np.nanmean(ranks)
+        ranks = np.nanmean(ranks_data[:, 2:], axis = 1)
+
+    # Sum up the ranks of the ranked participants for each team of each match
+    ranked = ~np.isnan(ranks)
+    teams, team_indices = np.unique(ranks_data[:, :2], axis = 0, return_inverse = True)
+    team_indices = team_indices.reshape(-1)
+    team_rank_sums = np.bincount(team_indices, weights = np.where(ranked, ranks, 0), minlength = len(teams))
+    team_rank_counts = np.bincount(team_indices, weights = ranked, minlength = len(teams))
+    team_average_ranks = {
+        (int(pmatch_pk), int(team)): average_rank
+        for (pmatch_pk, team), average_rank in zip(teams, np_divide(team_rank_sums, team_rank_counts))
+    }
+
+    # The opponents of a participation are the participants of the other team
+    return [
+        float(team_average_ranks.get((participation.pmatch_id, 3 - participation.team), np.nan))
+        for participation in participations
+    ]
+
+
+def _get_accounted_period(
+        participation_pks: Iterable[int],
+        accounted_participations: QuerySet,
+    ) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Get the index of the first accounted participation and the index after the last accounted participation, or None
+    if none of the participations is accounted.
+
+    The accounted participations are fetched with a single query, so that this runs in linear time.
+    """
+    accounted_pks = frozenset(accounted_participations.values_list('pk', flat = True))
+    accounted_indices = [pidx for pidx, pk in enumerate(participation_pks) if pk in accounted_pks]
+    if len(accounted_indices) == 0:
+        return None, None
+    else:
+        return accounted_indices[0], accounted_indices[-1] + 1
 
 
 def _corr_coeff_with_trendline(xfeat, yfeat) -> Dict[str, float]:
@@ -405,14 +523,32 @@ def _corr_coeff_with_trendline(xfeat, yfeat) -> Dict[str, float]:
 
 def player(request, squad, steamid):
     squad = Squad.objects.get(uuid = squad)
-    squad.update_stats()
+
+    # Render the last computed state, and refresh the stats in the background if they are outdated
+    if refresher.is_stale(squad):
+        refresher.request_refresh(squad)
+
+    # Serve the page from the cache, unless the data of the squad has changed since it was rendered
+    context = dict()
+    add_globals_to_context(context)
+    cache_key = pagecache.get_page_cache_key(
+        request,
+        'player',
+        [squad],
+        steamid,
+        context.get('version'),
+        context.get('error'),
+    )
+    if (response := pagecache.get_cached_page(cache_key)) is not None:
+        return response
+
     player = SteamProfile.objects.get(pk = steamid)
     squad_membership = squad.memberships.filter(player = player).first()
 
     # Compute the player card
     card = compute_card(squad_membership, all_features_expanded, max_badge_count = 6)
 
-    # Fetch the player's match participations
+    # Fetch the player's match participations (the time series are loaded asynchronously by the page)
     participations = MatchParticipation.objects.filter(player = player).order_by('pmatch__timestamp')
 
     # Compute stats for the player's Premier participations
@@ -420,11 +556,13 @@ def player(request, squad, steamid):
     if premier_participations.count() > 1:
 
         # Compute the average opponent rank for each of the player's match participation and corresponding player value
-        premier = dict(player_values = list(), average_opponent_ranks = list())
-        for participation in Features.player_value.get_queryset(FeatureContext(premier_participations, player)):
-            average_opponent_rank = _get_average_opponent_rank(participation)
-            premier['average_opponent_ranks'].append(average_opponent_rank)
-            premier['player_values'].append(participation.value)
+        premier_participations = list(
+            Features.player_value.get_queryset(FeatureContext(premier_participations, player))
+        )
+        premier = dict(
+            player_values = [participation.value for participation in premier_participations],
+            average_opponent_ranks = _get_average_opponent_ranks(premier_participations),
+        )
 
         # Compute the trendline
         premier.update(_corr_coeff_with_trendline(premier['average_opponent_ranks'], premier['player_values']))
@@ -438,21 +576,16 @@ def player(request, squad, steamid):
         premier = None
 
     # Determine the start and end of the accounted period
-    accounted_participations = squad_membership.accounted_match_participations
-    accounted_period_start: Optional[int] = None
-    accounted_period_end: Optional[int] = None
-    for pidx, participation in enumerate(participations):
-        if participation.pk in accounted_participations.values_list('pk', flat = True):
-            if accounted_period_start is None:
-                accounted_period_start = pidx
-            accounted_period_end = pidx + 1
+    accounted_period_start, accounted_period_end = _get_accounted_period(
+        participations.values_list('pk', flat = True),
+        squad_membership.accounted_match_participations.filter(player = player),
+    )
 
     # Compose the context for the player page
-    context = dict(
+    context.update(
         squad = squad,
         request = request,
         player = card,
-        participations = participations,
         premier = premier,
         period_start = accounted_period_start,
         period_end = accounted_period_end,
@@ -473,21 +606,55 @@ def player(request, squad, steamid):
         for potw_data in PlayerOfTheWeek.objects.filter(**{f'player{position}': player}):
             context['badges']['potw'].append(dict(potw = potw_data, position = position))
     context['badges']['potw'].sort(key = lambda badge: str(badge['potw']))
+    match_badges = dict()
+    for badge in player.match_badges().select_related('participation__pmatch'):
+        match_badges.setdefault(badge.badge_type_id, list()).append(badge)
+    badge_counts = BadgeCount.summarize(squad, player)
     for badge_type in MatchBadgeType.objects.all():
         context['badges']['match_badges'][badge_type.slug] = dict(
             name = badge_type.name,
-            matches = MatchBadge.objects.filter(
-                participation__player = player,
-                badge_type = badge_type,
-            )
+            matches = match_badges.get(badge_type.slug, list()),
+            frequency = badge_counts.get(badge_type.slug, dict(frequency = 0))['frequency'],
         )
 
-    # Add the global context and render the player page
-    add_globals_to_context(context)
-    return render(request, 'stats/player.html', context)
+    # Render the player page
+    return pagecache.cache_page(cache_key, render(request, 'stats/player.html', context))
+
+
+class Echo:
+    """
+    Pseudo-buffer, which returns the written values instead of storing them (used to stream CSV rows).
+    """
+
+    def write(self, value):
+        return value
+
+
+CSV_CHUNK_SIZE = 2000
+"""
+The number of rows fetched from the database at once, when streaming a CSV export.
+"""
+
+
+def stream_csv(header: List[str], rows: QuerySet) -> StreamingHttpResponse:
+    """
+    Stream the rows of a `values_list` queryset as semicolon-separated CSV.
+
+    The rows are fetched in chunks, so that the memory consumption does not depend on the number of rows.
+    """
+    writer = csv.writer(Echo(), delimiter = ';', lineterminator = '\n')
+    return StreamingHttpResponse(
+        itertools.chain(
+            [writer.writerow(header)],
+            (writer.writerow(row) for row in rows.iterator(chunk_size = CSV_CHUNK_SIZE)),
+        ),
+        content_type = 'text/csv',
+    )
 
 
 def export_csv(request, matchid):
-    from stats.models import MatchParticipation
     participations = MatchParticipation.objects.filter(pmatch__id = matchid)
-    return render(request, 'stats/export.csv', dict(participations = participations), content_type = 'text/csv')
+    return stream_csv(
+        ['Steam ID', 'Team'],
+        participations.values_list('player', 'team'),
+    )
@@ -1,6 +1,11 @@
+import json
+import pathlib
 import re
+import tempfile
 import unittest
+from unittest.mock import patch
 
+import git
 import gitinfo
 
 
@@ -13,6 +18,13 @@ class get_head_info(unittest.TestCase):
         self.assertIsNotNone(re.match(r'^[0-9]{4}-[0-9]{2}-[0-9]{2}$', info['date']))
 
 
+class get_head_stamp(unittest.TestCase):
+
+    def test(self):
+        self.assertEqual(gitinfo.get_head_stamp(), gitinfo.get_head_stamp())
+        self.assertIsNotNone(gitinfo.get_head_stamp()[1])
+
+
 class get_changelog(unittest.TestCase):
 
     def test_merged_pr(self):
@@ -53,3 +65,59 @@ class get_changelog(unittest.TestCase):
             if previous_date is not None:
                 self.assertLessEqual(entry['date'], previous_date)
             previous_date = entry['date']
+
+
+class get_changelog_entries(unittest.TestCase):
+
+    def setUp(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        self.cache_path = pathlib.Path(tempdir.name) / 'changelog.json'
+        patcher = patch.object(gitinfo, 'changelog_cache_path', self.cache_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.repo = git.Repo(str(gitinfo.repo_dir))
+        self.fake_entry = dict(
+            message = 'Fake entry',
+            url = 'https://github.com/kodikit/cs2pb/pull/0',
+            sha = '0' * 40,
+            date = '2024-01-01',
+            nochangelog = False,
+        )
+
+    def write_cache(self, head, entries):
+        with open(self.cache_path, 'w') as fp:
+            json.dump(dict(format = gitinfo.changelog_cache_format, head = head, entries = entries), fp)
+
+    def test_cache_created(self):
+        entries = gitinfo.get_changelog_entries()
+        with open(self.cache_path) as fp:
+            cache = json.load(fp)
+        self.assertEqual(cache['head'], self.repo.head.object.hexsha)
+        self.assertEqual(cache['entries'], entries)
+
+    @patch('gitinfo.parse_changelog_entry')
+    def test_cache_hit(self, mock__parse_changelog_entry):
+        self.write_cache(self.repo.head.object.hexsha, [self.fake_entry])
+        self.assertEqual(gitinfo.get_changelog_entries(), [self.fake_entry])
+        mock__parse_changelog_entry.assert_not_called()
+
+    @patch('gitinfo.parse_changelog_entry', return_value = None)
+    def test_incremental(self, mock__parse_changelog_entry):
+        self.write_cache(self.repo.head.object.parents[0].hexsha, [self.fake_entry])
+        self.assertEqual(gitinfo.get_changelog_entries(), [self.fake_entry])
+        mock__parse_changelog_entry.assert_called_once()
+        with open(self.cache_path) as fp:
+            self.assertEqual(json.load(fp)['head'], self.repo.head.object.hexsha)
+
+    def test_unknown_head(self):
+        self.write_cache('f' * 40, [self.fake_entry])
+        self.assertNotIn(self.fake_entry, gitinfo.get_changelog_entries())
+
+    def test_nochangelog(self):
+        self.write_cache(self.repo.head.object.hexsha, [self.fake_entry | dict(nochangelog = True)])
+        self.assertEqual(gitinfo.get_changelog(), [])
+        self.assertEqual(
+            gitinfo.get_changelog(skip_nochangelog = False),
+            [{key: value for key, value in self.fake_entry.items() if key != 'nochangelog'}],
+        )